@@ -1,20 +1,84 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import serial
-import serial.tools.list_ports
-import json
-import os
+import sys
+import time
+
+from relay_config import CONFIG_FILE, ConfigStore
+from relay_journal import StateJournal
+from relay_log import LogBuffer
+from relay_metrics import RelayMetrics
+from relay_ports import PortWatcher
+from relay_protocol import MAX_RELAY, MIN_RELAY, parse_relay_spec
+from relay_sequence import SEQUENCES_FILE, load_sequences
+from relay_worker import SerialWorker, StatusPoller
 
 class RelayControlApp:
-    CONFIG_FILE = "relay_config.json"
+    CONFIG_FILE = CONFIG_FILE
     DEFAULT_LANGUAGE = "en"
+    DEFAULT_RELAY_COUNT = 8
+    DEFAULT_LOG_MAX_LINES = 1000
+    DEFAULT_LOG_FILE = "relay_control.log"
+    # Лог перерисовывается не чаще, чем раз в LOG_FLUSH_MS миллисекунд
+    LOG_FLUSH_MS = 250
     
     def __init__(self, root):
         self.root = root
         self.root.title("Relay Control")
-        self.serial_port = None
-        self.config = self.load_config()
+        self.connected = False
+        # Порт, который воркер открыл или вот-вот откроет; наблюдатель портов его не проверяет
+        self.active_port = None
+        self.config = ConfigStore(self.CONFIG_FILE)
         self.last_relay_state = {}
+        # Журнал подтвержденных состояний, чтобы после перезапуска индикаторы не были серыми
+        journal_file = self.config.get("state_journal")
+        self.journal = StateJournal(journal_file) if journal_file else None
+        # Задержки последней команды: обмен с портом и доставка результата в UI
+        self.last_command_latency = None
+        self.last_ui_latency = None
+        
+        # Лог ограничен по числу строк, старые строки уходят в файл
+        self.log_buffer = LogBuffer(self.config.get("log_max_lines", self.DEFAULT_LOG_MAX_LINES),
+                                    self.config.get("log_file", self.DEFAULT_LOG_FILE))
+        self.log_flush_scheduled = False
+        
+        # Запись трафика в файл для отладки и воспроизведения
+        capture_file = self.config.get("capture_file")
+        self.capture = None
+        if capture_file:
+            from relay_capture import CaptureWriter
+            
+            self.capture = CaptureWriter(capture_file)
+        
+        # Счетчики и задержки команд, по желанию доступные по HTTP и в файле
+        self.metrics = RelayMetrics()
+        self.metrics_export = None
+        if self.config.get("metrics_http_port"):
+            try:
+                self.metrics.serve(self.config["metrics_http_port"])
+            except OSError:
+                pass
+        if self.config.get("metrics_file"):
+            self.metrics_export = self.metrics.start_file_export(self.config["metrics_file"])
+        self.stats_window = None
+        self.dashboard = None
+        
+        # Список портов ведется в фоне, UI и переподключение читают его из кэша
+        self.port_watcher = PortWatcher(self.on_ports_changed, self.config.get("port_scan_interval", 1.0),
+                                        in_use=lambda device: device == self.active_port)
+        
+        # Весь ввод-вывод с портом выполняется в отдельном потоке; если задан daemon_url,
+        # порт принадлежит фоновому сервису, а GUI работает как один из его клиентов
+        if self.config.get("daemon_url"):
+            from relay_daemon import RemoteWorker
+            
+            self.worker = RemoteWorker(self.config["daemon_url"], self.post_worker_event, self.metrics)
+        else:
+            self.worker = SerialWorker(self.post_worker_event, self.config.get("pipeline_window", 0),
+                                       self.capture, self.metrics,
+                                       self.config.get("reconnect_enabled", True),
+                                       self.config.get("outage_policy", "queue"),
+                                       self.config.get("outage_queue_limit", 100), self.port_watcher)
+        self.worker.start()
         
         # Загрузка языковых ресурсов
         self.languages = self.load_languages()
@@ -25,16 +89,39 @@ class RelayControlApp:
         self.relay_num_var = tk.IntVar(value=self.config.get("last_relay_num", 1))
         self.feedback_var = tk.BooleanVar(value=self.config.get("feedback_enabled", False))
         self.language_var = tk.StringVar(value=self.current_lang)
+        self.relay_list_var = tk.StringVar(value=self.config.get("last_relay_list", "1-8"))
+        self.relay_count = self.config.get("relay_count", self.DEFAULT_RELAY_COUNT)
+        self.poll_var = tk.BooleanVar(value=self.config.get("poll_enabled", False))
+        self.poller = None
+        self.sequence_var = tk.StringVar(value=self.config.get("last_sequence", ""))
         
         # Создание интерфейса
         self.create_widgets()
         
-        # Автоматическое обнаружение COM-портов
-        self.update_ports()
+        # Последние известные состояния показываются сразу, проверка идет после подключения
+        self.last_relay_state.update(self.journal_states(self.port_var.get()))
+        self.update_indicator_for_current_relay()
         
-        # Попытка автоматического подключения
+        # Все, что обращается к портам и файлам, выполняется после первой отрисовки окна:
+        # after_idle срабатывает, когда Tk уже обработал отложенные перерисовки
+        self.root.after_idle(self.root.after, 0, self.finish_startup)
+    
+    def finish_startup(self):
+        """Вторая часть запуска: перечисление портов, последовательности и автоподключение"""
+        # Попытка автоматического подключения; порт помечается занятым до запуска наблюдателя,
+        # чтобы его проверка не открывала порт одновременно с воркером
         if self.config.get("auto_connect", False) and self.port_var.get():
             self.auto_connect()
+        
+        # Автоматическое обнаружение COM-портов
+        self.port_watcher.start()
+        
+        self.load_sequence_list()
+        if self.config.load_error:
+            self.log_message(self.t("config_load_failed", self.config.load_error))
+        
+        if self.poll_var.get():
+            self.start_poller()
     
     def load_languages(self):
         """Загружает языковые ресурсы из конфига"""
@@ -73,7 +160,37 @@ class RelayControlApp:
                 "communication_error": "Communication error: {}",
                 "port_busy": "Port is busy (maybe used by another application)",
                 "auto_connect_failed": "Auto-connect failed: {}",
-                "connection_lost": "Connection lost: {}"
+                "connection_lost": "Connection lost: {}",
+                "reconnecting": "Reconnect attempt {} failed: {}; next in {:.1f} s",
+                "reconnected_to_port": "Reconnected to port {}",
+                "port_renamed": "Port {} reappeared as {}",
+                "relay_module_found": "Relay module found on {}",
+                "relays": "Relays:",
+                "group_on": "Group on",
+                "group_off": "Group off",
+                "invalid_relay_list": "Invalid relay list: {}",
+                "no_response_from": "No response from relays: {}",
+                "late_response": "Late response: {}",
+                "resync_skipped": "Skipped {} bytes while resynchronising",
+                "auto_poll": "Auto-poll status",
+                "statistics": "Statistics",
+                "dashboard": "Dashboard",
+                "stats_port": "Port",
+                "stats_relay": "Relay",
+                "stats_commands": "Commands",
+                "stats_timeouts": "Timeouts",
+                "stats_mean": "Mean, ms",
+                "stats_p50": "p50, ms",
+                "stats_p99": "p99, ms",
+                "stats_port_summary": "{}: connects {}, reconnects {}, connection errors {}, protocol errors {}",
+                "stats_last_command": "Last command: {:.1f} ms round trip, {:.1f} ms until shown",
+                "sequence": "Sequence:",
+                "run_sequence": "Run",
+                "stop_sequence": "Stop",
+                "sequence_started": "Sequence {} started ({} steps)",
+                "sequence_done": "Sequence {}: {}/{} steps, jitter mean {:.3f} ms, max {:.3f} ms, p99 {:.3f} ms",
+                "sequences_load_failed": "Failed to load sequences: {}",
+                "config_load_failed": "Settings could not be read, the file was kept with a .bad suffix: {}"
             },
             "ru": {
                 "app_title": "Управление реле",
@@ -109,12 +226,50 @@ class RelayControlApp:
                 "communication_error": "Ошибка связи: {}",
                 "port_busy": "Порт занят (возможно, используется другим приложением)",
                 "auto_connect_failed": "Автоподключение не удалось: {}",
-                "connection_lost": "Соединение потеряно: {}"
+                "connection_lost": "Соединение потеряно: {}",
+                "reconnecting": "Попытка переподключения {} не удалась: {}; следующая через {:.1f} с",
+                "reconnected_to_port": "Переподключено к порту {}",
+                "port_renamed": "Порт {} появился снова как {}",
+                "relay_module_found": "Найден модуль реле на порту {}",
+                "relays": "Реле:",
+                "group_on": "Включить группу",
+                "group_off": "Выключить группу",
+                "invalid_relay_list": "Некорректный список реле: {}",
+                "no_response_from": "Нет ответа от реле: {}",
+                "late_response": "Запоздавший ответ: {}",
+                "resync_skipped": "Пропущено байт при синхронизации: {}",
+                "auto_poll": "Автоопрос состояния",
+                "statistics": "Статистика",
+                "dashboard": "Панель реле",
+                "stats_port": "Порт",
+                "stats_relay": "Реле",
+                "stats_commands": "Команды",
+                "stats_timeouts": "Таймауты",
+                "stats_mean": "Среднее, мс",
+                "stats_p50": "p50, мс",
+                "stats_p99": "p99, мс",
+                "stats_port_summary": "{}: подключений {}, переподключений {}, ошибок связи {}, ошибок протокола {}",
+                "stats_last_command": "Последняя команда: обмен {:.1f} мс, до отображения {:.1f} мс",
+                "sequence": "Последовательность:",
+                "run_sequence": "Запустить",
+                "stop_sequence": "Остановить",
+                "sequence_started": "Последовательность {} запущена (шагов: {})",
+                "sequence_done": "Последовательность {}: шагов {}/{}, отклонение среднее {:.3f} мс, макс. {:.3f} мс, p99 {:.3f} мс",
+                "sequences_load_failed": "Не удалось загрузить последовательности: {}",
+                "config_load_failed": "Настройки не прочитаны, файл сохранен с расширением .bad: {}"
             }
         }
         
-        if "languages" in self.config:
-            return {**default_languages, **self.config["languages"]}
+        # Переводы из конфига дополняют встроенные, чтобы новые ключи не терялись;
+        # в конфиге остаются только строки, которые отличаются от встроенных
+        overrides = {}
+        for lang, texts in self.config.get("languages", {}).items():
+            builtin = default_languages.get(lang, {})
+            changed = {key: text for key, text in texts.items() if builtin.get(key) != text}
+            if changed:
+                overrides[lang] = changed
+            default_languages[lang] = {**builtin, **changed}
+        self.config.set("languages", overrides)
         return default_languages
     
     def t(self, key, *args):
@@ -123,26 +278,32 @@ class RelayControlApp:
         text = lang_dict.get(key, key)
         return text.format(*args) if args else text
     
-    def load_config(self):
-        if os.path.exists(self.CONFIG_FILE):
-            try:
-                with open(self.CONFIG_FILE, "r", encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-    
     def save_config(self):
-        config = {
+        """Передает текущие настройки в хранилище; запись в файл выполняется отложенно"""
+        self.config.update({
             "last_port": self.port_var.get(),
             "last_relay_num": self.relay_num_var.get(),
+            "last_relay_list": self.relay_list_var.get(),
+            "last_sequence": self.sequence_var.get(),
+            "relay_count": self.relay_count,
+            "pipeline_window": self.worker.pipeline_window,
+            "poll_enabled": self.poll_var.get(),
+            "poll_min_interval": self.config.get("poll_min_interval", 0.25),
+            "poll_max_interval": self.config.get("poll_max_interval", 5.0),
+            "log_max_lines": self.log_buffer.max_lines,
+            "log_file": self.config.get("log_file", self.DEFAULT_LOG_FILE),
+            "capture_file": self.config.get("capture_file", ""),
+            "metrics_http_port": self.config.get("metrics_http_port", 0),
+            "metrics_file": self.config.get("metrics_file", ""),
+            "daemon_url": self.config.get("daemon_url", ""),
+            "port_scan_interval": self.port_watcher.interval,
+            "reconnect_enabled": self.worker.reconnect,
+            "outage_policy": self.worker.outage_policy,
+            "outage_queue_limit": self.worker.outage_limit,
             "feedback_enabled": self.feedback_var.get(),
-            "auto_connect": bool(self.serial_port and self.serial_port.is_open),
-            "language": self.current_lang,
-            "languages": self.languages
-        }
-        with open(self.CONFIG_FILE, "w", encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+            "auto_connect": self.connected,
+            "language": self.current_lang
+        })
     
     def change_language(self, *args):
         """Меняет язык интерфейса"""
@@ -163,7 +324,7 @@ class RelayControlApp:
                 widget.config(text=self.t(widget_info["title_key"]))
         
         # Обновляем кнопку подключения
-        if self.serial_port and self.serial_port.is_open:
+        if self.connected:
             self.connect_button.config(text=self.t("disconnect"))
         else:
             self.connect_button.config(text=self.t("connect"))
@@ -186,12 +347,18 @@ class RelayControlApp:
         self.port_combobox = ttk.Combobox(port_frame, textvariable=self.port_var)
         self.port_combobox.grid(row=0, column=1, padx=5, pady=2)
         
-        refresh_button = ttk.Button(port_frame, command=self.update_ports)
+        refresh_button = ttk.Button(port_frame, command=self.port_watcher.kick)
         refresh_button.grid(row=0, column=2, padx=5, pady=2)
         
         self.connect_button = ttk.Button(port_frame, command=self.connect_port)
         self.connect_button.grid(row=0, column=3, padx=5, pady=2)
         
+        stats_button = ttk.Button(port_frame, command=self.show_statistics)
+        stats_button.grid(row=0, column=4, padx=5, pady=2)
+        
+        dashboard_button = ttk.Button(port_frame, command=self.show_dashboard)
+        dashboard_button.grid(row=0, column=5, padx=5, pady=2)
+        
         # Фрейм для выбора языка
         lang_frame = ttk.LabelFrame(settings_frame)
         lang_frame.grid(row=0, column=1, padx=5, pady=5, sticky="e")
@@ -211,16 +378,21 @@ class RelayControlApp:
         relay_num_label = ttk.Label(control_frame)
         relay_num_label.grid(row=0, column=0, padx=5, pady=2)
         
-        ttk.Spinbox(control_frame, from_=1, to=254, textvariable=self.relay_num_var, width=5,
+        ttk.Spinbox(control_frame, from_=MIN_RELAY, to=MAX_RELAY, textvariable=self.relay_num_var, width=5,
                    command=lambda: self.update_indicator_for_current_relay()).grid(row=0, column=1, padx=5, pady=2)
         
         feedback_check = ttk.Checkbutton(control_frame, variable=self.feedback_var)
         feedback_check.grid(row=0, column=2, padx=5, pady=2)
         
-        # Индикатор состояния
+        poll_check = ttk.Checkbutton(control_frame, variable=self.poll_var, command=self.toggle_poller)
+        poll_check.grid(row=0, column=4, padx=5, pady=2)
+        
+        # Индикатор состояния: элементы создаются один раз, потом меняется только их цвет
         self.state_indicator = tk.Canvas(control_frame, width=30, height=30, bg="gray")
         self.state_indicator.grid(row=0, column=3, padx=5, pady=2)
-        self.update_indicator("unknown")
+        self.indicator_oval = self.state_indicator.create_oval(5, 5, 25, 25, fill="gray", outline="black")
+        self.indicator_text = self.state_indicator.create_text(15, 15, text="●", fill="black")
+        self.indicator_state = "unknown"
         
         on_button = ttk.Button(control_frame, command=lambda: self.send_command("on"))
         on_button.grid(row=1, column=0, padx=5, pady=5)
@@ -231,6 +403,26 @@ class RelayControlApp:
         status_button = ttk.Button(control_frame, command=lambda: self.send_command("status"))
         status_button.grid(row=1, column=3, padx=5, pady=5)
         
+        # Групповые команды: все кадры уходят одной записью в порт
+        relays_label = ttk.Label(control_frame)
+        relays_label.grid(row=2, column=0, padx=5, pady=2)
+        ttk.Entry(control_frame, textvariable=self.relay_list_var, width=12).grid(row=2, column=1, padx=5, pady=2)
+        group_on_button = ttk.Button(control_frame, command=lambda: self.send_batch_command("on"))
+        group_on_button.grid(row=2, column=2, padx=5, pady=5)
+        group_off_button = ttk.Button(control_frame, command=lambda: self.send_batch_command("off"))
+        group_off_button.grid(row=2, column=3, padx=5, pady=5)
+        
+        # Временные последовательности из relay_sequences.json
+        sequence_label = ttk.Label(control_frame)
+        sequence_label.grid(row=3, column=0, padx=5, pady=2)
+        self.sequence_combobox = ttk.Combobox(control_frame, textvariable=self.sequence_var,
+                                              state="readonly", width=16)
+        self.sequence_combobox.grid(row=3, column=1, padx=5, pady=2)
+        run_sequence_button = ttk.Button(control_frame, command=self.run_sequence)
+        run_sequence_button.grid(row=3, column=2, padx=5, pady=5)
+        stop_sequence_button = ttk.Button(control_frame, command=lambda: self.worker.cancel_sequence())
+        stop_sequence_button.grid(row=3, column=3, padx=5, pady=5)
+        
         # Фрейм для лога
         log_frame = ttk.LabelFrame(self.root)
         log_frame.grid(row=2, column=0, padx=10, pady=5, sticky="nsew")
@@ -247,16 +439,25 @@ class RelayControlApp:
             {"widget": port_frame, "title_key": "port_settings"},
             {"widget": port_label, "text_key": "port"},
             {"widget": refresh_button, "text_key": "refresh"},
+            {"widget": stats_button, "text_key": "statistics"},
+            {"widget": dashboard_button, "text_key": "dashboard"},
             {"widget": self.connect_button, "text_key": "connect"},
             {"widget": lang_frame, "title_key": "language"},
             {"widget": lang_label, "text_key": "language"},
             {"widget": control_frame, "title_key": "relay_control"},
             {"widget": relay_num_label, "text_key": "relay_number"},
             {"widget": feedback_check, "text_key": "expect_response"},
+            {"widget": poll_check, "text_key": "auto_poll"},
             {"widget": on_button, "text_key": "on"},
             {"widget": off_button, "text_key": "off"},
             {"widget": toggle_button, "text_key": "toggle"},
             {"widget": status_button, "text_key": "get_status"},
+            {"widget": relays_label, "text_key": "relays"},
+            {"widget": group_on_button, "text_key": "group_on"},
+            {"widget": group_off_button, "text_key": "group_off"},
+            {"widget": sequence_label, "text_key": "sequence"},
+            {"widget": run_sequence_button, "text_key": "run_sequence"},
+            {"widget": stop_sequence_button, "text_key": "stop_sequence"},
             {"widget": log_frame, "title_key": "message_log"}
         ]
         
@@ -264,44 +465,149 @@ class RelayControlApp:
         self.language_var.set(self.current_lang)
         self.update_ui_texts()
     
+    def load_sequence_list(self):
+        """Загружает последовательности из файла рядом с конфигом"""
+        try:
+            self.sequences = load_sequences(SEQUENCES_FILE)
+        except (OSError, ValueError, KeyError) as e:
+            self.sequences = {}
+            self.log_message(self.t("sequences_load_failed", str(e)))
+        names = sorted(self.sequences)
+        self.sequence_combobox['values'] = names
+        if names and self.sequence_var.get() not in self.sequences:
+            self.sequence_var.set(names[0])
+    
+    def run_sequence(self):
+        """Запускает выбранную последовательность в потоке порта"""
+        sequence = self.sequences.get(self.sequence_var.get())
+        if sequence is None:
+            return
+        if not self.connected:
+            messagebox.showerror(self.t("app_title"), self.t("port_not_connected"))
+            return
+        self.worker.run_sequence(sequence)
+    
+    def show_statistics(self):
+        """Открывает окно со счетчиками и задержками по портам и реле"""
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title(self.t("statistics"))
+        columns = ("port", "relay", "commands", "timeouts", "mean", "p50", "p99")
+        self.stats_tree = ttk.Treeview(self.stats_window, columns=columns, show="headings", height=12)
+        for column in columns:
+            self.stats_tree.heading(column, text=self.t("stats_" + column))
+            self.stats_tree.column(column, width=90, anchor="e")
+        self.stats_tree.pack(fill="both", expand=True, padx=5, pady=5)
+        self.stats_summary = ttk.Label(self.stats_window, justify="left")
+        self.stats_summary.pack(fill="x", padx=5, pady=5)
+        self.refresh_statistics()
+    
+    def refresh_statistics(self):
+        """Обновляет окно статистики раз в секунду, пока оно открыто"""
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            self.stats_window = None
+            return
+        
+        def ms(value):
+            return "" if value is None else "{:.1f}".format(value * 1000)
+        
+        rows, port_rows = self.metrics.snapshot()
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for (port, relay), row in sorted(rows.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+            self.stats_tree.insert("", "end", values=(
+                port, relay, row.get("relay_commands_total", 0), row.get("relay_timeouts_total", 0),
+                ms(row.get("mean")), ms(row.get("p50")), ms(row.get("p99"))))
+        summary = []
+        for port, row in sorted(port_rows.items(), key=lambda item: str(item[0])):
+            protocol_errors = sum(value for key, value in row.items()
+                                  if key.startswith("relay_protocol_errors_total"))
+            summary.append(self.t("stats_port_summary", port, row.get("relay_connects_total", 0),
+                                  row.get("relay_reconnects_total", 0),
+                                  row.get("relay_connection_errors_total", 0), protocol_errors))
+        if self.last_command_latency is not None:
+            summary.append(self.t("stats_last_command", self.last_command_latency * 1000,
+                                  self.last_ui_latency * 1000))
+        self.stats_summary.config(text="\n".join(summary))
+        self.stats_window.after(1000, self.refresh_statistics)
+    
+    def show_dashboard(self):
+        """Открывает сетку индикаторов всех реле"""
+        if self.dashboard is not None and self.dashboard.winfo_exists():
+            self.dashboard.winfo_toplevel().lift()
+            return
+        
+        from relay_dashboard import RelayDashboard
+        
+        window = tk.Toplevel(self.root)
+        window.title(self.t("dashboard"))
+        self.dashboard = RelayDashboard(window, on_select=self.select_relay)
+        self.dashboard.pack(fill="both", expand=True, padx=5, pady=5)
+        port = self.worker.port or self.port_var.get()
+        self.dashboard.set_relays(port, set(range(MIN_RELAY, self.relay_count + 1)) | set(self.last_relay_state))
+        for relay_num, state in self.last_relay_state.items():
+            self.dashboard.set_state(port, relay_num, state)
+        self.dashboard.select(port, self.relay_num_var.get())
+    
+    def select_relay(self, port, relay_num):
+        """Делает реле, выбранное на панели, текущим"""
+        self.relay_num_var.set(relay_num)
+        self.update_indicator_for_current_relay()
+    
+    def set_relay_state(self, relay_num, state):
+        """Запоминает состояние реле и передает его на панель, если она открыта"""
+        self.last_relay_state[relay_num] = state
+        if self.dashboard is not None and self.dashboard.winfo_exists():
+            self.dashboard.set_state(self.worker.port or self.port_var.get(), relay_num, state)
+    
     def update_indicator_for_current_relay(self):
         """Обновляет индикатор для текущего выбранного реле"""
         relay_num = self.relay_num_var.get()
         state = self.last_relay_state.get(relay_num, "unknown")
         self.update_indicator(state)
+        if self.dashboard is not None and self.dashboard.winfo_exists():
+            self.dashboard.select(self.worker.port or self.port_var.get(), relay_num)
     
     def update_indicator(self, state):
         """Обновляет индикатор состояния"""
+        if state == self.indicator_state:
+            return
+        self.indicator_state = state
         color = {
             "on": "red",
             "off": "green",
             "unknown": "gray"
         }.get(state, "gray")
         
-        self.state_indicator.delete("all")
-        self.state_indicator.create_oval(5, 5, 25, 25, fill=color, outline="black")
-        self.state_indicator.create_text(15, 15, text="●", fill="white" if state != "unknown" else "black")
+        self.state_indicator.itemconfigure(self.indicator_oval, fill=color)
+        self.state_indicator.itemconfigure(self.indicator_text, fill="white" if state != "unknown" else "black")
+    
+    def on_ports_changed(self, added, removed):
+        """Вызывается из потока PortWatcher при появлении и исчезновении портов"""
+        self.root.after(0, self.update_ports, added)
     
-    def update_ports(self):
-        ports = [port.device for port in serial.tools.list_ports.comports()]
+    def update_ports(self, added=()):
+        ports = self.port_watcher.devices()
         self.port_combobox['values'] = ports
+        for device in added:
+            info = self.port_watcher.info(device)
+            if info is not None and info.is_relay:
+                self.log_message(self.t("relay_module_found", device))
         if ports and not self.port_var.get():
+            # Модули реле стоят в начале списка
             self.port_var.set(ports[0])
     
+    def journal_states(self, port):
+        """Состояния реле порта из журнала; пустой словарь, если журнал отключен"""
+        return self.journal.states(port) if self.journal is not None else {}
+    
     def auto_connect(self):
         """Пытается автоматически подключиться к порту"""
         port = self.port_var.get()
-        try:
-            self.serial_port = serial.Serial(port, baudrate=9600, timeout=2)
-            if self.serial_port.is_open:
-                self.connect_button.config(text=self.t("disconnect"))
-                self.log_message(self.t("connected_to_port", port))
-                self.clear_serial_buffer()
-            else:
-                raise serial.SerialException("Port open failed")
-        except Exception as e:
-            self.log_message(self.t("auto_connect_failed", str(e)))
-            self.serial_port = None
+        self.active_port = port
+        self.worker.open(port, True, self.journal_states(port))
     
     def connect_port(self):
         """Подключается к выбранному порту"""
@@ -310,172 +616,267 @@ class RelayControlApp:
             messagebox.showerror(self.t("app_title"), self.t("port_not_selected"))
             return
         
-        try:
-            if self.serial_port and self.serial_port.is_open:
-                self.serial_port.close()
-                self.serial_port = None
-                self.connect_button.config(text=self.t("connect"))
-                self.log_message(self.t("disconnected_from_port", port))
-                self.update_indicator("unknown")
-                self.save_config()
-                return
-            
-            self.serial_port = serial.Serial(port, baudrate=9600, timeout=2)
-            if self.serial_port.is_open:
-                self.connect_button.config(text=self.t("disconnect"))
-                self.log_message(self.t("connected_to_port", port))
-                self.save_config()
-                self.clear_serial_buffer()
-            else:
-                raise serial.SerialException("Port open failed")
-                
-        except Exception as e:
-            error_msg = str(e)
-            if "Access is denied" in error_msg or "Permission denied" in error_msg:
-                error_msg = self.t("port_busy") + " " + error_msg
-            messagebox.showerror(self.t("app_title"), error_msg)
-            if self.serial_port:
-                self.serial_port.close()
-            self.serial_port = None
-            self.connect_button.config(text=self.t("connect"))
-            self.update_indicator("unknown")
-
-    def clear_serial_buffer(self):
-        """Очищает буфер последовательного порта"""
-        if self.serial_port and self.serial_port.is_open:
-            self.serial_port.reset_input_buffer()
-            self.serial_port.reset_output_buffer()
+        if self.connected:
+            self.worker.close()
+            return
+        
+        self.active_port = port
+        self.worker.open(port, False, self.journal_states(port))
     
     def send_command(self, command):
         """Отправляет команду на реле"""
-        if not self.serial_port or not self.serial_port.is_open:
+        if not self.connected:
             if self.config.get("auto_connect", False) and self.port_var.get():
-                try:
-                    self.auto_connect()
-                    if not (self.serial_port and self.serial_port.is_open):
-                        raise serial.SerialException("Auto-reconnect failed")
-                except Exception as e:
-                    messagebox.showerror(self.t("app_title"), 
-                                       self.t("port_not_connected") + "\n" + str(e))
-                    return
+                # Команда встанет в очередь воркера сразу за открытием порта
+                self.auto_connect()
             else:
                 messagebox.showerror(self.t("app_title"), self.t("port_not_connected"))
                 return
         
         relay_num = self.relay_num_var.get()
-        if relay_num < 1 or relay_num > 254:
+        if relay_num < MIN_RELAY or relay_num > MAX_RELAY:
             messagebox.showerror(self.t("app_title"), self.t("invalid_relay_number"))
             return
         
-        try:
-            # Очищаем буфер перед отправкой
-            self.clear_serial_buffer()
-            
-            # Формируем команду
-            data1 = 0xA0
-            data2 = relay_num
-            data3 = self.get_command_code(command)
-            checksum = (data1 + data2 + data3) % 0x100
-            cmd_bytes = bytes([data1, data2, data3, checksum])
-            
-            # Отправляем команду
-            self.serial_port.write(cmd_bytes)
-            self.log_message(self.t("sent", cmd_bytes.hex(' ').upper()))
-            
-            # Обновляем индикатор для команд без обратной связи
-            if not self.feedback_var.get() and command in ("on", "off"):
-                self.update_indicator(command)
-                self.last_relay_state[relay_num] = command
-            
-            # Обрабатываем ответ, если требуется
-            if self.feedback_var.get() or command == "status":
-                try:
-                    response = self.serial_port.read(4)
-                    if response:
-                        self.log_message(self.t("received", response.hex(' ').upper()))
-                        self.parse_response(response)
-                    else:
-                        self.log_message(self.t("no_response"))
-                        self.update_indicator("unknown")
-                except Exception as e:
-                    self.log_message(self.t("connection_lost", str(e)))
-                    self.serial_port.close()
-                    self.serial_port = None
-                    self.connect_button.config(text=self.t("connect"))
-                    self.update_indicator("unknown")
-                    
-        except Exception as e:
-            error_msg = str(e)
-            if "failed" in error_msg or "error" in error_msg.lower():
-                self.log_message(self.t("communication_error", error_msg))
-            messagebox.showerror(self.t("app_title"), self.t("communication_error", error_msg))
-            if self.serial_port:
-                self.serial_port.close()
-            self.serial_port = None
-            self.connect_button.config(text=self.t("connect"))
-            self.update_indicator("unknown")
-
-    def get_command_code(self, command):
-        codes = {
-            "off": 0x00 if not self.feedback_var.get() else 0x02,
-            "on": 0x01 if not self.feedback_var.get() else 0x03,
-            "toggle": 0x04,
-            "status": 0x05
-        }
-        return codes.get(command)
-    
-    def parse_response(self, response):
-        if len(response) != 4:
-            self.log_message(self.t("invalid_response"))
-            return
+        # Обновляем индикатор для команд без обратной связи
+        feedback = self.feedback_var.get()
+        if not feedback and command in ("on", "off"):
+            self.update_indicator(command)
+            self.set_relay_state(relay_num, command)
         
-        data1, data2, data3, checksum = response
-        
-        # Проверка контрольной суммы
-        calculated_checksum = (data1 + data2 + data3) % 0x100
-        if calculated_checksum != checksum:
-            self.log_message(self.t("checksum_error"))
-            return
+        self.worker.send(relay_num, command, feedback)
+        if self.poller and command != "status":
+            self.poller.kick()
+    
+    def send_batch_command(self, command):
+        """Отправляет команду группе реле одной записью"""
+        if not self.connected:
+            if self.config.get("auto_connect", False) and self.port_var.get():
+                self.auto_connect()
+            else:
+                messagebox.showerror(self.t("app_title"), self.t("port_not_connected"))
+                return
         
-        # Проверка первого байта
-        if data1 != 0xA0:
-            self.log_message(self.t("invalid_first_byte"))
+        spec = self.relay_list_var.get()
+        try:
+            relays = parse_relay_spec(spec, range(MIN_RELAY, self.relay_count + 1))
+        except ValueError:
+            messagebox.showerror(self.t("app_title"), self.t("invalid_relay_list", spec))
             return
         
-        # Интерпретация данных
-        relay_num = data2
-        status = data3
+        feedback = self.feedback_var.get()
+        if not feedback:
+            for relay_num in relays:
+                self.set_relay_state(relay_num, command)
+            self.update_indicator_for_current_relay()
         
-        if status in (0x00, 0x02):
-            state = "off"
-            state_text = self.t("off")
-        elif status in (0x01, 0x03):
-            state = "on"
-            state_text = self.t("on")
+        self.worker.send_batch(relays, command, feedback)
+        if self.poller:
+            self.poller.kick()
+    
+    def start_poller(self):
+        """Запускает фоновый опрос состояния настроенных реле"""
+        if self.poller:
+            return
+        self.poller = StatusPoller(self.worker, range(MIN_RELAY, self.relay_count + 1),
+                                   min_interval=self.config.get("poll_min_interval", 0.25),
+                                   max_interval=self.config.get("poll_max_interval", 5.0))
+        self.poller.start()
+    
+    def stop_poller(self):
+        if self.poller:
+            self.poller.stop()
+            self.poller = None
+    
+    def toggle_poller(self):
+        if self.poll_var.get():
+            self.start_poller()
+        else:
+            self.stop_poller()
+    
+    def post_worker_event(self, event):
+        """Передает событие воркера в главный поток Tk"""
+        self.root.after(0, self.handle_worker_event, event)
+    
+    def handle_worker_event(self, event):
+        """Обрабатывает событие воркера в главном потоке"""
+        event_type = event["type"]
+        if event.get("sent_at") is not None and event.get("done_at") is not None:
+            self.last_command_latency = event["done_at"] - event["sent_at"]
+            self.last_ui_latency = time.monotonic() - event["done_at"]
+        
+        if event_type == "opened":
+            self.connected = True
+            self.connect_button.config(text=self.t("disconnect"))
+            if event.get("reconnected"):
+                self.log_message(self.t("reconnected_to_port", event["port"]))
+                return
+            self.log_message(self.t("connected_to_port", event["port"]))
+            # Состояния из журнала воркер сразу проверяет опросом и сообщит о расхождениях
+            self.last_relay_state.clear()
+            for relay_num, state in self.journal_states(event["port"]).items():
+                self.set_relay_state(relay_num, state)
+            self.update_indicator_for_current_relay()
+            if not event["auto"]:
+                self.save_config()
+        elif event_type == "open_failed":
+            self.set_disconnected()
+            if event["auto"]:
+                self.log_message(self.t("auto_connect_failed", event["error"]))
+                return
+            error_msg = event["error"]
+            if "Access is denied" in error_msg or "Permission denied" in error_msg:
+                error_msg = self.t("port_busy") + " " + error_msg
+            messagebox.showerror(self.t("app_title"), error_msg)
+        elif event_type == "closed":
+            self.set_disconnected()
+            self.log_message(self.t("disconnected_from_port", event["port"]))
+            self.save_config()
+        elif event_type == "sent":
+            self.log_message(self.t("sent", event["frame"].hex(' ').upper()))
+        elif event_type == "response":
+            self.log_message(self.t("received", event["response"].hex(' ').upper()))
+            self.apply_reply(event["reply"], event["port"])
+        elif event_type == "invalid_response":
+            self.log_message(self.t("received", event["response"].hex(' ').upper()))
+            self.log_message(self.t(event["error"]))
+        elif event_type == "late_response":
+            self.log_message(self.t("late_response", event["response"].hex(' ').upper()))
+            self.apply_reply(event["reply"], event["port"])
+        elif event_type == "sequence_started":
+            self.log_message(self.t("sequence_started", event["sequence"], event["steps"]))
+        elif event_type == "sequence_done":
+            report = event["report"]
+            if report.completed:
+                self.log_message(self.t("sequence_done", report.name, report.completed, report.steps,
+                                        report.jitter_mean * 1000, report.jitter_max * 1000,
+                                        report.jitter_p99 * 1000))
+            for relay_num, state in event["states"].items():
+                self.set_relay_state(relay_num, state)
+            self.update_indicator_for_current_relay()
+        elif event_type == "state_changed":
+            # Опрос присылает только изменения, поэтому каждое событие стоит перерисовки
+            if event["reply"] is not None:
+                self.apply_reply(event["reply"], event["port"])
+            else:
+                self.set_relay_state(event["relay"], "unknown")
+                if event["relay"] == self.relay_num_var.get():
+                    self.update_indicator("unknown")
+        elif event_type == "resync":
+            self.log_message(self.t("resync_skipped", event["skipped"]))
+        elif event_type == "batch_response":
+            if event["response"]:
+                self.log_message(self.t("received", event["response"].hex(' ').upper()))
+            for error in event["errors"]:
+                self.log_message(self.t(error))
+            for relay_num in event["relays"]:
+                if relay_num in event["replies"]:
+                    self.apply_reply(event["replies"][relay_num], event["port"])
+            if event["missing"]:
+                self.log_message(self.t("no_response_from", ", ".join(map(str, event["missing"]))))
+                for relay_num in event["missing"]:
+                    self.set_relay_state(relay_num, "unknown")
+                self.update_indicator_for_current_relay()
+        elif event_type == "no_response":
+            self.log_message(self.t("no_response"))
+            self.update_indicator("unknown")
+        elif event_type in ("connection_lost", "error"):
+            # Сбой порта не прерывает работу окном: воркер переподключается в фоне,
+            # а до тех пор команды ждут в его очереди
+            if event.get("reconnecting"):
+                self.update_indicator("unknown")
+            elif not event.get("connected"):
+                self.set_disconnected()
+            key = "connection_lost" if event_type == "connection_lost" else "communication_error"
+            self.log_message(self.t(key, event["error"]))
+        elif event_type == "reconnecting":
+            self.log_message(self.t("reconnecting", event["attempt"], event["error"], event["delay"]))
+        elif event_type == "port_renamed":
+            self.active_port = event["new_port"]
+            self.port_var.set(event["new_port"])
+            self.log_message(self.t("port_renamed", event["old_port"], event["new_port"]))
+        elif event_type == "not_connected":
+            self.log_message(self.t("port_not_connected"))
+    
+    def set_disconnected(self):
+        """Переводит интерфейс в состояние без подключения"""
+        self.connected = False
+        self.active_port = None
+        self.connect_button.config(text=self.t("connect"))
+        self.update_indicator("unknown")
+
+    def apply_reply(self, reply, port):
+        """Применяет разобранный ответ модуля к индикатору и логу
+
+        port берется из события: к моменту обработки в потоке Tk воркер мог уже
+        переключиться на другое имя порта.
+        """
+        relay_num = reply.relay
+        state = reply.state
+        if state == "unknown":
+            state_text = self.t("unknown_state", hex(reply.status))
         else:
-            state = "unknown"
-            state_text = self.t("unknown_state", hex(status))
+            state_text = self.t(state)
         
         # Обновляем индикатор, если это текущее реле
         if relay_num == self.relay_num_var.get():
             self.update_indicator(state)
         
-        self.last_relay_state[relay_num] = state
+        self.set_relay_state(relay_num, state)
+        if self.journal is not None:
+            self.journal.record(port, relay_num, state)
         self.log_message(self.t("relay_status", relay_num, state_text))
     
     def log_message(self, message):
+        """Добавляет строку в лог; виджет обновляется пакетно в flush_log"""
+        self.log_buffer.append(message)
+        if not self.log_flush_scheduled:
+            self.log_flush_scheduled = True
+            self.root.after(self.LOG_FLUSH_MS, self.flush_log)
+    
+    def flush_log(self):
+        """Вставляет накопленные строки одной операцией и удаляет вытесненные"""
+        self.log_flush_scheduled = False
+        lines, drop = self.log_buffer.flush()
+        if not lines:
+            return
         self.log_text.config(state="normal")
-        self.log_text.insert("end", message + "\n")
+        if drop:
+            self.log_text.delete("1.0", "{}.0".format(drop + 1))
+        self.log_text.insert("end", "\n".join(lines) + "\n")
         self.log_text.see("end")
         self.log_text.config(state="disabled")
     
     def on_closing(self):
         self.save_config()
-        if self.serial_port and self.serial_port.is_open:
-            self.serial_port.close()
+        try:
+            self.config.flush()
+        except OSError:
+            pass
+        self.stop_poller()
+        self.port_watcher.stop()
+        self.worker.stop(timeout=SerialWorker.TIMEOUT + 1)
+        self.log_buffer.close()
+        if self.metrics_export:
+            self.metrics_export.set()
+        self.metrics.shutdown()
+        if self.capture:
+            self.capture.close()
+        if self.journal is not None:
+            self.journal.close()
         self.root.destroy()
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--daemon"]:
+        import relay_daemon
+        
+        sys.exit(relay_daemon.main(sys.argv[2:]))
+    if sys.argv[1:]:
+        # С аргументами приложение работает как утилита командной строки, без окна
+        import relay_cli
+        
+        sys.exit(relay_cli.main(sys.argv[1:]))
+    
     root = tk.Tk()
     app = RelayControlApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
@@ -0,0 +1,175 @@
+"""Asyncio-управление множеством LCUS-модулей на разных портах"""
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from relay_protocol import (DEFAULT_BAUDRATE, DEFAULT_TIMEOUT, FRAME_SIZE, RelayClient, expects_response,
+                            list_ports)
+
+# reply: RelayReply или None; error: исключение или None
+FanOutResult = namedtuple("FanOutResult", "port relay command reply error")
+
+
+class AsyncRelayConnection:
+    """Соединение с одним модулем; весь ввод-вывод идет через собственный поток порта"""
+    # Запас ожидания coroutine сверх таймаута порта и времени передачи, чтобы ответившие
+    # реле не получали TimeoutError, пока чтение порта еще ждет молчащие
+    DEADLINE_MARGIN = 0.25
+
+    def __init__(self, port, timeout=DEFAULT_TIMEOUT, feedback=False, baudrate=DEFAULT_BAUDRATE):
+        self.port = port
+        self.timeout = timeout
+        self.feedback = feedback
+        self.baudrate = baudrate
+        self.client = None
+        # Один поток на порт сериализует обмен даже после отмены по таймауту
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relay-" + str(port))
+
+    def deadline(self, frames=1):
+        """Время ожидания обмена: таймаут чтения порта, передача запросов и ответов и запас"""
+        # 10 бит на байт, кадры идут в обе стороны
+        line_time = frames * FRAME_SIZE * 2 * 10.0 / self.baudrate
+        return self.timeout + line_time + self.DEADLINE_MARGIN
+
+    async def _call(self, func, *args, timeout=None, frames=1):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, func, *args)
+        return await asyncio.wait_for(future, self.deadline(frames) if timeout is None else timeout)
+
+    @property
+    def states(self):
+        return self.client.states if self.client else {}
+
+    async def open(self):
+        if self.client is None:
+            # Чтение из порта ограничено self.timeout, ожидание coroutine - deadline()
+            self.client = await self._call(RelayClient.open, self.port, self.baudrate,
+                                           self.timeout, self.feedback)
+        return self
+
+    async def close(self):
+        if self.client is not None:
+            client, self.client = self.client, None
+            await asyncio.get_running_loop().run_in_executor(self.executor, client.close)
+        self.executor.shutdown(wait=False)
+
+    async def send(self, relay, command, timeout=None):
+        """Отправляет команду и возвращает RelayReply или None"""
+        await self.open()
+        return await self._call(self.client.send, relay, command, self.feedback, timeout=timeout)
+
+    async def send_batch(self, relays, command, timeout=None):
+        """Отправляет команду нескольким реле одной записью"""
+        await self.open()
+        return await self._call(self.client.send_batch, relays, command, self.feedback, timeout=timeout,
+                                frames=len(relays))
+
+    async def on(self, relay):
+        return await self.send(relay, "on")
+
+    async def off(self, relay):
+        return await self.send(relay, "off")
+
+    async def toggle(self, relay):
+        return await self.send(relay, "toggle")
+
+    async def status(self, relay):
+        return await self.send(relay, "status")
+
+
+class AsyncRelayController:
+    """Набор соединений по портам с параллельной рассылкой команд"""
+
+    def __init__(self, max_concurrency=16, timeout=DEFAULT_TIMEOUT, feedback=False):
+        self.timeout = timeout
+        self.feedback = feedback
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.connections = {}
+
+    async def discover(self):
+        """Возвращает список портов полным перечислением, как relay_protocol.list_ports"""
+        return await asyncio.get_running_loop().run_in_executor(None, list_ports)
+
+    def connection(self, port):
+        """Возвращает соединение с портом, создавая его при первом обращении"""
+        connection = self.connections.get(port)
+        if connection is None:
+            connection = AsyncRelayConnection(port, self.timeout, self.feedback)
+            self.connections[port] = connection
+        return connection
+
+    async def connect(self, ports=None):
+        """Открывает порты параллельно; возвращает словарь порт -> исключение для неудачных"""
+        if ports is None:
+            ports = await self.discover()
+
+        async def open_one(port):
+            async with self.semaphore:
+                await self.connection(port).open()
+
+        results = await asyncio.gather(*(open_one(port) for port in ports), return_exceptions=True)
+        failed = {}
+        for port, result in zip(ports, results):
+            if isinstance(result, BaseException):
+                failed[port] = result
+                await self.connections.pop(port).close()
+        return failed
+
+    async def send(self, port, relay, command):
+        async with self.semaphore:
+            return await self.connection(port).send(relay, command)
+
+    async def fan_out(self, jobs):
+        """Выполняет задания (порт, реле, команда) на всех портах параллельно
+
+        Задания одного порта выполняются в порядке списка; подряд идущие задания с одинаковой
+        командой уходят одним пакетом. Порядок результатов совпадает с порядком заданий,
+        ошибки возвращаются в поле error.
+        """
+        jobs = list(jobs)
+        # Порт -> серии (команда, [(индекс, реле), ...]) в порядке заданий
+        groups = {}
+        for index, (port, relay, command) in enumerate(jobs):
+            runs = groups.setdefault(port, [])
+            if not runs or runs[-1][0] != command:
+                runs.append((command, []))
+            runs[-1][1].append((index, relay))
+        results = [None] * len(jobs)
+
+        async def run_port(port, runs):
+            connection = self.connection(port)
+            async with self.semaphore:
+                for command, items in runs:
+                    relays = [relay for _, relay in items]
+                    try:
+                        replies = await connection.send_batch(relays, command)
+                        error = None
+                    except Exception as e:
+                        replies, error = {}, e
+                    for index, relay in items:
+                        reply = replies.get(relay)
+                        if error is None and reply is None and expects_response(command, self.feedback):
+                            item_error = TimeoutError("No response from relay {}".format(relay))
+                        else:
+                            item_error = error
+                        results[index] = FanOutResult(port, relay, command, reply, item_error)
+
+        await asyncio.gather(*(run_port(port, runs) for port, runs in groups.items()))
+        return results
+
+    async def broadcast(self, command, relays, ports=None):
+        """Отправляет команду одним и тем же реле на всех (или указанных) портах"""
+        if ports is None:
+            ports = list(self.connections)
+        return await self.fan_out((port, relay, command) for port in ports for relay in relays)
+
+    async def close(self):
+        connections, self.connections = self.connections, {}
+        await asyncio.gather(*(connection.close() for connection in connections.values()),
+                             return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,190 @@
+"""Замеры производительности обмена с модулем: команды в секунду, задержки и восстановление
+
+По умолчанию работает с виртуальным модулем relay_sim, поэтому оборудование не нужно.
+Пороговые значения --min-rate и --max-p99-ms позволяют использовать замер как проверку в CI.
+Режим startup измеряет запуск GUI: импорт модулей и время до первой отрисовки окна.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from relay_protocol import ProtocolError, RelayClient
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(name, latencies, errors, elapsed, commands, recoveries):
+    return {
+        "mode": name,
+        "commands": commands,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 6),
+        # Скорость считается только по командам, на которые пришел ответ
+        "commands_per_s": round((commands - errors) / elapsed, 1) if elapsed else None,
+        "p50_ms": None if not latencies else round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": None if not latencies else round(percentile(latencies, 0.99) * 1000, 3),
+        "recovery_p50_ms": None if not recoveries else round(percentile(recoveries, 0.50) * 1000, 3),
+        "recovery_max_ms": None if not recoveries else round(max(recoveries) * 1000, 3),
+    }
+
+
+def bench_sequential(client, relays, count):
+    """Одна команда status за раз с очисткой буфера, как в обычном режиме приложения"""
+    latencies = []
+    recoveries = []
+    errors = 0
+    failed_at = None
+    started = time.perf_counter()
+    for index in range(count):
+        relay = relays[index % len(relays)]
+        sent_at = time.perf_counter()
+        try:
+            reply = client.send(relay, "status")
+        except ProtocolError:
+            reply = None
+        done_at = time.perf_counter()
+        if reply is None:
+            errors += 1
+            if failed_at is None:
+                failed_at = sent_at
+            continue
+        latencies.append(done_at - sent_at)
+        if failed_at is not None:
+            # Время от первой ошибки до следующего успешного ответа
+            recoveries.append(done_at - failed_at)
+            failed_at = None
+    return summarize("sequential", latencies, errors, time.perf_counter() - started, count, recoveries)
+
+
+def bench_batch(client, relays, count):
+    """Команда status всем реле одной записью"""
+    latencies = []
+    errors = 0
+    rounds = max(1, count // len(relays))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        sent_at = time.perf_counter()
+        replies = client.send_batch(relays, "status")
+        latencies.append(time.perf_counter() - sent_at)
+        errors += len(relays) - len(replies)
+    return summarize("batch", latencies, errors, time.perf_counter() - started,
+                     rounds * len(relays), [])
+
+
+def bench_pipeline(client, relays, count, window):
+    """Команды status с окном window запросов в полете"""
+    client.clear_buffer()
+    pipeline = client.pipeline(window, client.serial_port.timeout)
+    started = time.perf_counter()
+    results = pipeline.run([(relays[i % len(relays)], "status") for i in range(count)])
+    elapsed = time.perf_counter() - started
+    latencies = [r.done_at - r.sent_at for r in results if r.outcome == "ok"]
+    errors = sum(1 for r in results if r.outcome != "ok")
+    return summarize("pipeline", latencies, errors, elapsed, count, [])
+
+
+# Выполняется в отдельном процессе, чтобы импорты не были закэшированы
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {path!r})
+import RelaControl
+imported = time.perf_counter()
+result = {{"import_ms": round((imported - started) * 1000, 3), "first_paint_ms": None}}
+try:
+    root = RelaControl.tk.Tk()
+except RelaControl.tk.TclError as e:
+    result["error"] = str(e)
+else:
+    app = RelaControl.RelayControlApp(root)
+
+    def painted(event):
+        if result["first_paint_ms"] is None:
+            result["first_paint_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            root.after(0, app.on_closing)
+
+    root.bind("<Expose>", painted, "+")
+    root.mainloop()
+print(json.dumps(result))
+"""
+
+
+def bench_startup():
+    """Запуск GUI в новом процессе в пустом каталоге, чтобы не трогать настройки пользователя"""
+    path = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(path=path)], cwd=workdir,
+                                capture_output=True, text=True, check=True).stdout
+        elapsed = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    return {"mode": "startup", "process_ms": round(elapsed * 1000, 3), **result}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relay protocol benchmark")
+    parser.add_argument("--port", default="sim://?relays=8",
+                        help="serial port or sim:// URL (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=500, help="commands per mode")
+    parser.add_argument("--relays", type=int, default=8)
+    parser.add_argument("--window", type=int, default=8, help="pipeline window")
+    parser.add_argument("--timeout", type=float, default=0.2)
+    parser.add_argument("--modes", default="sequential,batch,pipeline")
+    parser.add_argument("--min-rate", type=float, help="fail if any mode is slower (commands/s)")
+    parser.add_argument("--max-p99-ms", type=float,
+                        help="fail if any mode has a higher p99 or no successful commands")
+    parser.add_argument("--max-errors", type=int, help="fail if any mode has more failed commands")
+    parser.add_argument("--max-startup-ms", type=float,
+                        help="fail if the GUI takes longer to first paint (or to import without a display)")
+    args = parser.parse_args(argv)
+
+    relays = list(range(1, args.relays + 1))
+    modes = args.modes.split(",")
+    results = []
+    if "startup" in modes:
+        modes.remove("startup")
+        results.append(bench_startup())
+    client = RelayClient.open(args.port, timeout=args.timeout) if modes else None
+    try:
+        for mode in modes:
+            client.clear_buffer()
+            if mode == "sequential":
+                results.append(bench_sequential(client, relays, args.count))
+            elif mode == "batch":
+                results.append(bench_batch(client, relays, args.count))
+            elif mode == "pipeline":
+                results.append(bench_pipeline(client, relays, args.count, args.window))
+            else:
+                parser.error("unknown mode: {}".format(mode))
+    finally:
+        if client is not None:
+            client.close()
+
+    failed = False
+    for result in results:
+        print(json.dumps(result))
+        if result["mode"] == "startup":
+            startup_ms = result["first_paint_ms"] or result["import_ms"]
+            if args.max_startup_ms is not None and startup_ms > args.max_startup_ms:
+                failed = True
+            continue
+        if args.min_rate is not None and (result["commands_per_s"] or 0) < args.min_rate:
+            failed = True
+        if args.max_p99_ms is not None and (result["p99_ms"] is None or result["p99_ms"] > args.max_p99_ms):
+            failed = True
+        if args.max_errors is not None and result["errors"] > args.max_errors:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Запись трафика LCUS-модуля в файл и воспроизведение записи без оборудования
+
+Формат выбирается по расширению: ".jsonl" - по одной JSON-записи на строку,
+иначе компактный двоичный формат: заголовок MAGIC и записи
+<время монотонных часов в нс: u64><направление: u8><длина: u16><данные>.
+"""
+import json
+import struct
+import sys
+import time
+from collections import Counter
+
+from relay_files import BackgroundWriter
+from relay_protocol import FrameParser
+
+MAGIC = b"LCUSCAP1"
+RECORD = struct.Struct("<QBH")
+DIRECTIONS = ("tx", "rx")
+
+
+def is_jsonl(path):
+    return str(path).endswith(".jsonl")
+
+
+class CaptureWriter(BackgroundWriter):
+    """Дописывает кадры в файл из фонового потока, не задерживая обмен с портом"""
+
+    def __init__(self, path):
+        super().__init__(name="CaptureWriter")
+        self.path = path
+        self.jsonl = is_jsonl(path)
+        self.file = open(path, "ab")
+        if not self.jsonl and self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.start()
+
+    def record(self, direction, data, port=None):
+        """Ставит кадр в очередь записи; вызывается из потока ввода-вывода"""
+        self.items.put((time.monotonic_ns(), direction, bytes(data), port))
+
+    def handle(self, item):
+        t_ns, direction, data, port = item
+        if self.jsonl:
+            line = {"t": t_ns, "dir": direction, "data": data.hex(" ").upper()}
+            if port is not None:
+                line["port"] = port
+            self.file.write((json.dumps(line) + "\n").encode("utf-8"))
+        else:
+            self.file.write(RECORD.pack(t_ns, DIRECTIONS.index(direction), len(data)))
+            self.file.write(data)
+
+    def flush_file(self):
+        self.file.flush()
+
+    def close_file(self):
+        self.file.close()
+
+
+def read_capture(path):
+    """Возвращает записи файла в виде (время_нс, направление, данные)"""
+    if is_jsonl(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    yield item["t"], item["dir"], bytes.fromhex(item["data"])
+        return
+
+    with open(path, "rb") as f:
+        blob = f.read()
+    if not blob.startswith(MAGIC):
+        raise ValueError("Not a relay capture file: {}".format(path))
+    view = memoryview(blob)
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(view):
+        t_ns, direction, length = RECORD.unpack_from(view, offset)
+        offset += RECORD.size
+        yield t_ns, DIRECTIONS[direction], bytes(view[offset:offset + length])
+        offset += length
+
+
+def replay(records, repeat=1):
+    """Прогоняет принятые кадры через разбор ответов с максимальной скоростью
+
+    Все принятые фрагменты идут одним потоком через FrameParser, как в приложении:
+    при конвейере и пакетах границы чтения не совпадают с границами кадров, даже если
+    фрагмент ровно 4 байта. Байты, пропущенные при синхронизации, считаются ошибками.
+    """
+    received = [data for _, direction, data in records if direction == "rx"]
+    stats = Counter()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parser = FrameParser()
+        for data in received:
+            stats["replies"] += len(parser.feed(data))
+        stats["discarded_bytes"] += parser.discarded
+        # Недописанный кадр в конце записи
+        stats["incomplete_bytes"] += len(parser.buffer)
+    elapsed = time.perf_counter() - started
+    stats["chunks"] = len(received) * repeat
+    return stats, elapsed
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Relay traffic capture tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dump_parser = commands.add_parser("dump", help="print capture records")
+    dump_parser.add_argument("path")
+    replay_parser = commands.add_parser("replay", help="parse received frames at full speed")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    records = list(read_capture(args.path))
+    if args.command == "dump":
+        start = records[0][0] if records else 0
+        for t_ns, direction, data in records:
+            print("{:12.6f} {} {}".format((t_ns - start) / 1e9, direction, data.hex(" ").upper()))
+        return 0
+
+    stats, elapsed = replay(records, args.repeat)
+    for key in sorted(stats):
+        print("{}: {}".format(key, stats[key]))
+    print("elapsed: {:.6f} s".format(elapsed))
+    if elapsed > 0:
+        print("chunks/s: {:.0f}".format(stats["chunks"] / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
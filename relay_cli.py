@@ -0,0 +1,195 @@
+"""Управление реле из командной строки и скриптов без GUI
+
+    python relay_cli.py --port /dev/ttyUSB0 on 1-4 status all
+    python relay_cli.py --port COM6 --script commands.txt
+    echo "off all" | python relay_cli.py --port COM6 --script -
+
+Команда состоит из слова on/off/toggle/status и списка реле ("3", "1-4", "1,3,5-7", "all");
+"sleep СЕКУНДЫ" делает паузу. В файле скрипта команды можно писать по одной или несколько
+в строке, "#" начинает комментарий. Все команды выполняются через один открытый порт
+с конвейером кадров, каждый результат выводится отдельной строкой JSON.
+"""
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+from relay_config import ConfigStore
+from relay_protocol import COMMANDS, DEFAULT_TIMEOUT, MIN_RELAY, RelayClient, parse_relay_spec
+
+SLEEP_WORDS = ("sleep", "wait")
+# Сколько прочитанных, но еще не выполненных строк потока может ждать в памяти
+STREAM_BACKLOG = 1000
+
+
+def parse_words(words, all_relays):
+    """Переводит слова скрипта в шаги ("command", команда, реле) и ("sleep", секунды)"""
+    steps = []
+    words = iter(words)
+    for word in words:
+        if word in COMMANDS:
+            spec = next(words, None)
+            if spec is None:
+                raise ValueError("'{}' needs a relay list".format(word))
+            steps.append(("command", word, parse_relay_spec(spec, all_relays)))
+        elif word in SLEEP_WORDS:
+            seconds = next(words, None)
+            if seconds is None:
+                raise ValueError("'{}' needs a number of seconds".format(word))
+            steps.append(("sleep", float(seconds)))
+        else:
+            raise ValueError("Unknown command: {}".format(word))
+    return steps
+
+
+def script_words(lines):
+    """Слова из строк скрипта без комментариев"""
+    for line in lines:
+        yield from line.split("#", 1)[0].split()
+
+
+def result_to_json(result):
+    data = {"relay": result.relay, "command": result.command, "outcome": result.outcome}
+    if result.reply is not None:
+        data["state"] = result.reply.state
+        data["status"] = result.reply.status
+    if result.sent_at is not None and result.done_at is not None:
+        data["latency_ms"] = round((result.done_at - result.sent_at) * 1000, 3)
+    return data
+
+
+def run_steps(pipeline, steps, out):
+    """Выполняет шаги; команды между паузами уходят одним конвейером. Возвращает число ошибок"""
+    failures = 0
+    commands = []
+
+    def flush():
+        nonlocal failures
+        for result in pipeline.run(commands):
+            if result.outcome == "timeout":
+                failures += 1
+            out.write(json.dumps(result_to_json(result)) + "\n")
+        out.flush()
+        commands.clear()
+
+    for step in steps:
+        if step[0] == "sleep":
+            flush()
+            time.sleep(step[1])
+        else:
+            commands.extend((relay, step[1]) for relay in step[2])
+    flush()
+    return failures
+
+
+def read_lines(stream, lines):
+    """Переносит строки потока в очередь; None отмечает конец ввода"""
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def run_stream(pipeline, stream, all_relays, out, interactive=False):
+    """Выполняет команды из потока по мере поступления; возвращает число ошибок
+
+    Каждая строка потока должна содержать целые команды. Строки, которые уже пришли,
+    выполняются одним конвейером, а новые читаются в фоне, поэтому бесконечный поток
+    команд выполняется сразу и не накапливается в памяти. Ошибка разбора в интерактивном
+    режиме только выводится, в остальных - выполняет предыдущие строки и вызывает ValueError.
+    """
+    lines = queue.Queue(STREAM_BACKLOG)
+    threading.Thread(target=read_lines, args=(stream, lines), name="ScriptReader", daemon=True).start()
+    failures = 0
+    ended = False
+    while not ended:
+        chunk = [lines.get()]
+        while chunk[-1] is not None and len(chunk) < STREAM_BACKLOG:
+            try:
+                chunk.append(lines.get_nowait())
+            except queue.Empty:
+                break
+        ended = chunk[-1] is None
+        steps = []
+        for line in chunk:
+            if line is None:
+                break
+            try:
+                steps += parse_words(script_words([line]), all_relays)
+            except ValueError as e:
+                if not interactive:
+                    failures += run_steps(pipeline, steps, out)
+                    raise
+                print(json.dumps({"error": str(e)}), file=sys.stderr)
+        failures += run_steps(pipeline, steps, out)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Send relay commands, e.g.: --port /dev/ttyUSB0 on 1-4 status all")
+    parser.add_argument("--port",
+                        help="serial port or sim:// URL (default: last port from the config)")
+    parser.add_argument("--feedback", action="store_true", help="use on/off codes that reply")
+    parser.add_argument("--window", type=int, default=8, help="requests kept in flight")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="reply timeout, seconds")
+    parser.add_argument("--relay-count", type=int,
+                        help="relays covered by 'all' (default: from the config)")
+    parser.add_argument("--script", help="file with commands, '-' for stdin")
+    parser.add_argument("commands", nargs="*", help="commands such as: on 1-4 status all sleep 0.5")
+    args = parser.parse_args(argv)
+
+    if args.port is None or args.relay_count is None:
+        # Настройки GUI только читаются: испорченный файл остается на месте
+        config = ConfigStore(read_only=True)
+        if args.port is None:
+            args.port = config.get("last_port")
+        if args.relay_count is None:
+            args.relay_count = config.get("relay_count")
+
+    if not args.port:
+        parser.error("--port is required")
+    if not args.commands and not args.script:
+        parser.error("no commands given")
+    all_relays = range(MIN_RELAY, args.relay_count + 1)
+    try:
+        steps = parse_words(args.commands, all_relays)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        client = RelayClient.open(args.port, timeout=args.timeout, feedback=args.feedback)
+    except Exception as e:
+        print(json.dumps({"error": str(e), "port": args.port}), file=sys.stderr)
+        return 1
+    pipeline = client.pipeline(max(1, args.window), args.timeout)
+    failures = 0
+    try:
+        failures += run_steps(pipeline, steps, sys.stdout)
+        if args.script == "-":
+            # Стандартный ввод выполняется по мере поступления строк, в том числе из канала
+            try:
+                failures += run_stream(pipeline, sys.stdin, all_relays, sys.stdout, sys.stdin.isatty())
+            except ValueError as e:
+                print(json.dumps({"error": str(e), "script": args.script}), file=sys.stderr)
+                return 2
+        elif args.script:
+            with open(args.script, "r", encoding="utf-8") as f:
+                words = list(script_words(f))
+            try:
+                script_steps = parse_words(words, all_relays)
+            except ValueError as e:
+                print(json.dumps({"error": str(e), "script": args.script}), file=sys.stderr)
+                return 2
+            failures += run_steps(pipeline, script_steps, sys.stdout)
+    except OSError as e:
+        print(json.dumps({"error": str(e), "port": args.port}), file=sys.stderr)
+        return 1
+    finally:
+        client.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Хранилище настроек приложения с отложенной атомарной записью
+
+В relay_config.json попадают только значения, отличные от встроенных (DEFAULTS), поэтому
+файл остается маленьким и читается при запуске одним json.load. Изменения собираются
+в течение delay секунд и записываются одним файлом через временный файл и os.replace,
+так что сбой во время записи не портит прежние настройки.
+"""
+import json
+import os
+import threading
+
+from relay_files import atomic_write
+
+CONFIG_FILE = "relay_config.json"
+
+DEFAULTS = {
+    "last_port": "",
+    "last_relay_num": 1,
+    "last_relay_list": "1-8",
+    "last_sequence": "",
+    "relay_count": 8,
+    "pipeline_window": 0,
+    "poll_enabled": False,
+    "poll_min_interval": 0.25,
+    "poll_max_interval": 5.0,
+    "log_max_lines": 1000,
+    "log_file": "relay_control.log",
+    "capture_file": "",
+    "state_journal": "relay_states.jsonl",
+    "metrics_http_port": 0,
+    "metrics_file": "",
+    "daemon_url": "",
+    "port_scan_interval": 1.0,
+    "reconnect_enabled": True,
+    "outage_policy": "queue",
+    "outage_queue_limit": 100,
+    "feedback_enabled": False,
+    "auto_connect": False,
+    "language": "en",
+    # Только измененные пользователем строки переводов
+    "languages": {},
+}
+
+
+class ConfigStore:
+    """Настройки со значениями по умолчанию; set() планирует запись, flush() выполняет ее сразу
+
+    read_only=True - только чтение для утилит: файл не переименовывается при ошибке
+    и никогда не записывается.
+    """
+
+    def __init__(self, path=CONFIG_FILE, defaults=DEFAULTS, delay=1.0, read_only=False):
+        self.path = path
+        self.defaults = defaults
+        self.delay = delay
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.timer = None
+        self.dirty = False
+        # Текст ошибки чтения файла, чтобы приложение могло сообщить о ней
+        self.load_error = None
+        self.overrides = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("top level is not an object")
+        except (OSError, ValueError) as e:
+            # Испорченный файл сохраняется рядом, а не перезаписывается настройками по умолчанию
+            self.load_error = "{}: {}".format(self.path, e)
+            if self.read_only:
+                return {}
+            try:
+                os.replace(self.path, self.path + ".bad")
+            except OSError:
+                pass
+            return {}
+        return {key: value for key, value in data.items()
+                if key not in self.defaults or self.defaults[key] != value}
+
+    def get(self, key, default=None):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.defaults.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        """Меняет несколько значений и планирует одну запись, если что-то изменилось"""
+        changed = False
+        with self.lock:
+            for key, value in values.items():
+                if key in self.defaults and self.defaults[key] == value:
+                    if key in self.overrides:
+                        del self.overrides[key]
+                        changed = True
+                elif self.overrides.get(key, KeyError) != value:
+                    self.overrides[key] = value
+                    changed = True
+            if changed and not self.read_only:
+                self.dirty = True
+                if self.timer is not None:
+                    self.timer.cancel()
+                self.timer = threading.Timer(self.delay, self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except OSError:
+            # Изменения остаются несохраненными и будут записаны при следующем flush
+            pass
+
+    def flush(self):
+        """Записывает накопленные изменения, если они есть"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            data = json.dumps(self.overrides, ensure_ascii=False, indent=2)
+            self.dirty = False
+            try:
+                atomic_write(self.path, data)
+            except OSError:
+                self.dirty = True
+                raise
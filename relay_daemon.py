@@ -0,0 +1,647 @@
+"""Фоновый сервис, который владеет портами и дает доступ к реле по HTTP/JSON и WebSocket
+
+Каждый порт обслуживает свой SerialWorker с очередью, поэтому сколько угодно клиентов
+используют один модуль без повторного открытия порта. Запуск: python RelaControl.py --daemon
+
+HTTP (keep-alive, HTTP/1.1):
+    GET  /ports                          - доступные и открытые порты
+    GET  /states?port=COM6               - последние известные состояния реле
+    GET  /relay?port=COM6&relay=1&command=on&feedback=1
+    POST /relay {"port": "COM6", "relay": 1, "command": "on", "feedback": true}
+    POST /relay {"port": "COM6", "relays": "1-8", "command": "status"}
+    POST /sequence {"port": "COM6", "pulse": {"relay": 3, "duration": 0.15}}
+    GET  /metrics                        - метрики в формате Prometheus
+WebSocket /ws: те же JSON-запросы, что и POST /relay, с необязательным полем "id",
+которое возвращается в ответе; кроме ответов сервер присылает события изменения состояния.
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from relay_metrics import RelayMetrics
+from relay_protocol import (DEFAULT_TIMEOUT, MIN_RELAY, RelayReply, command_frame,
+                            list_ports, parse_relay_spec, reply_frame)
+from relay_sequence import SequenceReport, build_sequence, load_sequences
+from relay_worker import SerialWorker
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+# События воркера, которые рассылаются подписчикам WebSocket
+PUSH_EVENTS = ("response", "late_response", "state_changed", "opened", "closed", "connection_lost",
+               "reconnecting", "port_renamed")
+
+
+class RequestError(ValueError):
+    """Некорректный запрос клиента"""
+
+
+def event_to_json(event):
+    """Переводит событие воркера в JSON-совместимый словарь"""
+    result = {"type": event["type"], "port": event.get("port")}
+    for key in ("relay", "relays", "command", "error", "missing", "errors", "state", "previous", "skipped",
+                "reconnecting", "attempt", "delay", "new_port"):
+        if event.get(key) is not None:
+            result[key] = event[key]
+    reply = event.get("reply")
+    if reply is not None:
+        result["relay"] = reply.relay
+        result["status"] = reply.status
+        result["state"] = reply.state
+    if "replies" in event:
+        result["states"] = {str(relay): reply.state for relay, reply in event["replies"].items()}
+        result["statuses"] = {str(relay): reply.status for relay, reply in event["replies"].items()}
+    if event["type"] == "invalid_response":
+        result["response"] = event["response"].hex(" ").upper()
+    if event.get("sent_at") is not None and event.get("done_at") is not None:
+        result["latency_ms"] = round((event["done_at"] - event["sent_at"]) * 1000, 3)
+    return result
+
+
+class RelayDaemon:
+    """Один SerialWorker на порт и синхронное выполнение запросов клиентов"""
+
+    def __init__(self, pipeline_window=0, request_timeout=30.0, metrics=None, relay_count=8):
+        self.pipeline_window = pipeline_window
+        self.request_timeout = request_timeout
+        self.metrics = metrics
+        self.relay_count = relay_count
+        self.lock = threading.Lock()
+        self.workers = {}
+        # Состояние открытия порта: threading.Event и текст ошибки
+        self.open_status = {}
+        self.subscribers = set()
+
+    def on_event(self, event):
+        port = event.get("port")
+        if event["type"] in ("opened", "open_failed"):
+            status = self.open_status.get(port)
+            if status is not None:
+                status["error"] = event.get("error")
+                status["ready"].set()
+        if event["type"] in PUSH_EVENTS:
+            with self.lock:
+                subscribers = list(self.subscribers)
+            if not subscribers:
+                return
+            # push только ставит сообщение в очередь соединения и не задерживает поток порта
+            message = json.dumps({"event": event_to_json(event)})
+            for subscriber in subscribers:
+                subscriber.push(message)
+
+    def subscribe(self, connection):
+        with self.lock:
+            self.subscribers.add(connection)
+
+    def unsubscribe(self, connection):
+        with self.lock:
+            self.subscribers.discard(connection)
+
+    def ensure_open(self, port):
+        """Возвращает воркер открытого порта, открывая его при первом обращении"""
+        with self.lock:
+            worker = self.workers.get(port)
+            if worker is None:
+                worker = SerialWorker(self.on_event, self.pipeline_window, metrics=self.metrics)
+                worker.name = "SerialWorker-" + str(port)
+                self.workers[port] = worker
+                self.open_status[port] = {"ready": threading.Event(), "error": None}
+                worker.start()
+                worker.open(port)
+            status = self.open_status[port]
+        if not status["ready"].wait(worker.TIMEOUT + 5):
+            raise RequestError("Timed out opening port {}".format(port))
+        if status["error"] is not None:
+            # Следующий запрос снова попробует открыть порт
+            with self.lock:
+                if self.workers.get(port) is worker:
+                    del self.workers[port]
+                    del self.open_status[port]
+            worker.stop()
+            raise RequestError(status["error"])
+        return worker
+
+    def close_port(self, port):
+        with self.lock:
+            worker = self.workers.pop(port, None)
+            self.open_status.pop(port, None)
+        if worker is not None:
+            worker.stop(timeout=worker.TIMEOUT + 1)
+
+    def execute(self, request):
+        """Выполняет JSON-запрос к реле и возвращает итоговое событие в виде словаря"""
+        port = request.get("port")
+        command = request.get("command")
+        if not port:
+            raise RequestError("'port' is required")
+        if command not in ("on", "off", "toggle", "status"):
+            raise RequestError("'command' must be one of on, off, toggle, status")
+        feedback = bool(request.get("feedback", False))
+        try:
+            if "relays" in request:
+                relays = request["relays"]
+                if isinstance(relays, str):
+                    relays = parse_relay_spec(relays, range(MIN_RELAY, self.relay_count + 1))
+                relays = [int(relay) for relay in relays]
+                for relay in relays:
+                    command_frame(relay, command)
+            else:
+                relay = int(request.get("relay", 0))
+                command_frame(relay, command)
+        except (TypeError, ValueError) as e:
+            raise RequestError(str(e)) from None
+
+        worker = self.ensure_open(port)
+        finished = threading.Event()
+        results = []
+
+        def done(event):
+            results.append(event)
+            finished.set()
+
+        if "relays" in request:
+            worker.send_batch(relays, command, feedback, done)
+        else:
+            worker.send(relay, command, feedback, done)
+        if not finished.wait(self.request_timeout):
+            raise RequestError("Request timed out in the port queue")
+        return event_to_json(results[0])
+
+    def run_sequence(self, request):
+        """Выполняет последовательность из запроса или по имени из relay_sequences.json"""
+        port = request.get("port")
+        if not port:
+            raise RequestError("'port' is required")
+        try:
+            if "name" in request:
+                sequence = load_sequences().get(request["name"])
+                if sequence is None:
+                    raise RequestError("Unknown sequence: {}".format(request["name"]))
+            else:
+                sequence = build_sequence("request", request)
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError(str(e)) from None
+
+        worker = self.ensure_open(port)
+        finished = threading.Event()
+        results = []
+
+        def done(event):
+            results.append(event)
+            finished.set()
+
+        worker.run_sequence(sequence, done)
+        if not finished.wait(self.request_timeout + sequence.duration):
+            raise RequestError("Request timed out in the port queue")
+        event = results[0]
+        result = event_to_json(event)
+        report = event.get("report")
+        if report is not None:
+            result.update(sequence=report.name, steps=report.steps, completed=report.completed,
+                          duration_ms=round(report.duration * 1000, 3))
+            if report.completed:
+                result.update(jitter_mean_ms=round(report.jitter_mean * 1000, 3),
+                              jitter_max_ms=round(report.jitter_max * 1000, 3),
+                              jitter_p99_ms=round(report.jitter_p99 * 1000, 3))
+        return result
+
+    def states(self, port):
+        worker = self.workers.get(port)
+        client = worker.client if worker is not None else None
+        return dict(client.states) if client is not None else {}
+
+    def ports(self):
+        return {"available": list_ports(), "open": sorted(self.workers)}
+
+    def shutdown(self):
+        for port in list(self.workers):
+            self.close_port(port)
+
+
+class WebSocketConnection:
+    """Минимальная серверная часть RFC 6455: текстовые кадры, ping/pong и закрытие
+
+    Сообщения отправляет отдельный поток из очереди, поэтому медленный клиент не задерживает
+    потоки портов; клиент, который отстал больше чем на OUTBOX_LIMIT сообщений, отключается.
+    """
+    OUTBOX_LIMIT = 1000
+
+    def __init__(self, handler):
+        self.rfile = handler.rfile
+        self.wfile = handler.wfile
+        self.socket = handler.connection
+        self.write_lock = threading.Lock()
+        self.closed = False
+        self.outbox = queue.Queue(self.OUTBOX_LIMIT)
+        self.writer = threading.Thread(target=self.write_loop, name="WebSocketWriter", daemon=True)
+        self.writer.start()
+
+    def push(self, text):
+        """Ставит текстовое сообщение в очередь отправки без ожидания"""
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(text)
+        except queue.Full:
+            self.close()
+            try:
+                # Прерываем и зависшую запись, и чтение в потоке обработчика
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def write_loop(self):
+        while True:
+            text = self.outbox.get()
+            if text is None or self.closed:
+                return
+            self.send(0x1, text.encode("utf-8"))
+
+    def close(self):
+        self.closed = True
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def send(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self.write_lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(header + payload)
+                self.wfile.flush()
+            except (OSError, ValueError):
+                # ValueError - файл уже закрыт обработчиком, который завершил соединение
+                self.closed = True
+
+    def receive(self):
+        """Возвращает следующее текстовое сообщение или None, если соединение закрыто"""
+        message = bytearray()
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return None
+            first, second = header
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if second & 0x80 else None
+            payload = self.rfile.read(length)
+            if mask:
+                # Снимаем маску целыми словами, а не побайтно
+                key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+                payload = (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big")
+            if opcode == 0x8:
+                self.send(0x8, payload[:2])
+                return None
+            if opcode == 0x9:
+                self.send(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if first & 0x80:
+                return message.decode("utf-8")
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RelayDaemon/1.0"
+    # Заголовки и тело уходят отдельными записями; без TCP_NODELAY keep-alive упирается в delayed ACK
+    disable_nagle_algorithm = True
+
+    @property
+    def daemon(self):
+        return self.server.relay_daemon
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, request):
+        try:
+            self.send_json(200, self.daemon.execute(request))
+        except RequestError as e:
+            self.send_json(400, {"error": str(e)})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+            self.serve_websocket()
+        elif url.path == "/relay":
+            if "feedback" in query:
+                query["feedback"] = query["feedback"].lower() in ("1", "true", "yes")
+            self.handle_request(query)
+        elif url.path == "/states":
+            states = self.daemon.states(query.get("port"))
+            self.send_json(200, {"port": query.get("port"),
+                                 "states": {str(relay): state for relay, state in states.items()}})
+        elif url.path == "/ports":
+            self.send_json(200, self.daemon.ports())
+        elif url.path == "/metrics" and self.daemon.metrics is not None:
+            body = self.daemon.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "Invalid JSON"})
+            return
+        if not isinstance(request, dict):
+            self.send_json(400, {"error": "Request must be a JSON object"})
+            return
+        path = urlsplit(self.path).path
+        if path == "/relay":
+            self.handle_request(request)
+        elif path == "/sequence":
+            try:
+                self.send_json(200, self.daemon.run_sequence(request))
+            except RequestError as e:
+                self.send_json(400, {"error": str(e)})
+        elif path == "/open":
+            try:
+                self.daemon.ensure_open(request.get("port"))
+                self.send_json(200, {"port": request.get("port"), "open": True})
+            except RequestError as e:
+                self.send_json(400, {"error": str(e)})
+        elif path == "/close":
+            self.daemon.close_port(request.get("port"))
+            self.send_json(200, {"port": request.get("port"), "open": False})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def serve_websocket(self):
+        key = self.headers.get("Sec-WebSocket-Key", "").encode("ascii")
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest()).decode("ascii")
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        connection = WebSocketConnection(self)
+        self.daemon.subscribe(connection)
+        try:
+            while True:
+                text = connection.receive()
+                if text is None:
+                    break
+                request = None
+                try:
+                    request = json.loads(text)
+                    if not isinstance(request, dict):
+                        raise RequestError("Request must be a JSON object")
+                    response = self.daemon.execute(request)
+                except (ValueError, RequestError) as e:
+                    response = {"error": str(e)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                connection.push(json.dumps(response))
+        except OSError:
+            pass
+        finally:
+            self.daemon.unsubscribe(connection)
+            connection.close()
+            # Сервер закроет wfile после возврата; даем писателю закончить текущую запись
+            connection.writer.join(1.0)
+            self.close_connection = True
+
+
+def serve(daemon, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.relay_daemon = daemon
+    return server
+
+
+class RemoteWorker(SerialWorker):
+    """Замена SerialWorker для GUI, которая выполняет команды через сервис по HTTP"""
+
+    def __init__(self, url, on_event, metrics=None, timeout=DEFAULT_TIMEOUT):
+        # Переподключением к порту занимается сам сервис
+        super().__init__(on_event, metrics=metrics, reconnect=False)
+        parts = urlsplit(url)
+        self.host = parts.hostname or DEFAULT_HOST
+        self.http_port = parts.port or DEFAULT_PORT
+        self.http_timeout = timeout + 30
+        self.connection = None
+        self.remote_open = False
+        self.states = {}
+
+    def request(self, method, path, body=None):
+        """Выполняет запрос по постоянному соединению, переподключаясь один раз при обрыве"""
+        payload = None if body is None else json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.http_port,
+                                                             timeout=self.http_timeout)
+            try:
+                self.connection.request(method, path, payload, headers)
+                response = self.connection.getresponse()
+                data = json.loads(response.read() or b"{}")
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise OSError(data.get("error", "HTTP {}".format(response.status)))
+            return data
+
+    def is_open(self):
+        return self.remote_open
+
+    def _open(self, port, auto, known_states=None):
+        self.port = port
+        try:
+            self.request("POST", "/open", {"port": port})
+        except OSError as e:
+            self.remote_open = False
+            self.emit("open_failed", error=str(e), auto=auto)
+            return
+        self.remote_open = True
+        self.emit("opened", auto=auto)
+
+    def _drop_port(self):
+        # Порт принадлежит сервису и остается открытым для других клиентов
+        self.remote_open = False
+
+    def _command(self, body, done):
+        """Отправляет команду сервису и повторяет события так, как их выдал бы SerialWorker"""
+        relays = body.get("relays")
+        timing = {"queued_at": body.pop("queued_at"), "sent_at": time.monotonic()}
+        target = {"relays": relays} if relays is not None else {"relay": body["relay"]}
+        if not self.is_open():
+            self.finish(done, "not_connected", command=body["command"], **target, **timing)
+            return
+        try:
+            result = self.request("POST", "/relay", body)
+        except OSError as e:
+            self._drop_port()
+            self.finish(done, "connection_lost", error=str(e), command=body["command"], **target, **timing)
+            return
+        timing["done_at"] = time.monotonic()
+        event_type = result["type"]
+        if relays is not None:
+            frame = b"".join(command_frame(relay, body["command"], body["feedback"]) for relay in relays)
+        else:
+            frame = command_frame(body["relay"], body["command"], body["feedback"])
+        if event_type == "sent":
+            self.finish(done, "sent", frame=frame, command=body["command"], **target, **timing)
+            return
+        if event_type not in ("not_connected", "error"):
+            self.emit("sent", frame=frame, command=body["command"], **target, **timing)
+
+        data = {"command": body["command"]}
+        data.update(target)
+        if event_type == "response":
+            reply = RelayReply(result["relay"], result["status"], result["state"])
+            self.states[reply.relay] = reply.state
+            data.update(reply=reply, response=reply_frame(reply))
+        elif event_type == "batch_response":
+            replies = {int(relay): RelayReply(int(relay), status, result["states"][relay])
+                       for relay, status in result.get("statuses", {}).items()}
+            for relay, reply in replies.items():
+                self.states[relay] = reply.state
+            response = b"".join(reply_frame(reply) for reply in replies.values())
+            data.update(replies=replies, missing=result.get("missing", []),
+                        errors=result.get("errors", []), response=response)
+        elif event_type == "invalid_response":
+            data.update(error=result["error"], response=bytes.fromhex(result["response"]))
+        elif "error" in result:
+            data["error"] = result["error"]
+        self.finish(done, event_type, **data, **timing)
+
+    def _send(self, relay_num, command, feedback, queued_at, done=None):
+        self._command({"port": self.port, "relay": relay_num, "command": command,
+                       "feedback": feedback, "queued_at": queued_at}, done)
+
+    def _send_batch(self, relays, command, feedback, queued_at, done=None):
+        self._command({"port": self.port, "relays": relays, "command": command,
+                       "feedback": feedback, "queued_at": queued_at}, done)
+
+    def _run_sequence(self, sequence, done=None):
+        """Передает шаги последовательности сервису, который выполняет их у себя рядом с портом"""
+        if not self.is_open():
+            self.finish(done, "not_connected", sequence=sequence.name)
+            return
+        body = {"port": self.port,
+                "steps": [{"at": step.at, "relays": step.relays, "command": step.command}
+                          for step in sequence.steps]}
+        self.emit("sequence_started", sequence=sequence.name, steps=len(sequence.steps))
+        try:
+            result = self.request("POST", "/sequence", body)
+        except OSError as e:
+            self._drop_port()
+            self.finish(done, "connection_lost", error=str(e), sequence=sequence.name)
+            return
+        if result["type"] != "sequence_done":
+            self.finish(done, result["type"], error=result.get("error"), sequence=sequence.name)
+            return
+
+        def seconds(key):
+            return None if result.get(key) is None else result[key] / 1000
+
+        report = SequenceReport(sequence.name, result["steps"], result["completed"],
+                                seconds("jitter_mean_ms"), seconds("jitter_max_ms"), seconds("jitter_p99_ms"),
+                                seconds("duration_ms"), [])
+        states = sequence.final_states() if report.completed == report.steps else {}
+        self.states.update(states)
+        self.finish(done, "sequence_done", sequence=sequence.name, report=report, states=states)
+
+    def _poll(self, relays, callback):
+        if not self.is_open():
+            callback(False)
+            return
+        try:
+            result = self.request("POST", "/relay", {"port": self.port, "relays": relays,
+                                                     "command": "status"})
+        except OSError as e:
+            self._drop_port()
+            self.emit("connection_lost", error=str(e))
+            callback(False)
+            return
+        statuses = result.get("statuses", {})
+        changed = False
+        for relay_num in relays:
+            status = statuses.get(str(relay_num))
+            reply = None if status is None else RelayReply(relay_num, status, result["states"][str(relay_num)])
+            state = reply.state if reply is not None else "unknown"
+            previous = self.states.get(relay_num)
+            self.states[relay_num] = state
+            if previous != state:
+                changed = True
+                self.emit("state_changed", relay=relay_num, state=state, reply=reply, previous=previous)
+        callback(changed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relay control daemon with HTTP/JSON and WebSocket API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--listen-port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--port", action="append", default=[],
+                        help="serial port to open at startup (may be repeated)")
+    parser.add_argument("--pipeline-window", type=int, default=0)
+    parser.add_argument("--relay-count", type=int, default=8, help="relays covered by 'all'")
+    args = parser.parse_args(argv)
+
+    daemon = RelayDaemon(args.pipeline_window, metrics=RelayMetrics(), relay_count=args.relay_count)
+    for port in args.port:
+        try:
+            daemon.ensure_open(port)
+        except RequestError as e:
+            print("{}: {}".format(port, e), file=sys.stderr)
+    server = serve(daemon, args.host, args.listen_port)
+    print("Listening on http://{}:{}".format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
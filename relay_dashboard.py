@@ -0,0 +1,131 @@
+"""Сетка индикаторов всех реле по портам
+
+Ячейки создаются один раз при раскладке, а смена состояния меняет только цвет
+существующих элементов холста через itemconfigure. Изменения копятся и рисуются
+не чаще одного раза за кадр, поэтому частый опрос сотен реле не загружает UI.
+"""
+import tkinter as tk
+from tkinter import ttk
+
+COLORS = {"on": "red", "off": "green"}
+UNKNOWN_COLOR = "gray"
+
+
+def state_colors(state):
+    """Цвет заливки и цвет номера реле для состояния"""
+    if state in COLORS:
+        return COLORS[state], "white"
+    return UNKNOWN_COLOR, "black"
+
+
+class RelayDashboard(ttk.Frame):
+    """Индикаторы реле на одном холсте; on_select(port, relay) вызывается по щелчку"""
+    CELL = 32
+    HEADER = 22
+    PADDING = 4
+    # Период пакетной перерисовки, примерно один кадр при 60 Гц
+    FRAME_MS = 16
+
+    def __init__(self, parent, columns=16, on_select=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.on_select = on_select
+        self.canvas = tk.Canvas(self, highlightthickness=0, width=columns * self.CELL + 2 * self.PADDING,
+                                height=4 * self.CELL + self.HEADER)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        self.canvas.tag_bind("cell", "<Button-1>", self.on_click)
+
+        # Номера реле каждого порта в порядке раскладки
+        self.sections = {}
+        # (порт, реле) -> (id круга, id номера) и обратный индекс для щелчков
+        self.cells = {}
+        self.cell_keys = {}
+        # Нарисованное состояние и изменения, ожидающие перерисовки
+        self.drawn = {}
+        self.pending = {}
+        self.redraw_job = None
+        self.selected = None
+
+    def set_relays(self, port, relays):
+        """Добавляет реле порта в сетку; раскладка пересчитывается, только если набор изменился"""
+        known = self.sections.get(port, [])
+        merged = sorted(set(known).union(relays))
+        if merged == known:
+            return
+        self.sections[port] = merged
+        self.layout()
+
+    def layout(self):
+        canvas = self.canvas
+        canvas.delete("all")
+        self.cells.clear()
+        self.cell_keys.clear()
+        size = self.CELL - 2 * self.PADDING
+        y = self.PADDING
+        for port in sorted(self.sections, key=str):
+            relays = self.sections[port]
+            canvas.create_text(self.PADDING, y + self.HEADER // 2, anchor="w", text=str(port))
+            y += self.HEADER
+            for index, relay in enumerate(relays):
+                row, column = divmod(index, self.columns)
+                x0 = self.PADDING + column * self.CELL
+                y0 = y + row * self.CELL
+                fill, text_fill = state_colors(self.drawn.get((port, relay)))
+                width = 3 if (port, relay) == self.selected else 1
+                oval = canvas.create_oval(x0, y0, x0 + size, y0 + size, fill=fill, outline="black",
+                                          width=width, tags=("cell",))
+                text = canvas.create_text(x0 + size // 2, y0 + size // 2, text=str(relay), fill=text_fill,
+                                          tags=("cell",))
+                self.cells[(port, relay)] = (oval, text)
+                self.cell_keys[oval] = self.cell_keys[text] = (port, relay)
+            y += -(-len(relays) // self.columns) * self.CELL + self.PADDING
+        canvas.configure(scrollregion=(0, 0, self.columns * self.CELL + 2 * self.PADDING, y))
+
+    def set_state(self, port, relay, state):
+        """Запоминает новое состояние; рисование откладывается до ближайшего кадра"""
+        if (port, relay) not in self.cells:
+            self.set_relays(port, [relay])
+        self.pending[(port, relay)] = state
+        if self.redraw_job is None:
+            self.redraw_job = self.after(self.FRAME_MS, self.redraw)
+
+    def redraw(self):
+        """Меняет цвет только тех ячеек, состояние которых действительно изменилось"""
+        self.redraw_job = None
+        pending, self.pending = self.pending, {}
+        for key, state in pending.items():
+            if self.drawn.get(key) == state:
+                continue
+            self.drawn[key] = state
+            oval, text = self.cells[key]
+            fill, text_fill = state_colors(state)
+            self.canvas.itemconfigure(oval, fill=fill)
+            self.canvas.itemconfigure(text, fill=text_fill)
+
+    def select(self, port, relay):
+        """Выделяет ячейку текущего реле толстой рамкой"""
+        key = (port, relay)
+        if key == self.selected:
+            return
+        if self.selected in self.cells:
+            self.canvas.itemconfigure(self.cells[self.selected][0], width=1)
+        self.selected = key
+        if key in self.cells:
+            self.canvas.itemconfigure(self.cells[key][0], width=3)
+
+    def on_click(self, event):
+        item = self.canvas.find_withtag("current")
+        key = self.cell_keys.get(item[0]) if item else None
+        if key is not None and self.on_select is not None:
+            self.on_select(*key)
+
+    def destroy(self):
+        if self.redraw_job is not None:
+            self.after_cancel(self.redraw_job)
+            self.redraw_job = None
+        super().destroy()
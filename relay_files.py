@@ -0,0 +1,68 @@
+"""Общие приемы записи файлов: атомарная замена целиком и дозапись из фонового потока"""
+import os
+import queue
+import threading
+
+
+def atomic_write(path, data, encoding="utf-8"):
+    """Заменяет файл новым содержимым так, что читатель видит либо старый, либо новый файл
+
+    Данные пишутся во временный файл в том же каталоге и сбрасываются на диск до os.replace.
+    Имя временного файла уникально для процесса и потока, поэтому одновременная запись
+    одного пути из разных мест не смешивает содержимое.
+    """
+    temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        if isinstance(data, bytes):
+            f = open(temp_path, "wb")
+        else:
+            f = open(temp_path, "w", encoding=encoding)
+        with f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class BackgroundWriter(threading.Thread):
+    """Поток, который забирает записи из очереди пачками и сбрасывает файл один раз на пачку
+
+    Наследник реализует handle(item), а также flush_file() и close_file() для своего файла.
+    None в очереди завершает поток после всех поставленных раньше записей.
+    """
+
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.items = queue.Queue()
+
+    def run(self):
+        item = self.items.get()
+        while item is not None:
+            self.handle(item)
+            # Обрабатываем все, что успело накопиться, и сбрасываем файл один раз
+            try:
+                item = self.items.get_nowait()
+            except queue.Empty:
+                self.flush_file()
+                item = self.items.get()
+        self.close_file()
+
+    def handle(self, item):
+        raise NotImplementedError
+
+    def flush_file(self):
+        pass
+
+    def close_file(self):
+        pass
+
+    def close(self):
+        """Дописывает очередь, закрывает файл и дожидается потока"""
+        self.items.put(None)
+        self.join()
@@ -0,0 +1,164 @@
+"""Журнал подтвержденных состояний реле, который переживает перезапуск приложения
+
+Каждое изменение дописывается в конец файла строкой JSON:
+
+    {"t": 1760700000.123, "port": "COM6", "relay": 5, "state": "on"}
+
+При загрузке из журнала берется последнее состояние каждого реле. Когда повторяющихся
+строк становится слишком много, файл переписывается только последними записями
+через временный файл и os.replace.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+from relay_files import BackgroundWriter, atomic_write
+
+JOURNAL_FILE = "relay_states.jsonl"
+# Сжатие выполняется, когда устаревших строк больше этого числа
+COMPACT_THRESHOLD = 10000
+
+_COMPACT = object()
+
+
+def journal_line(t, port, relay, state):
+    return json.dumps({"t": t, "port": port, "relay": relay, "state": state}) + "\n"
+
+
+def read_journal(path):
+    """Возвращает записи журнала (время, порт, реле, состояние); поврежденные строки пропускаются"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                yield entry["t"], entry["port"], int(entry["relay"]), entry["state"]
+            except (ValueError, KeyError, TypeError):
+                # Недописанная при сбое последняя строка не мешает прочитать остальные
+                continue
+
+
+class StateJournal(BackgroundWriter):
+    """Последние состояния реле в памяти и дозапись изменений в файл из фонового потока"""
+
+    def __init__(self, path=JOURNAL_FILE, compact_threshold=COMPACT_THRESHOLD):
+        super().__init__(name="StateJournal")
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        # (порт, реле) -> (состояние, время изменения)
+        self.last = {}
+        lines = 0
+        for t, port, relay, state in read_journal(path):
+            self.last[(port, relay)] = (state, t)
+            lines += 1
+        self.stale = lines - len(self.last)
+        self.file = None
+        self.start()
+        if self.stale > self.compact_threshold:
+            self.compact()
+
+    def record(self, port, relay, state, t=None):
+        """Запоминает подтвержденное состояние; в файл попадают только изменения"""
+        if state not in ("on", "off") or port is None:
+            return False
+        t = round(time.time() if t is None else t, 3)
+        with self.lock:
+            previous = self.last.get((port, relay))
+            if previous is not None and previous[0] == state:
+                return False
+            self.last[(port, relay)] = (state, t)
+            if previous is not None:
+                self.stale += 1
+            # Запись ставится в очередь под блокировкой, чтобы порядок совпадал с self.last
+            self.items.put((t, port, relay, state))
+            if self.stale > self.compact_threshold:
+                self.schedule_compact()
+        return True
+
+    def states(self, port):
+        """Последние известные состояния реле порта: номер -> "on"/"off\""""
+        with self.lock:
+            return {relay: state for (entry_port, relay), (state, _) in self.last.items()
+                    if entry_port == port}
+
+    def last_change(self, port, relay):
+        """(состояние, время) последнего изменения реле или None, если оно не записывалось"""
+        with self.lock:
+            return self.last.get((port, relay))
+
+    def compact(self):
+        """Планирует перезапись файла только последними состояниями"""
+        with self.lock:
+            self.schedule_compact()
+
+    def schedule_compact(self):
+        # Снимок берется в момент постановки в очередь: более поздние записи допишутся после него
+        snapshot = sorted((t, port, relay, state) for (port, relay), (state, t) in self.last.items())
+        self.stale = 0
+        self.items.put((_COMPACT, snapshot))
+
+    def handle(self, item):
+        try:
+            if item[0] is _COMPACT:
+                self.rewrite(item[1])
+            else:
+                if self.file is None:
+                    self.file = open(self.path, "a", encoding="utf-8")
+                t, port, relay, state = item
+                self.file.write(journal_line(t, port, relay, state))
+        except OSError:
+            # Журнал не должен останавливать работу с реле; состояние в памяти остается верным
+            pass
+
+    def rewrite(self, entries):
+        self.close_file()
+        atomic_write(self.path, "".join(journal_line(*entry) for entry in entries))
+
+    def flush_file(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Relay state journal tool")
+    parser.add_argument("--journal", default=JOURNAL_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    last_parser = commands.add_parser("last", help="when a relay last changed")
+    last_parser.add_argument("relay", type=int)
+    last_parser.add_argument("--port", help="only this port")
+    commands.add_parser("states", help="last known state of every relay")
+    commands.add_parser("compact", help="keep only the last state of every relay")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        journal = StateJournal(args.journal)
+        journal.compact()
+        journal.close()
+        return 0
+
+    last = {}
+    for t, port, relay, state in read_journal(args.journal):
+        last[(port, relay)] = (state, t)
+    found = False
+    for (port, relay), (state, t) in sorted(last.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        if args.command == "last" and (relay != args.relay or args.port not in (None, port)):
+            continue
+        found = True
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+        print("{} relay {}: {} since {}".format(port, relay, state, stamp))
+    return 0 if found or args.command == "states" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Ограниченный по размеру лог сообщений с выгрузкой старых строк в файл"""
+import time
+from collections import deque
+
+
+class LogBuffer:
+    """Кольцевой буфер строк лога, который накапливает новые строки до очередного сброса
+
+    Строки, вытесненные из буфера, дописываются в ротируемый файл, если он задан.
+    """
+
+    def __init__(self, max_lines=1000, spill_path=None, spill_max_bytes=1024 * 1024, spill_backups=3):
+        self.max_lines = max(1, max_lines)
+        # Строки, видимые в виджете, в виде (время, текст)
+        self.lines = deque()
+        self.pending = []
+        # Файл и модуль logging понадобятся только при первой выгрузке строк
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_backups = spill_backups
+        self.handler = None
+
+    def append(self, message):
+        self.pending.append((time.time(), message))
+
+    def flush(self):
+        """Переносит накопленные строки в буфер
+
+        Возвращает новые строки для вставки в виджет и число старых строк, которые нужно
+        удалить из начала виджета.
+        """
+        new = self.pending
+        if not new:
+            return [], 0
+        self.pending = []
+        old_count = len(self.lines)
+        self.lines.extend(new)
+        excess = len(self.lines) - self.max_lines
+        if excess <= 0:
+            return [message for _, message in new], 0
+
+        self.spill([self.lines.popleft() for _ in range(excess)])
+        # Если за один сброс пришло больше строк, чем помещается, часть их в виджет не попадет
+        visible = new[-self.max_lines:]
+        return [message for _, message in visible], min(excess, old_count)
+
+    def spill(self, entries):
+        if not self.spill_path or not entries:
+            return
+        import logging
+
+        if self.handler is None:
+            import logging.handlers
+
+            self.handler = logging.handlers.RotatingFileHandler(
+                self.spill_path, maxBytes=self.spill_max_bytes, backupCount=self.spill_backups,
+                encoding="utf-8", delay=True)
+            self.handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        for created, message in entries:
+            record = logging.makeLogRecord({"msg": message, "created": created,
+                                            "msecs": (created % 1) * 1000})
+            self.handler.emit(record)
+
+    def close(self):
+        """Выгружает в файл все строки, которые еще не были туда записаны"""
+        self.spill(list(self.lines) + self.pending)
+        self.lines.clear()
+        self.pending = []
+        if self.handler is not None:
+            self.handler.close()
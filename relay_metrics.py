@@ -0,0 +1,211 @@
+"""Счетчики и гистограммы задержек команд с выгрузкой в текстовом формате Prometheus"""
+import threading
+from bisect import bisect_left
+
+from relay_files import atomic_write
+
+# Границы корзин гистограммы времени обмена, в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COUNTERS = {
+    "relay_commands_total": "Relay commands sent",
+    "relay_timeouts_total": "Commands without a response before the timeout",
+    "relay_protocol_errors_total": "Invalid responses by kind",
+    "relay_late_responses_total": "Responses received after their request timed out",
+    "relay_connects_total": "Successful port opens",
+    "relay_reconnects_total": "Port opens after the first one",
+    "relay_connection_errors_total": "Port open failures and lost connections",
+}
+HISTOGRAM = "relay_round_trip_seconds"
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction):
+        """Оценка квантиля сверху по границам корзин"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return BUCKETS[index] if index < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                          for k, v in labels) + "}"
+
+
+class RelayMetrics:
+    """Потокобезопасный набор метрик, который заполняется из событий SerialWorker"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.opened_ports = set()
+        self.server = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, seconds, port, relay):
+        key = (("port", port), ("relay", relay))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def record(self, event):
+        """Учитывает событие воркера; вызывается в потоке воркера"""
+        event_type = event["type"]
+        port = event.get("port")
+        if event_type == "sent":
+            relays = event.get("relays") or [event.get("relay")]
+            for relay in relays:
+                self.inc("relay_commands_total", port=port, relay=relay)
+        elif event_type == "response":
+            self.observe(event["done_at"] - event["sent_at"], port, event["relay"])
+        elif event_type == "batch_response":
+            # Все ответы пакета пришли за одно чтение, поэтому время общее
+            elapsed = event["done_at"] - event["sent_at"]
+            for relay in event["replies"]:
+                self.observe(elapsed, port, relay)
+            for relay in event["missing"]:
+                self.inc("relay_timeouts_total", port=port, relay=relay)
+            for error in event["errors"]:
+                self.inc("relay_protocol_errors_total", port=port, kind=error)
+        elif event_type == "no_response":
+            self.inc("relay_timeouts_total", port=port, relay=event["relay"])
+        elif event_type == "invalid_response":
+            self.inc("relay_protocol_errors_total", port=port, kind=event["error"])
+        elif event_type == "late_response":
+            self.inc("relay_late_responses_total", port=port, relay=event["relay"])
+        elif event_type == "opened":
+            self.inc("relay_connects_total", port=port)
+            if port in self.opened_ports:
+                self.inc("relay_reconnects_total", port=port)
+            self.opened_ports.add(port)
+        elif event_type in ("open_failed", "connection_lost", "error") and not event.get("connected"):
+            # Ошибка команды при открытом порте не считается ошибкой соединения
+            self.inc("relay_connection_errors_total", port=port)
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus"""
+        with self.lock:
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            histograms = sorted(self.histograms.items(), key=lambda item: str(item[0]))
+            histograms = [(labels, list(h.counts), h.count, h.total) for labels, h in histograms]
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} counter".format(name))
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append("{}{} {}".format(name, format_labels(labels), value))
+        lines.append("# HELP {} Command round trip time (write + read)".format(HISTOGRAM))
+        lines.append("# TYPE {} histogram".format(HISTOGRAM))
+        for labels, counts, count, total in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(
+                    HISTOGRAM, format_labels(labels + (("le", bound),)), cumulative))
+            lines.append("{}_sum{} {}".format(HISTOGRAM, format_labels(labels), total))
+            lines.append("{}_count{} {}".format(HISTOGRAM, format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Строки для панели статистики: (порт, реле) -> словарь показателей"""
+        rows = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if "relay" not in labels:
+                    continue
+                row = rows.setdefault((labels["port"], labels["relay"]), {})
+                row[name] = value
+            for ((_, port), (_, relay)), histogram in self.histograms.items():
+                row = rows.setdefault((port, relay), {})
+                row["count"] = histogram.count
+                row["mean"] = histogram.total / histogram.count
+                row["p50"] = histogram.quantile(0.50)
+                row["p99"] = histogram.quantile(0.99)
+            port_rows = {}
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if "relay" in labels:
+                    continue
+                row = port_rows.setdefault(labels["port"], {})
+                key = name if "kind" not in labels else "{}:{}".format(name, labels["kind"])
+                row[key] = value
+        return rows, port_rows
+
+    def write_file(self, path):
+        """Атомарно записывает метрики в файл, например для textfile collector node_exporter"""
+        atomic_write(path, self.render())
+
+    def start_file_export(self, path, interval=15.0):
+        """Периодически переписывает файл метрик из фонового потока"""
+        stopped = threading.Event()
+
+        def export():
+            while not stopped.wait(interval):
+                try:
+                    self.write_file(path)
+                except OSError:
+                    pass
+
+        threading.Thread(target=export, name="MetricsFileExport", daemon=True).start()
+        return stopped
+
+    def serve(self, port, host="127.0.0.1"):
+        """Отдает метрики по HTTP на /metrics из фонового потока"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="MetricsHTTP", daemon=True).start()
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
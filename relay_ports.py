@@ -0,0 +1,261 @@
+"""Фоновое отслеживание последовательных портов с кэшем по VID/PID/серийному номеру
+
+PortWatcher один раз перечисляет порты, а затем применяет только изменения: на Linux -
+по событиям udev (если установлен pyudev), иначе - периодической проверкой, которая
+перечисляет порты заново только когда меняется список файлов устройств. Новые порты
+с USB-UART CH340 проверяются командой 0x05, чтобы отличить модули реле от других устройств.
+На Windows признаком изменения служит список значений HARDWARE\\DEVICEMAP\\SERIALCOMM в реестре.
+"""
+import glob
+import sys
+import threading
+from collections import namedtuple
+
+from relay_protocol import ProtocolError, RelayClient
+
+# USB-UART, на котором собраны LCUS-модули
+CH340_VID = 0x1A86
+CH340_PID = 0x7523
+# Шаблоны устройств, которые перечисляет serial.tools.list_ports на Linux
+LINUX_DEVICE_PATTERNS = ("/dev/ttyS*", "/dev/ttyUSB*", "/dev/ttyXRUSB*", "/dev/ttyACM*", "/dev/ttyAMA*",
+                         "/dev/rfcomm*", "/dev/ttyAP*", "/dev/ttyGS*")
+# Ключ реестра, в котором Windows перечисляет активные последовательные порты
+WINDOWS_SERIALCOMM_KEY = r"HARDWARE\DEVICEMAP\SERIALCOMM"
+
+# is_relay: True/False по результату проверки, None - порт не проверялся
+PortInfo = namedtuple("PortInfo", "device vid pid serial_number description is_relay")
+
+
+def is_ch340(info):
+    return info.vid == CH340_VID and info.pid == CH340_PID
+
+
+def identity_of(info):
+    """Ключ порта, который не меняется при переподключении; None для портов без USB"""
+    if info.vid is None:
+        return None
+    return (info.vid, info.pid, info.serial_number)
+
+
+def probe_relay(device, timeout=0.3, relay=1):
+    """Проверяет, отвечает ли устройство на запрос состояния как LCUS-модуль
+
+    Порт открывается монопольно: если его уже держит приложение, демон или CLI, проверка
+    пропускается, иначе запрос состояния забрал бы ответ, который ждет владелец порта.
+    """
+    try:
+        client = RelayClient.open(device, timeout=timeout, exclusive=True)
+    except Exception:
+        return False
+    try:
+        return client.send(relay, "status") is not None
+    except (ProtocolError, OSError):
+        return False
+    finally:
+        client.close()
+
+
+def scan_ports():
+    """Полное перечисление портов через pyserial"""
+    import serial.tools.list_ports
+
+    return {info.device: PortInfo(info.device, info.vid, info.pid, info.serial_number,
+                                  info.description, None)
+            for info in serial.tools.list_ports.comports()}
+
+
+def device_signature():
+    """Дешевый признак изменения набора портов; None, если на этой ОС его нет"""
+    if sys.platform.startswith("linux"):
+        return frozenset(path for pattern in LINUX_DEVICE_PATTERNS for path in glob.glob(pattern))
+    if sys.platform.startswith("win"):
+        return windows_signature()
+    return None
+
+
+def windows_signature():
+    """Пары (драйвер, COM-порт) из реестра; чтение ключа намного дешевле comports()"""
+    import winreg
+
+    try:
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, WINDOWS_SERIALCOMM_KEY)
+    except FileNotFoundError:
+        # Ключ создается при появлении первого порта
+        return frozenset()
+    except OSError:
+        return None
+    values = []
+    with key:
+        index = 0
+        while True:
+            try:
+                name, value, _ = winreg.EnumValue(key, index)
+            except OSError:
+                break
+            values.append((name, value))
+            index += 1
+    return frozenset(values)
+
+
+class PortWatcher(threading.Thread):
+    """Поддерживает кэш портов в фоне; чтение кэша не обращается к системе
+
+    on_change(added, removed) вызывается из потока наблюдателя со списками имен портов.
+    in_use(device) позволяет не проверять порт, который приложение открыло или открывает.
+    """
+
+    def __init__(self, on_change=None, interval=1.0, probe=True, in_use=None, use_udev=True):
+        super().__init__(name="PortWatcher", daemon=True)
+        self.on_change = on_change
+        self.interval = interval
+        self.probe = probe
+        self.in_use = in_use
+        self.use_udev = use_udev
+        self.lock = threading.Lock()
+        self.ports = {}
+        # Индекс VID/PID/серийный номер -> имена портов
+        self.by_identity = {}
+        self.ready = threading.Event()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.signature = None
+
+    def devices(self):
+        """Имена известных портов; модули реле идут первыми"""
+        with self.lock:
+            ports = list(self.ports.values())
+        return [info.device for info in sorted(ports, key=lambda info: (info.is_relay is not True,
+                                                                        info.device))]
+
+    def relay_devices(self):
+        with self.lock:
+            return sorted(info.device for info in self.ports.values() if info.is_relay)
+
+    def info(self, device):
+        with self.lock:
+            return self.ports.get(device)
+
+    def identity(self, device):
+        info = self.info(device)
+        return identity_of(info) if info is not None else None
+
+    def find(self, identity):
+        """Имена портов с указанной идентичностью"""
+        with self.lock:
+            return list(self.by_identity.get(tuple(identity), ()))
+
+    def kick(self):
+        """Запрашивает полное перечисление, не дожидаясь следующей проверки"""
+        self.signature = None
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def apply(self, added, removed):
+        """Вносит изменения в кэш и индекс и сообщает о них"""
+        with self.lock:
+            for device in removed:
+                info = self.ports.pop(device, None)
+                key = identity_of(info) if info is not None else None
+                if key is not None:
+                    devices = self.by_identity.get(key, [])
+                    if device in devices:
+                        devices.remove(device)
+                    if not devices:
+                        self.by_identity.pop(key, None)
+            for info in added:
+                self.ports[info.device] = info
+                key = identity_of(info)
+                if key is not None:
+                    devices = self.by_identity.setdefault(key, [])
+                    if info.device not in devices:
+                        devices.append(info.device)
+        if (added or removed) and self.on_change is not None:
+            self.on_change([info.device for info in added], list(removed))
+
+    def identify(self, info):
+        """Проверяет новый порт CH340 запросом состояния"""
+        if not self.probe or not is_ch340(info):
+            return info
+        if self.in_use is not None and self.in_use(info.device):
+            return info._replace(is_relay=True)
+        return info._replace(is_relay=probe_relay(info.device))
+
+    def rescan(self):
+        """Полное перечисление с применением разницы к кэшу"""
+        found = scan_ports()
+        with self.lock:
+            known = dict(self.ports)
+        # Порт с прежним именем, но другим устройством заменяется целиком
+        changed = [device for device, info in found.items()
+                   if device in known and identity_of(known[device]) != identity_of(info)]
+        added = [self.identify(info) for device, info in found.items()
+                 if device not in known or device in changed]
+        removed = [device for device in known if device not in found] + changed
+        self.apply(added, removed)
+
+    def run(self):
+        try:
+            self.signature = device_signature()
+            self.rescan()
+        except Exception:
+            pass
+        self.ready.set()
+        monitor = self.udev_monitor() if self.use_udev else None
+        while not self.stopped.is_set():
+            try:
+                if monitor is not None:
+                    self.watch_udev(monitor)
+                else:
+                    self.wakeup.wait(self.interval)
+                    self.wakeup.clear()
+                    self.poll()
+            except Exception:
+                # Наблюдатель не должен останавливаться из-за одного неудачного перечисления
+                self.stopped.wait(self.interval)
+
+    def poll(self):
+        signature = device_signature()
+        if signature is not None and signature == self.signature:
+            return
+        self.signature = signature
+        if not self.stopped.is_set():
+            self.rescan()
+
+    def udev_monitor(self):
+        """Монитор событий udev для tty или None, если pyudev недоступен"""
+        try:
+            import pyudev
+        except ImportError:
+            return None
+        try:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by("tty")
+            monitor.start()
+        except Exception:
+            return None
+        return monitor
+
+    def watch_udev(self, monitor):
+        """Применяет одно событие udev; без событий проверяет запрос полного перечисления"""
+        device = monitor.poll(timeout=self.interval)
+        if self.wakeup.is_set():
+            self.wakeup.clear()
+            self.rescan()
+        if device is None or device.device_node is None:
+            return
+        if device.action == "remove":
+            self.apply([], [device.device_node])
+        elif device.action == "add":
+            properties = device.properties
+            if "ID_VENDOR_ID" not in properties:
+                # Не USB-порт: его описание проще получить полным перечислением
+                self.rescan()
+                return
+            info = PortInfo(device.device_node, int(properties["ID_VENDOR_ID"], 16),
+                            int(properties["ID_MODEL_ID"], 16), properties.get("ID_SERIAL_SHORT"),
+                            properties.get("ID_MODEL_FROM_DATABASE", properties.get("ID_MODEL", "n/a")),
+                            None)
+            self.apply([self.identify(info)], [])
@@ -0,0 +1,548 @@
+"""Протокол LCUS-реле без зависимости от Tkinter"""
+import time
+from collections import deque, namedtuple
+
+HEADER = 0xA0
+FRAME_SIZE = 4
+MIN_RELAY = 1
+MAX_RELAY = 254
+
+CMD_OFF = 0x00
+CMD_ON = 0x01
+CMD_OFF_FEEDBACK = 0x02
+CMD_ON_FEEDBACK = 0x03
+CMD_TOGGLE = 0x04
+CMD_STATUS = 0x05
+COMMAND_CODES = (CMD_OFF, CMD_ON, CMD_OFF_FEEDBACK, CMD_ON_FEEDBACK, CMD_TOGGLE, CMD_STATUS)
+
+# Коды команд без обратной связи и с ней
+COMMANDS = {
+    "off": (CMD_OFF, CMD_OFF_FEEDBACK),
+    "on": (CMD_ON, CMD_ON_FEEDBACK),
+    "toggle": (CMD_TOGGLE, CMD_TOGGLE),
+    "status": (CMD_STATUS, CMD_STATUS)
+}
+
+DEFAULT_BAUDRATE = 9600
+DEFAULT_TIMEOUT = 2
+
+RelayReply = namedtuple("RelayReply", "relay status state")
+# outcome: "ok", "sent" (ответ не ожидался), "timeout" или "late" (ответ без ожидающего запроса);
+# tag - произвольное значение, переданное в RelayPipeline.submit
+PipelineResult = namedtuple("PipelineResult", "relay command reply outcome queued_at sent_at done_at tag")
+
+
+class ProtocolError(ValueError):
+    """Некорректный ответ модуля; key совпадает с ключом строки перевода"""
+
+    def __init__(self, key, response=b""):
+        super().__init__(key)
+        self.key = key
+        self.response = bytes(response)
+
+
+def checksum(data1, data2, data3):
+    return (data1 + data2 + data3) % 0x100
+
+
+def state_for_status(status):
+    """Переводит байт состояния из ответа в "on"/"off"/"unknown\""""
+    if status in (0x00, 0x02):
+        return "off"
+    if status in (0x01, 0x03):
+        return "on"
+    return "unknown"
+
+
+# Все 254×6 кадров команд вычисляются один раз: FRAMES[relay][code]
+FRAMES = (None,) + tuple(
+    tuple(bytes((HEADER, relay, code, checksum(HEADER, relay, code))) for code in COMMAND_CODES)
+    for relay in range(MIN_RELAY, MAX_RELAY + 1)
+)
+
+# Готовые ответы для известных кодов состояния, чтобы разбор не создавал объектов
+_REPLIES = tuple(
+    tuple(RelayReply(relay, status, state_for_status(status)) for status in COMMAND_CODES)
+    for relay in range(256)
+)
+
+
+def command_code(command, feedback=False):
+    """Возвращает код команды по имени"""
+    try:
+        return COMMANDS[command][1 if feedback else 0]
+    except KeyError:
+        raise ValueError("Unknown command: {}".format(command)) from None
+
+
+def check_relay(relay):
+    if not MIN_RELAY <= relay <= MAX_RELAY:
+        raise ValueError("Relay number must be between {} and {}".format(MIN_RELAY, MAX_RELAY))
+
+
+def build_frame(relay, code):
+    """Возвращает готовый кадр команды для реле"""
+    check_relay(relay)
+    return FRAMES[relay][code]
+
+
+def command_frame(relay, command, feedback=False):
+    """Возвращает кадр команды по имени команды"""
+    return build_frame(relay, command_code(command, feedback))
+
+
+def expects_response(command, feedback=False):
+    """Ожидает ли модуль ответ на команду; на 0x04 и 0x05 модуль отвечает всегда"""
+    return feedback or command in ("status", "toggle")
+
+
+def list_ports():
+    """Возвращает имена доступных последовательных портов"""
+    import serial.tools.list_ports
+
+    return [port.device for port in serial.tools.list_ports.comports()]
+
+
+def port_identity(port):
+    """(VID, PID, серийный номер) USB-порта или None, если порт не USB или не найден"""
+    if "://" in port:
+        # sim://, loop:// и другие адреса pyserial не соответствуют USB-устройству
+        return None
+    import serial.tools.list_ports
+
+    for info in serial.tools.list_ports.comports():
+        if info.device == port and info.vid is not None:
+            return (info.vid, info.pid, info.serial_number)
+    return None
+
+
+def find_port_by_identity(identity):
+    """Имена портов с указанной идентичностью; без серийного номера совпадение только по VID/PID"""
+    import serial.tools.list_ports
+
+    return [info.device for info in serial.tools.list_ports.comports()
+            if (info.vid, info.pid, info.serial_number) == tuple(identity)]
+
+
+def parse_relay_spec(spec, all_relays=None):
+    """Разбирает список реле вида "1-8", "1,3,5-7" или "all" в упорядоченный список номеров"""
+    relays = []
+    seen = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        if part == "all":
+            if all_relays is None:
+                raise ValueError("Relay count is not configured for 'all'")
+            numbers = all_relays
+        elif "-" in part:
+            first, last = part.split("-", 1)
+            numbers = range(int(first), int(last) + 1)
+        else:
+            numbers = (int(part),)
+        for relay in numbers:
+            check_relay(relay)
+            if relay not in seen:
+                seen.add(relay)
+                relays.append(relay)
+    if not relays:
+        raise ValueError("Empty relay list")
+    return relays
+
+
+def batch_frame(relays, command, feedback=False):
+    """Склеивает кадры команды для нескольких реле в одну запись"""
+    code = command_code(command, feedback)
+    for relay in relays:
+        check_relay(relay)
+    return b"".join([FRAMES[relay][code] for relay in relays])
+
+
+def parse_frame(buf, offset=0):
+    """Разбирает 4-байтовый кадр в bytes/bytearray/memoryview начиная с offset"""
+    if len(buf) - offset < FRAME_SIZE:
+        raise ProtocolError("invalid_response", buf[offset:])
+    data1 = buf[offset]
+    data2 = buf[offset + 1]
+    data3 = buf[offset + 2]
+
+    # Проверка контрольной суммы
+    if (data1 + data2 + data3) % 0x100 != buf[offset + 3]:
+        raise ProtocolError("checksum_error", buf[offset:offset + FRAME_SIZE])
+
+    # Проверка первого байта
+    if data1 != HEADER:
+        raise ProtocolError("invalid_first_byte", buf[offset:offset + FRAME_SIZE])
+
+    if data3 <= CMD_STATUS:
+        return _REPLIES[data2][data3]
+    return RelayReply(data2, data3, "unknown")
+
+
+def parse_response(response):
+    """Разбирает ответ модуля длиной ровно 4 байта"""
+    if len(response) != FRAME_SIZE:
+        raise ProtocolError("invalid_response", response)
+    return parse_frame(response)
+
+
+def reply_frame(reply):
+    """Восстанавливает байты ответа по разобранному RelayReply"""
+    return bytes((HEADER, reply.relay, reply.status, checksum(HEADER, reply.relay, reply.status)))
+
+
+def reply_matches(command, state):
+    """Может ли ответ с таким состоянием быть ответом на команду"""
+    if command in ("on", "off"):
+        return state == command
+    return True
+
+
+class RelayClient:
+    """Синхронный клиент LCUS-модуля поверх открытого последовательного порта"""
+
+    def __init__(self, serial_port, feedback=False):
+        self.serial_port = serial_port
+        self.feedback = feedback
+        # Последнее известное состояние реле по номеру
+        self.states = {}
+        # tap(direction, data) получает копию всего трафика: "tx" и "rx"
+        self.tap = None
+
+    @classmethod
+    def open(cls, port, baudrate=DEFAULT_BAUDRATE, timeout=DEFAULT_TIMEOUT, feedback=False,
+             exclusive=True):
+        """Открывает порт и возвращает клиента; адрес "sim://..." открывает виртуальный модуль
+
+        exclusive блокирует порт (на POSIX - через flock), чтобы другой процесс приложения,
+        демона или CLI не смог открыть его одновременно и перехватить ответы.
+        """
+        import relay_sim
+
+        if relay_sim.is_sim_url(port):
+            serial_port = relay_sim.VirtualRelayDevice.from_url(port, timeout, baudrate)
+        else:
+            import serial
+
+            serial_port = serial.Serial(port, baudrate=baudrate, timeout=timeout,
+                                        exclusive=exclusive or None)
+            if not serial_port.is_open:
+                raise serial.SerialException("Port open failed")
+        client = cls(serial_port, feedback)
+        client.clear_buffer()
+        return client
+
+    @property
+    def is_open(self):
+        return bool(self.serial_port and self.serial_port.is_open)
+
+    def close(self):
+        if self.serial_port:
+            try:
+                self.serial_port.close()
+            finally:
+                self.serial_port = None
+
+    def clear_buffer(self):
+        """Очищает буфер последовательного порта"""
+        if self.is_open:
+            self.serial_port.reset_input_buffer()
+            self.serial_port.reset_output_buffer()
+
+    def write(self, frame):
+        self.serial_port.write(frame)
+        if self.tap is not None:
+            self.tap("tx", frame)
+
+    def read(self, size):
+        data = self.serial_port.read(size)
+        if data and self.tap is not None:
+            self.tap("rx", data)
+        return data
+
+    def read_response(self):
+        """Читает один ответ; пустой результат означает таймаут"""
+        return self.read(FRAME_SIZE)
+
+    def remember(self, relay, command, reply):
+        """Запоминает состояние реле после команды"""
+        if reply is not None:
+            self.states[reply.relay] = reply.state
+        elif command in ("on", "off"):
+            self.states[relay] = command
+
+    def send(self, relay, command, feedback=None):
+        """Отправляет команду и возвращает RelayReply или None, если ответа нет"""
+        if feedback is None:
+            feedback = self.feedback
+        frame = command_frame(relay, command, feedback)
+        self.clear_buffer()
+        self.write(frame)
+        if not expects_response(command, feedback):
+            self.remember(relay, command, None)
+            return None
+        response = self.read_response()
+        if not response:
+            return None
+        reply = parse_response(response)
+        self.remember(relay, command, reply)
+        return reply
+
+    def write_batch(self, relays, command, feedback=None):
+        """Отправляет команду нескольким реле одной записью и возвращает отправленные байты"""
+        if feedback is None:
+            feedback = self.feedback
+        frame = batch_frame(relays, command, feedback)
+        self.clear_buffer()
+        self.write(frame)
+        if not expects_response(command, feedback):
+            for relay in relays:
+                self.remember(relay, command, None)
+        return frame
+
+    def read_batch(self, relays, command, timeout=None):
+        """Читает ответы на пакет и сопоставляет их по номеру реле
+
+        Ответы выделяются FrameParser, поэтому потерянный или лишний байт портит только
+        один ответ, а не все следующие за ним. Ключи ошибок: "checksum_error", если
+        пришлось пропускать байты, и "invalid_response" для недописанного кадра в конце.
+        timeout ограничивает ожидание всего пакета вместо таймаута порта на каждое чтение.
+        """
+        parser = FrameParser()
+        response = bytearray()
+        by_relay = {}
+        received = 0
+        port_timeout = self.serial_port.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while received < len(relays):
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.serial_port.timeout = remaining
+                size = FRAME_SIZE * (len(relays) - received) - len(parser.buffer)
+                data = self.read(size)
+                response += data
+                for reply in parser.feed(data):
+                    received += 1
+                    by_relay[reply.relay] = reply
+                    self.remember(reply.relay, command, reply)
+                # Неполное чтение означает, что истек таймаут порта
+                if len(data) < size:
+                    break
+        finally:
+            if deadline is not None:
+                self.serial_port.timeout = port_timeout
+        errors = []
+        if parser.discarded:
+            errors.append("checksum_error")
+        if parser.buffer:
+            errors.append("invalid_response")
+        return bytes(response), by_relay, errors
+
+    def send_batch(self, relays, command, feedback=None):
+        """Отправляет команду нескольким реле; возвращает словарь ответов по номеру реле"""
+        if feedback is None:
+            feedback = self.feedback
+        self.write_batch(relays, command, feedback)
+        if not expects_response(command, feedback):
+            return {}
+        return self.read_batch(relays, command)[1]
+
+    def pipeline(self, window=8, timeout=DEFAULT_TIMEOUT):
+        """Создает конвейер запросов поверх этого клиента"""
+        return RelayPipeline(self, window, timeout)
+
+    def on(self, relay):
+        return self.send(relay, "on")
+
+    def off(self, relay):
+        return self.send(relay, "off")
+
+    def toggle(self, relay):
+        return self.send(relay, "toggle")
+
+    def status(self, relay):
+        return self.send(relay, "status")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameParser:
+    """Выделяет ответы из потока байтов, синхронизируясь по 0xA0 и контрольной сумме"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # Число байтов, отброшенных при поиске начала кадра
+        self.discarded = 0
+
+    def feed(self, data):
+        """Добавляет байты и возвращает список полностью принятых ответов"""
+        buf = self.buffer
+        buf += data
+        replies = []
+        pos = 0
+        end = len(buf) - FRAME_SIZE
+        while pos <= end:
+            if buf[pos] == HEADER and (buf[pos] + buf[pos + 1] + buf[pos + 2]) % 0x100 == buf[pos + 3]:
+                replies.append(parse_frame(buf, pos))
+                pos += FRAME_SIZE
+                continue
+            # Ищем следующий заголовок, все байты до него не могут начинать кадр
+            next_pos = buf.find(HEADER, pos + 1)
+            if next_pos < 0:
+                next_pos = len(buf)
+            self.discarded += next_pos - pos
+            pos = next_pos
+        del buf[:pos]
+        return replies
+
+    def reset(self):
+        self.buffer.clear()
+
+
+class _Pending:
+    __slots__ = ("relay", "command", "feedback", "queued_at", "sent_at", "done", "tag")
+
+    def __init__(self, relay, command, feedback, queued_at, tag=None):
+        self.relay = relay
+        self.command = command
+        self.feedback = feedback
+        self.queued_at = queued_at
+        self.sent_at = None
+        self.done = False
+        self.tag = tag
+
+
+class RelayPipeline:
+    """Держит до window запросов в полете без очистки буфера перед каждой командой"""
+
+    def __init__(self, client, window=8, timeout=DEFAULT_TIMEOUT):
+        self.client = client
+        self.window = max(1, window)
+        self.timeout = timeout
+        self.parser = FrameParser()
+        self.backlog = deque()
+        # Запросы в порядке отправки и ожидающие ответа запросы по номеру реле
+        self.in_flight = deque()
+        self.waiting = {}
+        self.outstanding = 0
+
+    @property
+    def idle(self):
+        return not self.backlog and not self.outstanding
+
+    def submit(self, relay, command, feedback=None, queued_at=None, tag=None):
+        """Ставит запрос в очередь; проверка номера реле выполняется сразу"""
+        if feedback is None:
+            feedback = self.client.feedback
+        command_frame(relay, command, feedback)
+        self.backlog.append(_Pending(relay, command, feedback,
+                                     time.monotonic() if queued_at is None else queued_at, tag))
+
+    def pump(self):
+        """Отправляет из очереди столько кадров, сколько позволяет окно, одной записью
+
+        Возвращает (кадр, список отправленных запросов, результаты) или None, если отправлять нечего.
+        """
+        if not self.backlog or self.outstanding >= self.window:
+            return None
+        sent = []
+        results = []
+        while self.backlog and self.outstanding < self.window:
+            request = self.backlog.popleft()
+            sent.append(request)
+            if expects_response(request.command, request.feedback):
+                self.outstanding += 1
+        frame = b"".join([command_frame(r.relay, r.command, r.feedback) for r in sent])
+        now = time.monotonic()
+        self.client.write(frame)
+        for request in sent:
+            request.sent_at = now
+            if expects_response(request.command, request.feedback):
+                self.in_flight.append(request)
+                self.waiting.setdefault(request.relay, deque()).append(request)
+            else:
+                self.client.remember(request.relay, request.command, None)
+                request.done = True
+                results.append(PipelineResult(request.relay, request.command, None, "sent",
+                                              request.queued_at, now, now, request.tag))
+        return frame, sent, results
+
+    def poll(self):
+        """Читает доступные байты без блокировки, сопоставляет ответы и снимает просроченные запросы"""
+        available = self.client.serial_port.in_waiting
+        data = self.client.read(available) if available else b""
+        return self.process(data)
+
+    def process(self, data, now=None):
+        """Обрабатывает принятые байты и возвращает список PipelineResult"""
+        if now is None:
+            now = time.monotonic()
+        results = []
+        for reply in self.parser.feed(data) if data else ():
+            results.append(self._match(reply, now))
+        self._expire(now, results)
+        return results
+
+    def _match(self, reply, now):
+        self.client.remember(reply.relay, None, reply)
+        pending = self.waiting.get(reply.relay)
+        if pending:
+            for request in pending:
+                if reply_matches(request.command, reply.state):
+                    pending.remove(request)
+                    request.done = True
+                    self.outstanding -= 1
+                    return PipelineResult(reply.relay, request.command, reply, "ok",
+                                          request.queued_at, request.sent_at, now, request.tag)
+        # Поздний ответ на уже просроченный запрос: состояние все равно обновляется
+        return PipelineResult(reply.relay, None, reply, "late", None, None, now, None)
+
+    def _expire(self, now, results):
+        in_flight = self.in_flight
+        deadline = now - self.timeout
+        while in_flight and (in_flight[0].done or in_flight[0].sent_at <= deadline):
+            request = in_flight.popleft()
+            if request.done:
+                continue
+            request.done = True
+            self.outstanding -= 1
+            self.waiting[request.relay].remove(request)
+            results.append(PipelineResult(request.relay, request.command, None, "timeout",
+                                          request.queued_at, request.sent_at, now, request.tag))
+
+    def fail_all(self):
+        """Снимает все запросы, например после потери порта; возвращает их номера реле, команды и метки"""
+        dropped = [(r.relay, r.command, r.tag) for r in self.backlog]
+        dropped += [(r.relay, r.command, r.tag) for r in self.in_flight if not r.done]
+        self.backlog.clear()
+        self.in_flight.clear()
+        self.waiting.clear()
+        self.outstanding = 0
+        self.parser.reset()
+        return dropped
+
+    def run(self, commands, feedback=None):
+        """Выполняет последовательность (реле, команда) с конвейером и возвращает результаты"""
+        for relay, command in commands:
+            self.submit(relay, command, feedback)
+        results = []
+        serial_port = self.client.serial_port
+        while not self.idle:
+            sent = self.pump()
+            if sent:
+                results.extend(sent[2])
+            if not self.outstanding:
+                continue
+            # Блокирующее чтение хотя бы одного байта ограничено таймаутом порта
+            data = self.client.read(max(1, serial_port.in_waiting))
+            if data and serial_port.in_waiting:
+                data += self.client.read(serial_port.in_waiting)
+            results.extend(self.process(data))
+        return results
@@ -0,0 +1,146 @@
+"""Временные последовательности команд реле с точным планированием по монотонным часам
+
+Последовательности описываются в relay_sequences.json рядом с relay_config.json:
+
+    {
+      "pulse_3": {"pulse": {"relay": 3, "duration": 0.15}},
+      "step_1_8": {"step": {"relays": "1-8", "interval": 0.05, "command": "on"}},
+      "custom": {"repeat": 3, "period": 1.0,
+                 "steps": [{"at": 0, "relays": "1-4", "command": "on"},
+                           {"at": 0.5, "relay": 2, "command": "off"}]}
+    }
+
+Время шагов отсчитывается от начала последовательности, поэтому ошибка одного шага
+не накапливается в следующих.
+"""
+import json
+import os
+import time
+from collections import namedtuple
+
+from relay_protocol import MAX_RELAY, MIN_RELAY, batch_frame, parse_relay_spec
+
+SEQUENCES_FILE = "relay_sequences.json"
+# Последние миллисекунды перед шагом ожидаем активно: sleep в ОС недостаточно точен
+SPIN_THRESHOLD = 0.002
+
+Step = namedtuple("Step", "at relays command frame")
+SequenceReport = namedtuple("SequenceReport",
+                            "name steps completed jitter_mean jitter_max jitter_p99 duration lateness")
+
+
+class Sequence:
+    """Упорядоченный по времени список шагов с готовыми кадрами"""
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = sorted(steps, key=lambda step: step.at)
+
+    @property
+    def duration(self):
+        return self.steps[-1].at if self.steps else 0.0
+
+    def final_states(self):
+        """Состояния реле после выполнения: "on"/"off", для toggle - "unknown\""""
+        states = {}
+        for step in self.steps:
+            for relay in step.relays:
+                states[relay] = step.command if step.command in ("on", "off") else "unknown"
+        return states
+
+
+def make_step(at, relays, command):
+    if command not in ("on", "off", "toggle"):
+        raise ValueError("Sequence command must be on, off or toggle: {}".format(command))
+    if at < 0:
+        raise ValueError("Step time must not be negative")
+    relays = list(relays)
+    # В последовательностях используются коды без обратной связи, чтобы чтение ответа не сдвигало время
+    return Step(float(at), relays, command, batch_frame(relays, command))
+
+
+def relays_from(spec):
+    if "relays" in spec:
+        relays = spec["relays"]
+        if isinstance(relays, str):
+            return parse_relay_spec(relays, range(MIN_RELAY, MAX_RELAY + 1))
+        return [int(relay) for relay in relays]
+    return [int(spec["relay"])]
+
+
+def build_sequence(name, spec):
+    """Создает Sequence из описания в JSON"""
+    steps = []
+    if "pulse" in spec:
+        pulse = spec["pulse"]
+        relays = relays_from(pulse)
+        steps.append(make_step(0.0, relays, "on"))
+        steps.append(make_step(float(pulse["duration"]), relays, "off"))
+    elif "step" in spec:
+        step = spec["step"]
+        interval = float(step["interval"])
+        for index, relay in enumerate(relays_from(step)):
+            steps.append(make_step(index * interval, [relay], step.get("command", "on")))
+    else:
+        for step in spec.get("steps", []):
+            steps.append(make_step(float(step["at"]), relays_from(step), step["command"]))
+    if not steps:
+        raise ValueError("Sequence {} has no steps".format(name))
+
+    # Повторы сдвигаются на period, по умолчанию - на длительность одного прохода
+    repeat = int(spec.get("repeat", 1))
+    period = float(spec.get("period", max(step.at for step in steps)))
+    if repeat > 1 and period <= 0:
+        raise ValueError("Sequence {} needs a positive period to repeat".format(name))
+    steps = [step._replace(at=step.at + index * period) for index in range(repeat) for step in steps]
+    return Sequence(name, steps)
+
+
+def load_sequences(path=SEQUENCES_FILE):
+    """Загружает последовательности из файла; отсутствующий файл означает пустой набор"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        specs = json.load(f)
+    return {name: build_sequence(name, spec) for name, spec in specs.items()}
+
+
+def wait_until(deadline, cancel):
+    """Ждет момента deadline по perf_counter; возвращает False, если выполнение отменено"""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return True
+        if remaining > SPIN_THRESHOLD:
+            if cancel.wait(remaining - SPIN_THRESHOLD):
+                return False
+        elif cancel.is_set():
+            return False
+
+
+def run_sequence(sequence, write, cancel, lead=0.005):
+    """Выполняет шаги через write(frame) и возвращает отчет о расхождении с планом
+
+    lead - запас перед первым шагом, чтобы он не опаздывал из-за подготовки.
+    """
+    start = time.perf_counter() + lead
+    errors = []
+    for step in sequence.steps:
+        if not wait_until(start + step.at, cancel):
+            break
+        write(step.frame)
+        errors.append(time.perf_counter() - start - step.at)
+    duration = time.perf_counter() - start
+    return make_report(sequence, errors, duration)
+
+
+def make_report(sequence, errors, duration):
+    if errors:
+        ordered = sorted(abs(error) for error in errors)
+        jitter_mean = sum(ordered) / len(ordered)
+        jitter_max = ordered[-1]
+        jitter_p99 = ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+    else:
+        jitter_mean = jitter_max = jitter_p99 = None
+    return SequenceReport(sequence.name, len(sequence.steps), len(errors), jitter_mean, jitter_max,
+                          jitter_p99, duration, errors)
@@ -0,0 +1,193 @@
+"""Виртуальный LCUS-модуль для тестов и замеров без оборудования
+
+Устройство ведет себя как объект serial.Serial и открывается через RelayClient.open
+по адресу вида "sim://?relays=8&latency=0.005&baudrate=9600&drop=0&corrupt=0&seed=1".
+Команды 0x00/0x01 переключают реле без ответа, 0x02-0x05 отвечают новым или текущим
+состоянием (0x00/0x01). Реле вне 1..relays не отвечают.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from relay_protocol import (CMD_OFF, CMD_OFF_FEEDBACK, CMD_ON, CMD_ON_FEEDBACK, CMD_STATUS,
+                            CMD_TOGGLE, DEFAULT_BAUDRATE, DEFAULT_TIMEOUT, FRAME_SIZE, HEADER,
+                            checksum)
+
+URL_SCHEME = "sim://"
+
+
+def is_sim_url(port):
+    return isinstance(port, str) and port.startswith(URL_SCHEME)
+
+
+class VirtualRelayDevice:
+    """Эмулирует модуль с 1-254 реле с настраиваемой задержкой, скоростью и ошибками"""
+
+    def __init__(self, relays=8, latency=0.0, baudrate=DEFAULT_BAUDRATE, drop=0.0, corrupt=0.0,
+                 timeout=DEFAULT_TIMEOUT, seed=None):
+        self.relays = relays
+        self.latency = latency
+        # 10 бит на байт: старт, 8 бит данных, стоп; baudrate=0 отключает эмуляцию скорости
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.drop = drop
+        self.corrupt = corrupt
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.states = [0] * 256
+        self.is_open = True
+        self.rx = bytearray()
+        # Байты ответа с моментом, когда они станут доступны для чтения
+        self.output = deque()
+        self.line_free_at = 0.0
+        self.lock = threading.Lock()
+        self.data_ready = threading.Condition(self.lock)
+
+    @classmethod
+    def from_url(cls, url, timeout=DEFAULT_TIMEOUT, baudrate=DEFAULT_BAUDRATE):
+        query = parse_qs(urlsplit(url).query)
+
+        def option(name, convert, default):
+            return convert(query[name][0]) if name in query else default
+
+        return cls(relays=option("relays", int, 8),
+                   latency=option("latency", float, 0.0),
+                   baudrate=option("baudrate", int, baudrate),
+                   drop=option("drop", float, 0.0),
+                   corrupt=option("corrupt", float, 0.0),
+                   timeout=timeout,
+                   seed=option("seed", int, None))
+
+    def close(self):
+        self.is_open = False
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.output.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        with self.lock:
+            count = 0
+            for ready_at, _ in self.output:
+                if ready_at > now:
+                    break
+                count += 1
+            return count
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Virtual device is closed")
+        now = time.monotonic()
+        with self.lock:
+            # Запрос сам занимает линию на время передачи
+            received_at = now + len(data) * self.byte_time
+            self.rx += data
+            while len(self.rx) >= FRAME_SIZE:
+                if self.rx[0] != HEADER or checksum(*self.rx[:3]) != self.rx[3]:
+                    del self.rx[0]
+                    continue
+                reply = self.execute(self.rx[1], self.rx[2])
+                del self.rx[:FRAME_SIZE]
+                if reply is not None:
+                    self.queue_reply(reply, received_at)
+            self.data_ready.notify_all()
+        return len(data)
+
+    def execute(self, relay, code):
+        """Выполняет команду и возвращает байт состояния для ответа или None"""
+        if not 1 <= relay <= self.relays:
+            return None
+        if code in (CMD_OFF, CMD_OFF_FEEDBACK):
+            self.states[relay] = 0
+        elif code in (CMD_ON, CMD_ON_FEEDBACK):
+            self.states[relay] = 1
+        elif code == CMD_TOGGLE:
+            self.states[relay] ^= 1
+        elif code != CMD_STATUS:
+            return None
+
+        if code in (CMD_OFF, CMD_ON):
+            return None
+        # Как и модуль, в ответе передается новое состояние: 0x00 - выключено, 0x01 - включено
+        return (relay, self.states[relay])
+
+    def queue_reply(self, reply, received_at):
+        relay, status = reply
+        frame = bytearray((HEADER, relay, status, checksum(HEADER, relay, status)))
+        if self.corrupt and self.random.random() < self.corrupt:
+            frame[3] ^= 0xFF
+        start = max(received_at + self.latency, self.line_free_at)
+        for index, byte in enumerate(frame):
+            if self.drop and self.random.random() < self.drop:
+                continue
+            self.output.append((start + (index + 1) * self.byte_time, byte))
+        self.line_free_at = start + len(frame) * self.byte_time
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        result = bytearray()
+        with self.lock:
+            while len(result) < size:
+                now = time.monotonic()
+                while self.output and self.output[0][0] <= now and len(result) < size:
+                    result.append(self.output.popleft()[1])
+                if len(result) >= size:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+                wait_until = self.output[0][0] if self.output else deadline
+                if deadline is not None and wait_until is not None:
+                    wait_until = min(wait_until, deadline)
+                self.data_ready.wait(None if wait_until is None else max(0.0, wait_until - now))
+        return bytes(result)
+
+
+def serve_pty(device):
+    """Выставляет устройство на псевдотерминал, чтобы его мог открыть любой процесс (POSIX)"""
+    import pty
+    import tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    print(os.ttyname(slave), flush=True)
+    device.timeout = 0.01
+
+    def pump_replies():
+        while device.is_open:
+            data = device.read(FRAME_SIZE)
+            if data:
+                os.write(master, data)
+
+    threading.Thread(target=pump_replies, daemon=True).start()
+    try:
+        while True:
+            device.write(os.read(master, 1024))
+    except (KeyboardInterrupt, OSError):
+        device.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Virtual LCUS relay module on a pseudo-terminal")
+    parser.add_argument("--relays", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--baudrate", type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument("--drop", type=float, default=0.0)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    serve_pty(VirtualRelayDevice(args.relays, args.latency, args.baudrate, args.drop,
+                                 args.corrupt, seed=args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
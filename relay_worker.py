@@ -0,0 +1,589 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from relay_protocol import (DEFAULT_BAUDRATE, DEFAULT_TIMEOUT, FRAME_SIZE, ProtocolError,
+                            RelayClient, RelayPipeline, batch_frame, command_frame,
+                            expects_response, find_port_by_identity, parse_response,
+                            port_identity, reply_frame)
+from relay_sequence import run_sequence
+
+
+class SerialWorker(threading.Thread):
+    """Фоновый поток, который владеет RelayClient и выполняет команды из очереди"""
+    BAUDRATE = DEFAULT_BAUDRATE
+    TIMEOUT = DEFAULT_TIMEOUT
+    # Период опроса порта, пока в конвейере есть запросы без ответа
+    POLL_INTERVAL = 0.005
+    # Запас на ответ модуля сверх времени передачи кадров при опросе состояний
+    SWEEP_MARGIN = 0.1
+    RECONNECT_INITIAL_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
+    # Что делать с командами, пока порт переподключается: "queue" или "fail_fast"
+    OUTAGE_POLICIES = ("queue", "fail_fast")
+
+    def __init__(self, on_event, pipeline_window=0, capture=None, metrics=None, reconnect=True,
+                 outage_policy="queue", outage_limit=100, ports=None):
+        super().__init__(name="SerialWorker", daemon=True)
+        # on_event вызывается из потока воркера, доставку в UI обеспечивает вызывающая сторона
+        self.on_event = on_event
+        self.commands = queue.Queue()
+        self.client = None
+        self.port = None
+        # pipeline_window > 0 включает конвейерный режим без очистки буфера перед командами
+        self.pipeline_window = pipeline_window
+        self.pipeline = None
+        # capture (CaptureWriter) получает все отправленные и принятые байты
+        self.capture = capture
+        # metrics (RelayMetrics) учитывает каждое событие в потоке воркера
+        self.metrics = metrics
+        self.sequence_cancel = threading.Event()
+        # После сбоя порт переоткрывается в фоне с экспоненциальной задержкой
+        self.reconnect = reconnect
+        self.outage_policy = outage_policy if outage_policy in self.OUTAGE_POLICIES else "queue"
+        self.outage_limit = outage_limit
+        self.outage = deque()
+        self.reconnect_at = None
+        self.reconnect_delay = self.RECONNECT_INITIAL_DELAY
+        self.reconnect_attempt = 0
+        # VID/PID/серийный номер открытого порта, чтобы найти его после смены имени;
+        # ports (PortWatcher) отвечает из кэша вместо перечисления портов
+        self.ports = ports
+        self.identity = None
+        # Порты с той же идентичностью, которые были в системе в момент сбоя
+        self.identity_ports = set()
+        self.known_states = {}
+
+    def open(self, port, auto=False, known_states=None):
+        """Ставит в очередь открытие порта
+
+        known_states - состояния реле, известные до подключения (например, из журнала);
+        сразу после открытия они проверяются одним пакетным опросом.
+        """
+        self.commands.put(("open", port, auto, known_states))
+
+    def close(self):
+        """Ставит в очередь закрытие порта"""
+        self.commands.put(("close",))
+
+    def send(self, relay_num, command, feedback=False, done=None):
+        """Ставит в очередь команду реле; время постановки нужно для замера задержек
+
+        done(event) вызывается из потока воркера с итоговым событием команды.
+        """
+        self.commands.put(("send", relay_num, command, feedback, time.monotonic(), done))
+
+    def send_batch(self, relays, command, feedback=False, done=None):
+        """Ставит в очередь одну команду для нескольких реле"""
+        self.commands.put(("batch", list(relays), command, feedback, time.monotonic(), done))
+
+    def poll(self, relays, callback):
+        """Ставит в очередь опрос состояния; callback(changed) вызывается из потока воркера"""
+        self.commands.put(("poll", list(relays), callback))
+
+    def run_sequence(self, sequence, done=None):
+        """Ставит в очередь выполнение последовательности; порт занят до ее окончания"""
+        self.commands.put(("sequence", sequence, done))
+
+    def cancel_sequence(self):
+        """Прерывает выполняемую последовательность"""
+        self.sequence_cancel.set()
+
+    def stop(self, timeout=None):
+        """Закрывает порт и останавливает поток"""
+        self.sequence_cancel.set()
+        self.commands.put(("stop",))
+        if self.is_alive():
+            self.join(timeout)
+
+    def pending(self):
+        """Количество команд, ожидающих выполнения"""
+        return self.commands.qsize()
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.pipeline is not None and not self.pipeline.idle:
+                timeout = self.POLL_INTERVAL
+            if self.reconnect_at is not None:
+                until_reconnect = max(0.0, self.reconnect_at - time.monotonic())
+                timeout = until_reconnect if timeout is None else min(timeout, until_reconnect)
+            try:
+                item = self.commands.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                if item[0] == "stop":
+                    self._close()
+                    return
+                try:
+                    self._dispatch(item)
+                except Exception as e:
+                    # Ошибка одной команды не должна останавливать единственный поток порта
+                    self._item_failed(item, e)
+            if self.reconnect_at is not None and time.monotonic() >= self.reconnect_at:
+                self._try_reconnect()
+            if self.pipeline is not None:
+                self._service_pipeline()
+
+    def _dispatch(self, item):
+        kind = item[0]
+        if kind in ("send", "batch", "sequence") and self.reconnect_at is not None \
+                and self.outage_policy == "queue":
+            # Порт временно недоступен: команда будет выполнена после переподключения
+            if len(self.outage) < self.outage_limit:
+                self.outage.append(item)
+                return
+        if kind == "open":
+            self._open(*item[1:])
+        elif kind == "close":
+            self._close(notify=True)
+        elif kind == "send":
+            self._send(*item[1:])
+        elif kind == "batch":
+            self._send_batch(*item[1:])
+        elif kind == "poll":
+            self._poll(*item[1:])
+        elif kind == "sequence":
+            self._run_sequence(*item[1:])
+
+    def emit(self, event_type, **data):
+        data["type"] = event_type
+        data["port"] = self.port
+        if self.metrics is not None:
+            self.metrics.record(data)
+        self.on_event(data)
+        return data
+
+    def finish(self, done, event_type, **data):
+        """Отправляет итоговое событие команды и сообщает о нем вызывающей стороне"""
+        event = self.emit(event_type, **data)
+        if done is not None:
+            try:
+                done(event)
+            except Exception as e:
+                self.emit("error", error="{}: {}".format(type(e).__name__, e), connected=self.is_open())
+
+    def is_open(self):
+        return bool(self.client and self.client.is_open)
+
+    def _connect(self, port):
+        self.client = RelayClient.open(port, baudrate=self.BAUDRATE, timeout=self.TIMEOUT)
+        if self.capture is not None:
+            self.client.tap = lambda direction, data: self.capture.record(direction, data, self.port)
+        if self.pipeline_window > 0:
+            self.pipeline = RelayPipeline(self.client, self.pipeline_window, self.TIMEOUT)
+
+    def _open(self, port, auto, known_states=None):
+        self._close()
+        self.port = port
+        self.known_states = dict(known_states or {})
+        try:
+            self._connect(port)
+        except Exception as e:
+            self._drop_port()
+            self.emit("open_failed", error=str(e), auto=auto)
+            return
+        self.identity = self.ports.identity(port) if self.ports is not None else None
+        if self.identity is None:
+            # Кэш портов может быть еще не заполнен, например при автоподключении на старте
+            self.identity = port_identity(port)
+        self.emit("opened", auto=auto)
+        if self.known_states:
+            # Сообщаются только реле, состояние которых разошлось с известным
+            self._sweep(sorted(self.known_states), self.known_states)
+
+    def _close(self, notify=False):
+        was_open = self.is_open() or self.reconnect_at is not None
+        self._stop_reconnect()
+        self._drop_port()
+        if notify and was_open:
+            self.emit("closed")
+
+    def _fail_port(self):
+        """Закрывает порт после сбоя и планирует переподключение; возвращает True, если оно будет"""
+        self._drop_port()
+        if not self.reconnect or self.port is None:
+            return False
+        if self.reconnect_at is None:
+            self.reconnect_delay = self.RECONNECT_INITIAL_DELAY
+            self.reconnect_attempt = 0
+            self.reconnect_at = time.monotonic() + self.reconnect_delay
+            self.identity_ports = set(self._identity_candidates()) if self._renamable() else set()
+        return True
+
+    def _renamable(self):
+        """Можно ли искать модуль под другим именем: только по идентичности с серийным номером
+
+        У CH340 серийного номера нет, и VID/PID совпадают у всех таких адаптеров, поэтому
+        без номера "тот же" модуль нельзя отличить от соседнего.
+        """
+        return self.identity is not None and self.identity[2] is not None
+
+    def _identity_candidates(self):
+        try:
+            if self.ports is not None:
+                return self.ports.find(self.identity)
+            return find_port_by_identity(self.identity)
+        except Exception:
+            return []
+
+    def _stop_reconnect(self):
+        self.reconnect_at = None
+        # Отложенные на время сбоя команды больше не будут выполнены
+        outage, self.outage = self.outage, deque()
+        for item in outage:
+            self._fail_item(item)
+
+    def _fail_item(self, item):
+        """Сообщает о невыполненной команде из очереди"""
+        kind = item[0]
+        if kind == "send":
+            self.finish(item[-1], "not_connected", relay=item[1], command=item[2], queued_at=item[4])
+        elif kind == "batch":
+            self.finish(item[-1], "not_connected", relays=item[1], command=item[2], queued_at=item[4])
+        elif kind == "sequence":
+            self.finish(item[-1], "not_connected", sequence=item[1].name)
+
+    def _item_failed(self, item, error):
+        """Сообщает о команде, выполнение которой прервала непредвиденная ошибка
+
+        Порт остается открытым (connected), если ошибка не связана с ним, например
+        при неверном номере реле.
+        """
+        kind = item[0]
+        data = {"error": "{}: {}".format(type(error).__name__, error), "connected": self.is_open()}
+        if kind == "send":
+            data.update(relay=item[1], command=item[2], queued_at=item[4])
+        elif kind == "batch":
+            data.update(relays=item[1], command=item[2], queued_at=item[4])
+        elif kind == "sequence":
+            data.update(sequence=getattr(item[1], "name", None))
+        elif kind == "poll":
+            # Опросчик ждет обратного вызова, иначе он остановится навсегда
+            try:
+                item[2](False)
+            except Exception:
+                pass
+        event = self.emit("error", **data)
+        done = item[-1] if kind in ("send", "batch", "sequence") else None
+        if done is not None:
+            try:
+                done(event)
+            except Exception:
+                pass
+
+    def _try_reconnect(self):
+        """Одна попытка переподключения; при неудаче задержка до следующей удваивается"""
+        port = self.port
+        if self._renamable():
+            # Модуль мог вернуться в систему под другим именем порта; переходим на новое имя,
+            # только если появилось ровно одно новое устройство с тем же серийным номером
+            candidates = self._identity_candidates()
+            new = [device for device in candidates if device not in self.identity_ports]
+            if port not in candidates and len(new) == 1:
+                self.emit("port_renamed", old_port=port, new_port=new[0])
+                self.port = port = new[0]
+        try:
+            self._connect(port)
+        except Exception as e:
+            self._drop_port()
+            self.reconnect_attempt += 1
+            self.reconnect_delay = min(self.reconnect_delay * 2, self.RECONNECT_MAX_DELAY)
+            self.reconnect_at = time.monotonic() + self.reconnect_delay
+            self.emit("reconnecting", error=str(e), attempt=self.reconnect_attempt,
+                      delay=self.reconnect_delay)
+            return
+
+        self.reconnect_at = None
+        self.emit("opened", auto=True, reconnected=True)
+        # Сверяем состояние реле с тем, что было известно до сбоя
+        if self.known_states:
+            self._sweep(sorted(self.known_states), self.known_states)
+        outage, self.outage = self.outage, deque()
+        for item in outage:
+            self._dispatch(item)
+
+    def _drop_port(self):
+        if self.client is not None:
+            self.known_states.update(self.client.states)
+        if self.pipeline is not None:
+            for relay_num, command, done in self.pipeline.fail_all():
+                self.finish(done, "not_connected", relay=relay_num, command=command)
+            self.pipeline = None
+        if self.client:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+        self.client = None
+
+    def _send(self, relay_num, command, feedback, queued_at, done=None):
+        timing = {"queued_at": queued_at}
+        if not self.is_open():
+            self.finish(done, "not_connected", relay=relay_num, command=command, **timing)
+            return
+
+        if self.pipeline is not None:
+            self.pipeline.submit(relay_num, command, feedback, queued_at, done)
+            return
+
+        client = self.client
+        frame = command_frame(relay_num, command, feedback)
+        try:
+            client.clear_buffer()
+            timing["sent_at"] = time.monotonic()
+            client.write(frame)
+        except Exception as e:
+            reconnecting = self._fail_port()
+            self.finish(done, "error", error=str(e), relay=relay_num, command=command,
+                        reconnecting=reconnecting, **timing)
+            return
+
+        if not expects_response(command, feedback):
+            client.remember(relay_num, command, None)
+            self.finish(done, "sent", frame=frame, relay=relay_num, command=command, **timing)
+            return
+        self.emit("sent", frame=frame, relay=relay_num, command=command, **timing)
+        try:
+            response = client.read_response()
+        except Exception as e:
+            reconnecting = self._fail_port()
+            self.finish(done, "connection_lost", error=str(e), relay=relay_num, command=command,
+                        reconnecting=reconnecting, **timing)
+            return
+        timing["done_at"] = time.monotonic()
+        if not response:
+            self.finish(done, "no_response", relay=relay_num, command=command, **timing)
+            return
+        try:
+            reply = parse_response(response)
+        except ProtocolError as e:
+            self.finish(done, "invalid_response", response=response, error=e.key,
+                        relay=relay_num, command=command, **timing)
+            return
+        client.remember(relay_num, command, reply)
+        self.finish(done, "response", response=response, reply=reply, relay=relay_num, command=command,
+                    **timing)
+
+    def _send_batch(self, relays, command, feedback, queued_at, done=None):
+        timing = {"queued_at": queued_at}
+        if not self.is_open():
+            self.finish(done, "not_connected", relays=relays, command=command, **timing)
+            return
+        # Неверный номер реле - ошибка команды, а не порта: проверяем до записи и до постановки
+        # в конвейер, чтобы пакет не застрял там частично
+        batch_frame(relays, command, feedback)
+
+        if self.pipeline is not None:
+            # Конвейер сам склеивает кадры в одну запись и сопоставляет ответы
+            collector = None if done is None else _BatchCollector(self, relays, command, queued_at, done)
+            for relay_num in relays:
+                self.pipeline.submit(relay_num, command, feedback, queued_at, collector)
+            return
+
+        client = self.client
+        try:
+            timing["sent_at"] = time.monotonic()
+            frame = client.write_batch(relays, command, feedback)
+        except Exception as e:
+            reconnecting = self._fail_port()
+            self.finish(done, "error", error=str(e), relays=relays, command=command,
+                        reconnecting=reconnecting, **timing)
+            return
+
+        if not expects_response(command, feedback):
+            self.finish(done, "sent", frame=frame, relays=relays, command=command, **timing)
+            return
+        self.emit("sent", frame=frame, relays=relays, command=command, **timing)
+        try:
+            response, replies, errors = client.read_batch(relays, command)
+        except Exception as e:
+            reconnecting = self._fail_port()
+            self.finish(done, "connection_lost", error=str(e), relays=relays, command=command,
+                        reconnecting=reconnecting, **timing)
+            return
+        timing["done_at"] = time.monotonic()
+        missing = [relay for relay in relays if relay not in replies]
+        self.finish(done, "batch_response", response=response, replies=replies, errors=errors,
+                    missing=missing, relays=relays, command=command, **timing)
+
+    def _poll(self, relays, callback):
+        """Опрашивает реле командой 0x05 и сообщает только об изменившихся состояниях"""
+        # В конвейерном режиме опрос не должен сбрасывать буфер с ответами на чужие запросы
+        if not self.is_open() or (self.pipeline is not None and not self.pipeline.idle):
+            callback(False)
+            return
+        batch_frame(relays, "status")
+
+        callback(self._sweep(relays, dict(self.client.states)))
+
+    def sweep_timeout(self, count):
+        """Время ожидания ответов на опрос count реле: передача кадров в обе стороны и запас
+
+        Модуль отвечает за миллисекунды, а реле, которого нет на плате (например, 2-8 у
+        одноканального LCUS-1), не отвечает вовсе; полный таймаут порта на каждый опрос
+        занимал бы воркер на секунды и задерживал пользовательские команды.
+        """
+        # 10 бит на байт
+        line_time = count * FRAME_SIZE * 2 * 10.0 / self.BAUDRATE
+        return min(self.TIMEOUT, line_time + self.SWEEP_MARGIN)
+
+    def _sweep(self, relays, previous):
+        """Запрашивает состояния реле и сообщает об отличиях от previous; возвращает True при изменениях"""
+        client = self.client
+        try:
+            client.write_batch(relays, "status")
+            replies = client.read_batch(relays, "status", self.sweep_timeout(len(relays)))[1]
+        except Exception as e:
+            self.emit("connection_lost", error=str(e), reconnecting=self._fail_port())
+            return False
+
+        changed = False
+        for relay_num in relays:
+            reply = replies.get(relay_num)
+            state = reply.state if reply is not None else "unknown"
+            if reply is None:
+                client.states[relay_num] = state
+            if previous.get(relay_num) != state:
+                changed = True
+                self.emit("state_changed", relay=relay_num, state=state, reply=reply,
+                          previous=previous.get(relay_num))
+        return changed
+
+    def _run_sequence(self, sequence, done=None):
+        """Отправляет шаги последовательности точно по плану без ожидания ответов"""
+        if not self.is_open():
+            self.finish(done, "not_connected", sequence=sequence.name)
+            return
+        self.sequence_cancel.clear()
+        client = self.client
+        self.emit("sequence_started", sequence=sequence.name, steps=len(sequence.steps))
+        try:
+            report = run_sequence(sequence, client.write, self.sequence_cancel)
+        except Exception as e:
+            reconnecting = self._fail_port()
+            self.finish(done, "connection_lost", error=str(e), sequence=sequence.name,
+                        reconnecting=reconnecting)
+            return
+        states = sequence.final_states() if report.completed == report.steps else {}
+        for relay_num, state in states.items():
+            client.states[relay_num] = state
+        self.finish(done, "sequence_done", sequence=sequence.name, report=report, states=states)
+
+    def _service_pipeline(self):
+        """Отправляет кадры из очереди конвейера и разбирает пришедшие ответы"""
+        pipeline = self.pipeline
+        try:
+            sent = pipeline.pump()
+            if sent:
+                frame, requests, results = sent
+                self.emit("sent", frame=frame, relays=[r.relay for r in requests],
+                          queued_at=requests[0].queued_at, sent_at=requests[0].sent_at)
+            else:
+                results = []
+            discarded = pipeline.parser.discarded
+            results += pipeline.poll()
+        except Exception as e:
+            self.emit("connection_lost", error=str(e), reconnecting=self._fail_port())
+            return
+        if pipeline.parser.discarded != discarded:
+            self.emit("resync", skipped=pipeline.parser.discarded - discarded)
+
+        for result in results:
+            timing = {"queued_at": result.queued_at, "sent_at": result.sent_at, "done_at": result.done_at}
+            if result.outcome == "ok":
+                self.finish(result.tag, "response", response=reply_frame(result.reply), reply=result.reply,
+                            relay=result.relay, command=result.command, **timing)
+            elif result.outcome == "timeout":
+                self.finish(result.tag, "no_response", relay=result.relay, command=result.command, **timing)
+            elif result.outcome == "sent" and result.tag is not None:
+                # Сам кадр уже попал в событие "sent" всей записи, здесь только итог запроса
+                result.tag({"type": "sent", "port": self.port, "relay": result.relay,
+                            "command": result.command, **timing})
+            elif result.outcome == "late":
+                self.emit("late_response", response=reply_frame(result.reply), reply=result.reply,
+                          relay=result.relay, done_at=result.done_at)
+
+
+class StatusPoller(threading.Thread):
+    """Периодически опрашивает реле через воркер с адаптивным интервалом
+
+    Интервал удваивается, пока состояния не меняются, и сбрасывается до минимального
+    после изменения или вызова kick().
+    """
+
+    def __init__(self, worker, relays, min_interval=0.25, max_interval=5.0, backoff=2.0):
+        super().__init__(name="StatusPoller", daemon=True)
+        self.worker = worker
+        self.relays = list(relays)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.wakeup = threading.Event()
+        self.sweep_done = threading.Event()
+        self.stopped = False
+
+    def kick(self):
+        """Ускоряет опрос, например сразу после переключения реле"""
+        self.interval = self.min_interval
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.sweep_done.set()
+
+    def on_sweep(self, changed):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.sweep_done.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            # Не опрашиваем, пока пользовательские команды ждут в очереди
+            if not self.worker.is_open() or self.worker.pending():
+                continue
+            self.sweep_done.clear()
+            self.worker.poll(self.relays, self.on_sweep)
+            self.sweep_done.wait()
+
+
+class _BatchCollector:
+    """Собирает итоги конвейерных запросов пакета в одно событие batch_response"""
+
+    def __init__(self, worker, relays, command, queued_at, done):
+        self.worker = worker
+        self.relays = relays
+        self.command = command
+        self.queued_at = queued_at
+        self.done = done
+        self.replies = {}
+        self.events = 0
+        self.expected = False
+
+    def __call__(self, event):
+        self.events += 1
+        if event["type"] == "response":
+            self.replies[event["relay"]] = event["reply"]
+        if event["type"] != "sent":
+            self.expected = True
+        if self.events < len(self.relays):
+            return
+        if not self.expected:
+            self.done({"type": "sent", "port": self.worker.port, "relays": self.relays,
+                       "command": self.command, "queued_at": self.queued_at})
+            return
+        self.done({"type": "batch_response", "port": self.worker.port, "relays": self.relays,
+                   "command": self.command, "replies": self.replies, "errors": [],
+                   "missing": [relay for relay in self.relays if relay not in self.replies],
+                   "queued_at": self.queued_at, "sent_at": None,
+                   "done_at": time.monotonic()})
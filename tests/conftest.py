@@ -0,0 +1,24 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# Модули приложения лежат в корне репозитория, а не в пакете
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def daemon_url():
+    """Сервис реле на свободном локальном порту; возвращает его адрес"""
+    from relay_daemon import RelayDaemon, serve
+    from relay_metrics import RelayMetrics
+
+    daemon = RelayDaemon(metrics=RelayMetrics(), request_timeout=5)
+    server = serve(daemon, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    daemon.shutdown()
@@ -0,0 +1,34 @@
+"""Поддельные порты для тестов, которым не нужен симулятор целиком"""
+from relay_protocol import RelayReply, reply_frame
+
+
+class BytePort:
+    """Порт с заранее заданными байтами ответа; записанные байты сохраняются"""
+
+    def __init__(self, data=b""):
+        self.data = bytearray(data)
+        self.written = bytearray()
+        self.is_open = True
+        self.timeout = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size):
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+    def write(self, data):
+        self.written += data
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+
+def frame(relay, status):
+    return reply_frame(RelayReply(relay, status, None))
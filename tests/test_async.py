@@ -0,0 +1,31 @@
+import asyncio
+
+from relay_async import AsyncRelayController
+
+SIM = "sim://?relays=8&latency=0&baudrate=0"
+
+
+def test_fan_out_keeps_job_order_per_port():
+    async def run():
+        async with AsyncRelayController(timeout=1) as rack:
+            return await rack.fan_out([(SIM, 1, "on"), (SIM, 1, "off"), (SIM, 1, "on"), (SIM, 1, "status"),
+                                       (SIM, 2, "on"), (SIM, 3, "on"), (SIM, 2, "status")])
+
+    results = asyncio.run(run())
+    assert [(r.relay, r.command) for r in results] == [
+        (1, "on"), (1, "off"), (1, "on"), (1, "status"), (2, "on"), (3, "on"), (2, "status")]
+    assert results[3].reply.state == "on"
+    assert results[6].reply.state == "on"
+    assert all(r.error is None for r in results)
+
+
+def test_fan_out_keeps_replies_when_some_relays_are_silent():
+    port = "sim://?relays=4&latency=0"
+
+    async def run():
+        async with AsyncRelayController(timeout=0.2) as rack:
+            return [await rack.fan_out((port, relay, "status") for relay in range(1, 7)) for _ in range(5)]
+
+    for results in asyncio.run(run()):
+        assert [r.error is None for r in results] == [True] * 4 + [False] * 2
+        assert all(isinstance(r.error, TimeoutError) for r in results[4:])
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+import relay_cli
+
+SIM = "sim://?relays=8&latency=0&baudrate=0"
+
+
+def results(out):
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def test_parse_words():
+    steps = relay_cli.parse_words(relay_cli.script_words(["on 1-3 # comment", "sleep 0.5 status all"]),
+                                  range(1, 5))
+    assert steps == [("command", "on", [1, 2, 3]), ("sleep", 0.5), ("command", "status", [1, 2, 3, 4])]
+    with pytest.raises(ValueError):
+        relay_cli.parse_words(["on"], range(1, 5))
+    with pytest.raises(ValueError):
+        relay_cli.parse_words(["jump", "1"], range(1, 5))
+
+
+def test_commands_from_arguments(capsys):
+    assert relay_cli.main(["--port", SIM, "--relay-count", "4", "on", "1-2", "status", "all"]) == 0
+    lines = results(capsys.readouterr().out)
+    assert [(line["relay"], line["command"], line["outcome"]) for line in lines] == [
+        (1, "on", "sent"), (2, "on", "sent"), (1, "status", "ok"), (2, "status", "ok"),
+        (3, "status", "ok"), (4, "status", "ok")]
+    assert [line["state"] for line in lines[2:]] == ["on", "on", "off", "off"]
+
+
+def test_piped_stdin_runs_line_by_line(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("toggle 1\nstatus 1\ntoggle 1\nstatus 1\n"))
+    assert relay_cli.main(["--port", SIM, "--relay-count", "8", "--script", "-"]) == 0
+    states = [line["state"] for line in results(capsys.readouterr().out) if line["command"] == "status"]
+    assert states == ["on", "off"]
+
+
+def test_malformed_stdin_runs_earlier_lines_and_exits_2(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("status 1\nbogus 2\nstatus 2\n"))
+    assert relay_cli.main(["--port", SIM, "--relay-count", "8", "--script", "-"]) == 2
+    captured = capsys.readouterr()
+    assert [line["relay"] for line in results(captured.out)] == [1]
+    assert "bogus" in captured.err
+
+
+def test_timeout_sets_exit_status(capsys):
+    assert relay_cli.main(["--port", "sim://?relays=2&latency=0&baudrate=0", "--relay-count", "8",
+                           "--timeout", "0.05", "status", "1-3"]) == 1
+    outcomes = [line["outcome"] for line in results(capsys.readouterr().out)]
+    assert sorted(outcomes) == ["ok", "ok", "timeout"]
+
+
+def test_reads_config_without_touching_it(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "relay_config.json").write_text(json.dumps({"last_port": SIM, "relay_count": 2}))
+    assert relay_cli.main(["status", "all"]) == 0
+    assert [line["relay"] for line in results(capsys.readouterr().out)] == [1, 2]
+
+    (tmp_path / "relay_config.json").write_text("{broken")
+    with pytest.raises(SystemExit):
+        relay_cli.main(["status", "1"])
+    assert (tmp_path / "relay_config.json").read_text() == "{broken"
+    assert not (tmp_path / "relay_config.json.bad").exists()
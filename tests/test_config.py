@@ -0,0 +1,85 @@
+import json
+import os
+import time
+
+import pytest
+
+from relay_config import ConfigStore
+
+DEFAULTS = {"language": "en", "relay_count": 8, "languages": {}}
+
+
+def test_config_prunes_defaults_on_load(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"language": "en", "relay_count": 16, "extra": 1}))
+    config = ConfigStore(str(path), DEFAULTS)
+    assert config.overrides == {"relay_count": 16, "extra": 1}
+    assert config["language"] == "en"
+    assert config.get("missing", 3) == 3
+
+
+def test_config_writes_only_overrides(tmp_path):
+    path = tmp_path / "config.json"
+    config = ConfigStore(str(path), DEFAULTS, delay=60)
+    config.update({"language": "ru", "relay_count": 8})
+    config.flush()
+    assert json.loads(path.read_text()) == {"language": "ru"}
+
+    config.set("language", "en")
+    config.flush()
+    assert json.loads(path.read_text()) == {}
+    assert os.listdir(str(tmp_path)) == ["config.json"]
+
+
+def test_config_flush_failure_keeps_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    config = ConfigStore(str(path), DEFAULTS, delay=60)
+    config.set("language", "ru")
+    config.flush()
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    config.set("relay_count", 4)
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        config.flush()
+    assert json.loads(path.read_text()) == {"language": "ru"}
+    assert config.dirty
+
+
+def test_config_moves_unreadable_file_aside(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{broken")
+    config = ConfigStore(str(path), DEFAULTS)
+    assert config.overrides == {}
+    assert config.load_error
+    assert (tmp_path / "config.json.bad").read_text() == "{broken"
+
+
+def test_config_debounces_writes(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    writes = []
+    config = ConfigStore(str(path), DEFAULTS, delay=0.05)
+    flush = config.flush
+    monkeypatch.setattr(config, "flush", lambda: (writes.append(1), flush()))
+    for count in range(1, 20):
+        config.set("relay_count", count)
+    deadline = time.monotonic() + 2
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert json.loads(path.read_text()) == {"relay_count": 19}
+    assert len(writes) == 1
+
+
+def test_read_only_config_never_touches_file(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{broken")
+    config = ConfigStore(str(path), DEFAULTS, delay=0, read_only=True)
+    assert config.load_error
+    config.set("language", "ru")
+    config.flush()
+    assert config["language"] == "ru"
+    assert os.listdir(str(tmp_path)) == ["config.json"]
+    assert path.read_text() == "{broken"
@@ -0,0 +1,145 @@
+import base64
+import http.client
+import json
+import os
+import queue
+import socket
+import struct
+from urllib.parse import urlencode, urlsplit
+
+from relay_daemon import RemoteWorker
+
+PORT = "sim://?relays=8&baudrate=0"
+
+
+def http_request(url, method, path, body=None):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        payload = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+        connection.request(method, path, payload, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def post(url, path, body):
+    status, data = http_request(url, "POST", path, body)
+    return status, json.loads(data)
+
+
+class WebSocketClient:
+    """Клиент RFC 6455 ровно настолько, насколько нужно тестам: маскированные текстовые кадры"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.socket = socket.create_connection((parts.hostname, parts.port), timeout=5)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.socket.sendall("GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                            "Connection: Upgrade\r\nSec-WebSocket-Key: {}\r\n"
+                            "Sec-WebSocket-Version: 13\r\n\r\n".format(key).encode("ascii"))
+        self.file = self.socket.makefile("rb")
+        assert b" 101 " in self.file.readline()
+        while self.file.readline() not in (b"\r\n", b""):
+            pass
+
+    def send(self, message):
+        payload = json.dumps(message).encode("utf-8")
+        mask = os.urandom(4)
+        masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+        self.socket.sendall(struct.pack("!BB", 0x81, 0x80 | len(payload)) + mask + masked)
+
+    def receive(self):
+        first, second = self.file.read(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.file.read(2))[0]
+        return json.loads(self.file.read(length))
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def test_http_commands_and_states(daemon_url):
+    status, result = post(daemon_url, "/relay", {"port": PORT, "relay": 2, "command": "on", "feedback": True})
+    assert status == 200
+    assert (result["type"], result["relay"], result["state"]) == ("response", 2, "on")
+    assert "latency_ms" in result
+
+    status, result = post(daemon_url, "/relay", {"port": PORT, "relays": "1-3", "command": "status"})
+    assert result["type"] == "batch_response"
+    assert result["states"] == {"1": "off", "2": "on", "3": "off"}
+
+    query = urlencode({"port": PORT, "relay": 2, "command": "off"})
+    status, data = http_request(daemon_url, "GET", "/relay?" + query)
+    assert json.loads(data)["type"] == "sent"
+
+    status, data = http_request(daemon_url, "GET", "/states?" + urlencode({"port": PORT}))
+    assert json.loads(data)["states"]["2"] == "off"
+    assert post(daemon_url, "/open", {"port": PORT})[1] == {"port": PORT, "open": True}
+    status, data = http_request(daemon_url, "GET", "/ports")
+    assert json.loads(data)["open"] == [PORT]
+
+    status, data = http_request(daemon_url, "GET", "/metrics")
+    assert b"relay_commands_total" in data
+
+
+def test_http_rejects_bad_requests(daemon_url):
+    assert post(daemon_url, "/relay", [1, 2])[0] == 400
+    assert http_request(daemon_url, "POST", "/relay", b"{broken")[0] == 400
+    assert post(daemon_url, "/relay", {"port": PORT, "relay": 1, "command": "blink"})[0] == 400
+    assert post(daemon_url, "/relay", {"port": PORT, "relay": 0, "command": "on"})[0] == 400
+    status, result = post(daemon_url, "/relay", {"port": "/dev/does-not-exist", "relay": 1, "command": "on"})
+    assert status == 400 and result["error"]
+    assert http_request(daemon_url, "GET", "/nothing")[0] == 404
+
+
+def test_websocket_requests_and_pushed_events(daemon_url):
+    client = WebSocketClient(daemon_url)
+    try:
+        client.send({"id": 7, "port": PORT, "relay": 4, "command": "on", "feedback": True})
+        messages = []
+        while True:
+            message = client.receive()
+            messages.append(message)
+            if message.get("id") == 7:
+                break
+        assert messages[-1]["type"] == "response" and messages[-1]["state"] == "on"
+        # Подписчик получает и события порта, в том числе открытие и ответ
+        pushed = [message["event"]["type"] for message in messages if "event" in message]
+        assert "opened" in pushed and "response" in pushed
+
+        client.send([1])
+        while True:
+            message = client.receive()
+            if "event" not in message:
+                break
+        assert message["error"]
+    finally:
+        client.close()
+
+
+def test_remote_worker_replays_worker_events(daemon_url):
+    events = queue.Queue()
+    worker = RemoteWorker(daemon_url, events.put)
+    worker.start()
+    try:
+        worker.open(PORT)
+        assert events.get(timeout=5)["type"] == "opened"
+
+        result = queue.Queue()
+        worker.send(5, "on", feedback=True, done=result.put)
+        event = result.get(timeout=5)
+        assert event["type"] == "response" and event["reply"].state == "on"
+
+        worker.send_batch([5, 6], "status", done=result.put)
+        event = result.get(timeout=5)
+        assert event["type"] == "batch_response"
+        assert {relay: reply.state for relay, reply in event["replies"].items()} == {5: "on", 6: "off"}
+
+        worker.poll([5, 6], result.put)
+        assert result.get(timeout=5) is False
+    finally:
+        worker.stop(5)
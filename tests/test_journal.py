@@ -0,0 +1,103 @@
+import os
+import threading
+
+from relay_files import BackgroundWriter, atomic_write
+from relay_journal import StateJournal, read_journal
+
+
+def test_journal_records_only_changes_and_compacts(tmp_path):
+    path = str(tmp_path / "states.jsonl")
+    journal = StateJournal(path, compact_threshold=5)
+    assert journal.record("COM1", 1, "on", t=1)
+    assert not journal.record("COM1", 1, "on", t=2)
+    for index in range(8):
+        journal.record("COM1", 2, "on" if index % 2 else "off", t=10 + index)
+    journal.record("COM2", 1, "off", t=20)
+    journal.close()
+
+    entries = list(read_journal(path))
+    # После сжатия остаются последние состояния и записи, пришедшие после него
+    assert len(entries) < 10
+    assert StateJournal(path).states("COM1") == {1: "on", 2: "on"}
+
+    reloaded = StateJournal(path)
+    assert reloaded.states("COM2") == {1: "off"}
+    assert reloaded.last_change("COM1", 2) == ("on", 17)
+    reloaded.close()
+
+
+def test_journal_skips_damaged_lines(tmp_path):
+    path = tmp_path / "states.jsonl"
+    path.write_text('{"t": 1, "port": "COM1", "relay": 1, "state": "on"}\n{"t": 2, "port": "CO')
+    assert list(read_journal(str(path))) == [(1, "COM1", 1, "on")]
+
+
+def test_compact_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / "states.jsonl")
+    journal = StateJournal(path)
+    journal.record("COM1", 1, "on", t=1)
+    journal.record("COM1", 1, "off", t=2)
+    journal.compact()
+    journal.close()
+    assert os.listdir(str(tmp_path)) == ["states.jsonl"]
+    assert list(read_journal(path)) == [(2, "COM1", 1, "off")]
+
+
+def test_atomic_write_keeps_old_file_on_failure(tmp_path):
+    path = str(tmp_path / "metrics.prom")
+    atomic_write(path, "old\n")
+    try:
+        atomic_write(path, object())
+    except TypeError:
+        pass
+    with open(path) as f:
+        assert f.read() == "old\n"
+    atomic_write(path, b"new\n")
+    assert os.listdir(str(tmp_path)) == ["metrics.prom"]
+    with open(path, "rb") as f:
+        assert f.read() == b"new\n"
+
+
+def test_atomic_write_from_threads_does_not_mix_temporary_files(tmp_path):
+    path = str(tmp_path / "config.json")
+    contents = ["{}\n".format(index) * 1000 for index in range(8)]
+    threads = [threading.Thread(target=atomic_write, args=(path, data)) for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(path) as f:
+        assert f.read() in contents
+    assert os.listdir(str(tmp_path)) == ["config.json"]
+
+
+class ListWriter(BackgroundWriter):
+    def __init__(self):
+        super().__init__(name="ListWriter")
+        self.handled = []
+        self.flushes = []
+        self.closed = False
+        self.release = threading.Event()
+
+    def handle(self, item):
+        self.release.wait(2)
+        self.handled.append(item)
+
+    def flush_file(self):
+        self.flushes.append(len(self.handled))
+
+    def close_file(self):
+        self.closed = True
+
+
+def test_background_writer_flushes_once_per_batch():
+    writer = ListWriter()
+    writer.start()
+    for item in range(5):
+        writer.items.put(item)
+    writer.release.set()
+    writer.close()
+    assert writer.handled == [0, 1, 2, 3, 4]
+    # Все записи, накопленные за время обработки первой, сбрасываются вместе
+    assert len(writer.flushes) <= 2
+    assert writer.closed
@@ -0,0 +1,44 @@
+from relay_log import LogBuffer
+
+
+def test_log_buffer_evicts_to_spill_file(tmp_path):
+    spill = tmp_path / "log.txt"
+    log = LogBuffer(max_lines=3, spill_path=str(spill))
+    for index in range(2):
+        log.append("line {}".format(index))
+    assert log.flush() == (["line 0", "line 1"], 0)
+
+    for index in range(2, 5):
+        log.append("line {}".format(index))
+    lines, drop = log.flush()
+    assert lines == ["line 2", "line 3", "line 4"]
+    assert drop == 2
+    assert [message for _, message in log.lines] == ["line 2", "line 3", "line 4"]
+
+    log.close()
+    spilled = [line.split(" ", 2)[2] for line in spill.read_text().splitlines()]
+    assert spilled == ["line {}".format(index) for index in range(5)]
+
+
+def test_log_buffer_keeps_only_last_lines_of_large_flush():
+    log = LogBuffer(max_lines=3)
+    log.append("old")
+    log.flush()
+    for index in range(10):
+        log.append("line {}".format(index))
+    lines, drop = log.flush()
+    # Виджет удаляет только то, что в нем было, и получает последние строки
+    assert lines == ["line 7", "line 8", "line 9"]
+    assert drop == 1
+    assert log.flush() == ([], 0)
+
+
+def test_log_spill_file_rotates(tmp_path):
+    spill = tmp_path / "log.txt"
+    log = LogBuffer(max_lines=1, spill_path=str(spill), spill_max_bytes=200, spill_backups=2)
+    for index in range(40):
+        log.append("message number {}".format(index))
+        log.flush()
+    log.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["log.txt", "log.txt.1", "log.txt.2"]
+    assert spill.read_text().splitlines()[-1].endswith("message number 39")
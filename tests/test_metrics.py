@@ -0,0 +1,96 @@
+import queue
+import urllib.request
+
+from relay_metrics import BUCKETS, Histogram, RelayMetrics
+from relay_worker import SerialWorker
+
+
+def samples(text):
+    """Значения из текстового формата Prometheus: строка с метрикой и метками -> число"""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            result[name] = float(value)
+    return result
+
+
+def test_histogram_quantiles_use_bucket_bounds():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None
+    for value in (0.0005, 0.004, 0.004, 0.2):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.99) == 0.25
+    histogram.observe(60)
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_render_counts_events_by_port_and_relay():
+    metrics = RelayMetrics()
+    metrics.record({"type": "opened", "port": "COM1"})
+    metrics.record({"type": "opened", "port": "COM1"})
+    metrics.record({"type": "sent", "port": "COM1", "relays": [1, 2]})
+    metrics.record({"type": "batch_response", "port": "COM1", "sent_at": 1.0, "done_at": 1.003,
+                    "replies": {1: None}, "missing": [2], "errors": ["checksum_error"]})
+    metrics.record({"type": "late_response", "port": "COM1", "relay": 2})
+    # Ошибка команды при открытом порте не относится к соединению
+    metrics.record({"type": "error", "port": "COM1", "connected": True})
+    metrics.record({"type": "connection_lost", "port": "COM1"})
+    metrics.record({"type": "open_failed", "port": 'C:\\"odd"'})
+
+    values = samples(metrics.render())
+    assert values['relay_connects_total{port="COM1"}'] == 2
+    assert values['relay_reconnects_total{port="COM1"}'] == 1
+    assert values['relay_commands_total{port="COM1",relay="1"}'] == 1
+    assert values['relay_commands_total{port="COM1",relay="2"}'] == 1
+    assert values['relay_timeouts_total{port="COM1",relay="2"}'] == 1
+    assert values['relay_protocol_errors_total{kind="checksum_error",port="COM1"}'] == 1
+    assert values['relay_late_responses_total{port="COM1",relay="2"}'] == 1
+    assert values['relay_connection_errors_total{port="COM1"}'] == 1
+    assert values['relay_connection_errors_total{port="C:\\\\\\"odd\\""}'] == 1
+    assert values['relay_round_trip_seconds_bucket{port="COM1",relay="1",le="0.0025"}'] == 0
+    assert values['relay_round_trip_seconds_bucket{port="COM1",relay="1",le="0.005"}'] == 1
+    assert values['relay_round_trip_seconds_bucket{port="COM1",relay="1",le="+Inf"}'] == 1
+    assert values['relay_round_trip_seconds_count{port="COM1",relay="1"}'] == 1
+    assert len([name for name in values if name.startswith("relay_round_trip_seconds_bucket")]) \
+        == len(BUCKETS) + 1
+
+
+def test_worker_feeds_metrics_and_statistics_snapshot():
+    metrics = RelayMetrics()
+    events = queue.Queue()
+    worker = SerialWorker(events.put, metrics=metrics)
+    worker.start()
+    try:
+        worker.open("sim://?relays=2&baudrate=0")
+        result = queue.Queue()
+        worker.send(1, "on", feedback=True, done=result.put)
+        worker.send(2, "status", done=result.put)
+        assert [result.get(timeout=5)["type"] for _ in range(2)] == ["response", "response"]
+    finally:
+        worker.stop(5)
+    rows, port_rows = metrics.snapshot()
+    port = "sim://?relays=2&baudrate=0"
+    assert rows[(port, 1)]["relay_commands_total"] == 1
+    assert rows[(port, 1)]["count"] == 1
+    assert rows[(port, 1)]["p50"] <= rows[(port, 1)]["p99"]
+    assert port_rows[port]["relay_connects_total"] == 1
+
+
+def test_http_and_file_export(tmp_path):
+    metrics = RelayMetrics()
+    metrics.record({"type": "opened", "port": "COM1"})
+    server = metrics.serve(0)
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode("utf-8") == metrics.render()
+    finally:
+        metrics.shutdown()
+
+    path = str(tmp_path / "relay.prom")
+    metrics.write_file(path)
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == metrics.render()
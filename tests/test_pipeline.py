@@ -0,0 +1,58 @@
+from fakes import BytePort, frame
+from relay_protocol import RelayClient, RelayPipeline
+
+SIM = "sim://?relays=8&latency=0&baudrate=0"
+
+
+def test_pipeline_matches_replies_by_relay_and_command():
+    client = RelayClient(BytePort())
+    pipeline = RelayPipeline(client, window=4, timeout=1.0)
+    pipeline.submit(1, "status", tag="a")
+    pipeline.submit(2, "on", feedback=True, tag="b")
+    pipeline.submit(3, "off", tag="c")
+    frame_sent, requests, results = pipeline.pump()
+    assert len(requests) == 3
+    assert [(r.relay, r.outcome, r.tag) for r in results] == [(3, "sent", "c")]
+    assert pipeline.outstanding == 2
+
+    # Ответы приходят в другом порядке, чем запросы
+    results = pipeline.process(frame(2, 1) + frame(1, 0))
+    assert [(r.relay, r.command, r.outcome, r.tag) for r in results] == [
+        (2, "on", "ok", "b"), (1, "status", "ok", "a")]
+    assert pipeline.idle
+    assert client.states == {1: "off", 2: "on", 3: "off"}
+
+
+def test_pipeline_expires_requests_and_reports_late_replies():
+    client = RelayClient(BytePort())
+    pipeline = RelayPipeline(client, window=2, timeout=0.5)
+    pipeline.submit(5, "status")
+    pipeline.pump()
+    sent_at = pipeline.in_flight[0].sent_at
+
+    assert pipeline.process(b"", now=sent_at + 0.4) == []
+    results = pipeline.process(b"", now=sent_at + 0.6)
+    assert [(r.relay, r.outcome) for r in results] == [(5, "timeout")]
+    assert pipeline.idle
+
+    results = pipeline.process(frame(5, 1), now=sent_at + 0.7)
+    assert [(r.relay, r.outcome) for r in results] == [(5, "late")]
+    assert client.states[5] == "on"
+
+
+def test_pipeline_window_limits_requests_in_flight():
+    client = RelayClient(BytePort())
+    pipeline = RelayPipeline(client, window=2, timeout=1.0)
+    for relay in (1, 2, 3):
+        pipeline.submit(relay, "status")
+    assert len(pipeline.pump()[1]) == 2
+    assert pipeline.pump() is None
+    pipeline.process(frame(1, 0))
+    assert [r.relay for r in pipeline.pump()[1]] == [3]
+
+
+def test_pipeline_keeps_command_order_on_simulator():
+    with RelayClient.open(SIM, timeout=0.5) as client:
+        results = client.pipeline(8, 0.5).run([(1, "toggle"), (1, "status"), (1, "toggle"), (1, "status")])
+    assert [(r.command, r.outcome, r.reply.state) for r in results] == [
+        ("toggle", "ok", "on"), ("status", "ok", "on"), ("toggle", "ok", "off"), ("status", "ok", "off")]
@@ -0,0 +1,65 @@
+import queue
+import time
+
+from relay_protocol import RelayClient
+from relay_worker import SerialWorker, StatusPoller
+
+
+def start_worker(url):
+    events = queue.Queue()
+    worker = SerialWorker(events.put)
+    worker.start()
+    worker.open(url)
+    assert events.get(timeout=2)["type"] == "opened"
+    return worker, events
+
+
+def test_read_batch_timeout_bounds_whole_batch():
+    client = RelayClient.open("sim://?relays=1&baudrate=0")
+    client.write_batch(range(1, 9), "status")
+    started = time.monotonic()
+    replies = client.read_batch(list(range(1, 9)), "status", timeout=0.1)[1]
+    assert time.monotonic() - started < 0.5
+    assert list(replies) == [1]
+    # Таймаут порта возвращается к прежнему значению
+    assert client.serial_port.timeout == 2
+
+
+def test_sweep_of_missing_relays_does_not_wait_port_timeout():
+    # Одноканальный модуль, а опрашиваются 8 реле, как по умолчанию в приложении
+    worker, events = start_worker("sim://?relays=1&baudrate=9600")
+    try:
+        result = queue.Queue()
+        started = time.monotonic()
+        worker.poll(range(1, 9), result.put)
+        assert result.get(timeout=2) is True
+        assert time.monotonic() - started < worker.TIMEOUT / 2
+        changes = {}
+        while not events.empty():
+            event = events.get()
+            if event["type"] == "state_changed":
+                changes[event["relay"]] = event["state"]
+        assert changes == {1: "off", **{relay: "unknown" for relay in range(2, 9)}}
+    finally:
+        worker.stop()
+
+
+def test_poller_backs_off_while_states_are_stable():
+    worker, events = start_worker("sim://?relays=1&baudrate=0")
+    poller = StatusPoller(worker, range(1, 9), min_interval=0.01, max_interval=0.04)
+    sweeps = []
+    on_sweep = poller.on_sweep
+    poller.on_sweep = lambda changed: (sweeps.append(changed), on_sweep(changed))
+    try:
+        poller.start()
+        deadline = time.monotonic() + 2
+        while len(sweeps) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sweeps[:4] == [True, False, False, False]
+        assert poller.interval == 0.04
+        poller.kick()
+        assert poller.interval == 0.01
+    finally:
+        poller.stop()
+        poller.join(2)
+        worker.stop()
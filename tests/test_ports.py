@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+
+import pytest
+
+import relay_ports
+from relay_ports import PortInfo, PortWatcher, probe_relay
+from relay_protocol import FRAME_SIZE, RelayClient
+from relay_sim import VirtualRelayDevice
+
+
+def ch340(device, serial_number=None):
+    return PortInfo(device, relay_ports.CH340_VID, relay_ports.CH340_PID, serial_number, "CH340", None)
+
+
+@pytest.fixture
+def system(monkeypatch):
+    """Подменяет перечисление портов и признак изменений; считает полные перечисления"""
+    state = {"ports": {}, "signature": frozenset(), "scans": 0}
+
+    def scan_ports():
+        state["scans"] += 1
+        return dict(state["ports"])
+
+    monkeypatch.setattr(relay_ports, "scan_ports", scan_ports)
+    monkeypatch.setattr(relay_ports, "device_signature", lambda: state["signature"])
+    return state
+
+
+def test_poll_rescans_only_when_signature_changes(system):
+    changes = []
+    watcher = PortWatcher(on_change=lambda added, removed: changes.append((added, removed)),
+                          probe=False, use_udev=False)
+    # Первая проверка запоминает признак и перечисляет порты, как при запуске потока
+    watcher.poll()
+    watcher.poll()
+    assert system["scans"] == 1
+
+    system["ports"] = {"/dev/ttyUSB0": ch340("/dev/ttyUSB0", "A1")}
+    system["signature"] = frozenset({"/dev/ttyUSB0"})
+    watcher.poll()
+    watcher.poll()
+    assert system["scans"] == 2
+    assert changes == [(["/dev/ttyUSB0"], [])]
+    assert watcher.find(ch340("/dev/ttyUSB0", "A1")[1:4]) == ["/dev/ttyUSB0"]
+
+    system["ports"] = {}
+    system["signature"] = frozenset()
+    watcher.poll()
+    assert changes[-1] == ([], ["/dev/ttyUSB0"])
+    assert watcher.devices() == []
+
+
+def test_kick_forces_rescan(system):
+    watcher = PortWatcher(probe=False, use_udev=False)
+    watcher.poll()
+    watcher.kick()
+    watcher.poll()
+    assert system["scans"] == 2
+
+
+def test_in_use_port_is_not_probed(system, monkeypatch):
+    probed = []
+    monkeypatch.setattr(relay_ports, "probe_relay", lambda device: probed.append(device) or False)
+    system["ports"] = {"COM3": ch340("COM3"), "COM4": ch340("COM4")}
+    watcher = PortWatcher(in_use=lambda device: device == "COM3", use_udev=False)
+    watcher.rescan()
+    assert probed == ["COM4"]
+    assert watcher.relay_devices() == ["COM3"]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="pseudo-terminal and flock")
+def test_probe_skips_port_held_by_another_client():
+    master, slave = os.openpty()
+    name = os.ttyname(slave)
+    device = VirtualRelayDevice(relays=1, baudrate=0, timeout=0.05)
+
+    def pump():
+        while device.is_open:
+            try:
+                device.write(os.read(master, FRAME_SIZE))
+                os.write(master, device.read(FRAME_SIZE))
+            except OSError:
+                return
+
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        assert probe_relay(name)
+        owner = RelayClient.open(name, timeout=0.3)
+        try:
+            assert not probe_relay(name)
+            assert owner.send(1, "status") is not None
+        finally:
+            owner.close()
+    finally:
+        device.close()
+        os.close(slave)
+        os.close(master)
@@ -0,0 +1,36 @@
+from fakes import BytePort, frame
+from relay_protocol import FrameParser, RelayClient
+
+SIM = "sim://?relays=8&latency=0&baudrate=0"
+
+
+def test_parser_resyncs_after_garbage_and_split_frames():
+    parser = FrameParser()
+    data = b"\x00\x11" + frame(1, 1) + frame(2, 0)
+    replies = parser.feed(data[:5]) + parser.feed(data[5:])
+    assert [(r.relay, r.state) for r in replies] == [(1, "on"), (2, "off")]
+    assert parser.discarded == 2
+    assert not parser.buffer
+
+
+def test_parser_skips_frame_with_lost_byte():
+    frames = b"".join(frame(relay, 1) for relay in range(1, 9))
+    parser = FrameParser()
+    replies = parser.feed(frames[:5] + frames[6:])
+    assert [r.relay for r in replies] == [1, 3, 4, 5, 6, 7, 8]
+
+
+def test_read_batch_recovers_after_lost_byte():
+    frames = b"".join(frame(relay, 1) for relay in range(1, 9))
+    client = RelayClient(BytePort(frames[:5] + frames[6:]))
+    _, replies, errors = client.read_batch(list(range(1, 9)), "status")
+    assert sorted(replies) == [1, 3, 4, 5, 6, 7, 8]
+    assert errors == ["checksum_error"]
+
+
+def test_batch_on_simulator():
+    with RelayClient.open(SIM, timeout=0.5) as client:
+        client.send_batch([1, 2, 3], "on", feedback=True)
+        replies = client.send_batch(list(range(1, 9)), "status")
+    assert {relay: reply.state for relay, reply in replies.items()} == {
+        1: "on", 2: "on", 3: "on", 4: "off", 5: "off", 6: "off", 7: "off", 8: "off"}
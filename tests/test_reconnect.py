@@ -0,0 +1,164 @@
+import queue
+import time
+
+from relay_protocol import RelayClient
+from relay_sim import VirtualRelayDevice
+from relay_worker import SerialWorker
+
+CH340 = (0x1A86, 0x7523, None)
+
+
+class Device(VirtualRelayDevice):
+    """Модуль, который можно выдернуть: порт остается открытым, но запись падает"""
+    unplugged = False
+
+    def write(self, data):
+        if self.unplugged:
+            raise OSError("Device disconnected")
+        return super().write(data)
+
+
+class Bus:
+    """Подключенные устройства по именам портов и их VID/PID/серийные номера"""
+
+    def __init__(self):
+        self.devices = {}
+        self.identities = {}
+
+    def plug(self, port, identity):
+        device = Device(relays=8, baudrate=0, timeout=0.2)
+        self.devices[port] = device
+        self.identities[port] = identity
+        return device
+
+    def unplug(self, port):
+        self.devices.pop(port).unplugged = True
+        del self.identities[port]
+
+    # Интерфейс PortWatcher, которым пользуется воркер
+    def identity(self, port):
+        return self.identities.get(port)
+
+    def find(self, identity):
+        return [port for port, known in self.identities.items() if known == tuple(identity)]
+
+
+class BusWorker(SerialWorker):
+    RECONNECT_INITIAL_DELAY = 0.02
+    TIMEOUT = 0.2
+
+    def __init__(self, bus, on_event, **kwargs):
+        super().__init__(on_event, ports=bus, **kwargs)
+        self.bus = bus
+
+    def _connect(self, port):
+        device = self.bus.devices.get(port)
+        if device is None:
+            raise OSError("No such port: {}".format(port))
+        self.client = RelayClient(device)
+
+
+def wait_for(events, event_type, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    seen = []
+    while time.monotonic() < deadline:
+        try:
+            event = events.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        seen.append(event)
+        if event["type"] == event_type:
+            return event, seen
+    raise AssertionError("no {} event in {}".format(event_type, [e["type"] for e in seen]))
+
+
+def start(bus, port):
+    events = queue.Queue()
+    worker = BusWorker(bus, events.put)
+    worker.start()
+    worker.open(port)
+    wait_for(events, "opened")
+    return worker, events
+
+
+def test_reconnects_and_replays_queued_commands():
+    bus = Bus()
+    bus.plug("A", CH340)
+    worker, events = start(bus, "A")
+    try:
+        bus.unplug("A")
+        worker.send(1, "on")
+        assert wait_for(events, "error")[0]["reconnecting"]
+        worker.send(4, "on")
+        time.sleep(0.1)
+        device = bus.plug("A", CH340)
+        event, _ = wait_for(events, "opened")
+        assert event["reconnected"]
+        wait_for(events, "sent")
+        assert device.states[4] == 1
+    finally:
+        worker.stop(1)
+
+
+def test_does_not_rename_to_another_adapter_without_serial_number():
+    bus = Bus()
+    bus.plug("A", CH340)
+    other = bus.plug("B", CH340)
+    worker, events = start(bus, "A")
+    try:
+        bus.unplug("A")
+        worker.send(1, "on")
+        wait_for(events, "error")
+        worker.send(4, "on")
+        _, seen = wait_for(events, "reconnecting")
+        time.sleep(0.1)
+        assert worker.port == "A"
+        assert "port_renamed" not in [event["type"] for event in seen]
+        assert other.states[4] == 0
+
+        device = bus.plug("A", CH340)
+        wait_for(events, "opened")
+        wait_for(events, "sent")
+        assert device.states[4] == 1
+        assert other.states[4] == 0
+    finally:
+        worker.stop(1)
+
+
+def test_follows_module_with_serial_number_to_new_port():
+    identity = (0x0403, 0x6001, "A1B2")
+    bus = Bus()
+    bus.plug("A", identity)
+    worker, events = start(bus, "A")
+    try:
+        bus.unplug("A")
+        worker.send(1, "on")
+        wait_for(events, "error")
+        worker.send(4, "on")
+        device = bus.plug("C", identity)
+        event, _ = wait_for(events, "port_renamed")
+        assert (event["old_port"], event["new_port"]) == ("A", "C")
+        wait_for(events, "opened")
+        wait_for(events, "sent")
+        assert device.states[4] == 1
+    finally:
+        worker.stop(1)
+
+
+def test_fail_fast_rejects_commands_during_outage():
+    bus = Bus()
+    bus.plug("A", CH340)
+    events = queue.Queue()
+    worker = BusWorker(bus, events.put, outage_policy="fail_fast")
+    worker.start()
+    worker.open("A")
+    try:
+        wait_for(events, "opened")
+        bus.unplug("A")
+        worker.send(1, "on")
+        wait_for(events, "error")
+        worker.send(2, "on")
+        event, _ = wait_for(events, "not_connected")
+        assert event["relay"] == 2
+    finally:
+        worker.stop(1)
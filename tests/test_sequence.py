@@ -0,0 +1,93 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+from relay_daemon import RemoteWorker
+from relay_protocol import batch_frame
+from relay_sequence import build_sequence, load_sequences, run_sequence
+
+PORT = "sim://?relays=8&baudrate=0"
+
+
+def test_pulse_step_and_repeat_specs():
+    pulse = build_sequence("pulse", {"pulse": {"relay": 3, "duration": 0.15}})
+    assert [(step.at, step.relays, step.command) for step in pulse.steps] == [(0.0, [3], "on"),
+                                                                             (0.15, [3], "off")]
+    assert pulse.steps[0].frame == batch_frame([3], "on")
+
+    step = build_sequence("step", {"step": {"relays": "1-3", "interval": 0.05, "command": "off"}})
+    assert [step.at for step in step.steps] == pytest.approx([0.0, 0.05, 0.1])
+    assert step.final_states() == {1: "off", 2: "off", 3: "off"}
+
+    repeated = build_sequence("custom", {"repeat": 2, "period": 1.0,
+                                         "steps": [{"at": 0.5, "relay": 2, "command": "toggle"},
+                                                   {"at": 0, "relays": [1, 2], "command": "on"}]})
+    assert [step.at for step in repeated.steps] == [0.0, 0.5, 1.0, 1.5]
+    assert repeated.duration == 1.5
+    assert repeated.final_states() == {1: "on", 2: "unknown"}
+
+
+@pytest.mark.parametrize("spec", [{}, {"steps": [{"at": 0, "relay": 1, "command": "status"}]},
+                                  {"steps": [{"at": -1, "relay": 1, "command": "on"}]},
+                                  {"repeat": 2, "period": 0, "pulse": {"relay": 1, "duration": 0}}])
+def test_invalid_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        build_sequence("bad", spec)
+
+
+def test_load_sequences(tmp_path):
+    assert load_sequences(str(tmp_path / "missing.json")) == {}
+    path = tmp_path / "sequences.json"
+    path.write_text(json.dumps({"pulse_1": {"pulse": {"relay": 1, "duration": 0.1}}}))
+    assert list(load_sequences(str(path))) == ["pulse_1"]
+
+
+def test_run_sequence_keeps_schedule_and_reports_jitter():
+    sequence = build_sequence("steps", {"step": {"relays": "1-4", "interval": 0.02}})
+    written = []
+    started = time.perf_counter()
+    report = run_sequence(sequence, lambda frame: written.append((time.perf_counter(), frame)),
+                          threading.Event())
+    assert report.completed == report.steps == 4
+    assert [frame for _, frame in written] == [step.frame for step in sequence.steps]
+    # Шаги отсчитываются от начала (с запасом lead), поэтому ни один не уходит раньше плана
+    assert all(at - started >= step.at for (at, _), step in zip(written, sequence.steps))
+    assert report.jitter_max < 0.05
+    assert report.jitter_mean <= report.jitter_p99 <= report.jitter_max
+
+
+def test_cancel_stops_sequence():
+    sequence = build_sequence("pulse", {"pulse": {"relay": 1, "duration": 5}})
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    started = time.perf_counter()
+    report = run_sequence(sequence, lambda frame: None, cancel)
+    assert time.perf_counter() - started < 1
+    assert (report.steps, report.completed) == (2, 1)
+
+
+def test_remote_worker_runs_sequence_on_daemon(daemon_url):
+    events = queue.Queue()
+    worker = RemoteWorker(daemon_url, events.put)
+    worker.start()
+    try:
+        worker.open(PORT)
+        assert events.get(timeout=5)["type"] == "opened"
+        sequence = build_sequence("pulse", {"steps": [{"at": 0, "relays": "1-2", "command": "on"},
+                                                      {"at": 0.02, "relay": 1, "command": "off"}]})
+        result = queue.Queue()
+        worker.run_sequence(sequence, done=result.put)
+        event = result.get(timeout=5)
+        assert event["type"] == "sequence_done"
+        assert (event["report"].steps, event["report"].completed) == (2, 2)
+        assert event["states"] == {1: "off", 2: "on"}
+
+        # Шаги выполнил сервис на своем порту
+        worker.send_batch([1, 2], "status", done=result.put)
+        replies = result.get(timeout=5)["replies"]
+        assert {relay: reply.state for relay, reply in replies.items()} == {1: "off", 2: "on"}
+    finally:
+        worker.stop(5)
@@ -0,0 +1,34 @@
+import relay_bench
+from relay_protocol import RelayClient, expects_response
+
+SIM = "sim://?relays=8&latency=0&baudrate=0"
+
+
+def test_simulator_replies_match_expects_response():
+    with RelayClient.open(SIM, timeout=0.1) as client:
+        for command in ("on", "off", "toggle", "status"):
+            for feedback in (False, True):
+                client.write_batch([1], command, feedback)
+                replied = bool(client.read(4))
+                assert replied == expects_response(command, feedback), (command, feedback)
+
+
+def test_simulator_ignores_relays_it_does_not_have():
+    with RelayClient.open("sim://?relays=1&latency=0&baudrate=0", timeout=0.05) as client:
+        assert client.status(1) is not None
+        assert client.status(2) is None
+
+
+def test_bench_passes_on_healthy_simulator(capsys):
+    assert relay_bench.main(["--port", SIM, "--count", "40", "--min-rate", "100", "--max-p99-ms", "50",
+                             "--max-errors", "0"]) == 0
+    assert len(capsys.readouterr().out.splitlines()) == 3
+
+
+def test_bench_gate_fails_on_dead_link(capsys):
+    dead = "sim://?relays=8&latency=0&baudrate=0&drop=1"
+    assert relay_bench.main(["--port", dead, "--modes", "pipeline", "--count", "8", "--timeout", "0.02",
+                             "--max-p99-ms", "20"]) == 1
+    assert relay_bench.main(["--port", dead, "--modes", "sequential", "--count", "4", "--timeout", "0.02",
+                             "--max-errors", "0"]) == 1
+    assert '"commands_per_s": 0.0' in capsys.readouterr().out
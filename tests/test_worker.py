@@ -0,0 +1,94 @@
+import queue
+
+import pytest
+
+from relay_sequence import build_sequence
+from relay_worker import SerialWorker
+
+
+class FastWorker(SerialWorker):
+    # Реле вне 1..relays симулятора не отвечают; ждать их полный таймаут незачем
+    TIMEOUT = 0.3
+
+
+@pytest.fixture(params=[0, 4], ids=["direct", "pipelined"])
+def worker(request):
+    events = queue.Queue()
+    worker = FastWorker(events.put, pipeline_window=request.param)
+    worker.events = events
+    worker.start()
+    worker.open("sim://?relays=8&baudrate=0")
+    assert events.get(timeout=2)["type"] == "opened"
+    yield worker
+    worker.stop(2)
+    assert not worker.is_alive()
+
+
+def call(submit, *args, **kwargs):
+    """Ставит команду в очередь воркера и ждет ее итогового события"""
+    result = queue.Queue()
+    submit(*args, done=result.put, **kwargs)
+    return result.get(timeout=2)
+
+
+def test_command_events_carry_reply_and_timing(worker):
+    event = call(worker.send, 3, "on", feedback=True)
+    assert event["type"] == "response"
+    assert event["port"] == "sim://?relays=8&baudrate=0"
+    assert (event["reply"].relay, event["reply"].state) == (3, "on")
+    assert event["queued_at"] <= event["sent_at"] <= event["done_at"]
+
+    assert call(worker.send, 3, "off")["type"] == "sent"
+    assert call(worker.send, 3, "status")["reply"].state == "off"
+    assert call(worker.send, 9, "status")["type"] == "no_response"
+
+
+def test_batch_reports_replies_and_missing_relays(worker):
+    event = call(worker.send_batch, [1, 2, 9], "on", feedback=True)
+    assert event["type"] == "batch_response"
+    assert sorted(event["replies"]) == [1, 2]
+    assert event["missing"] == [9]
+
+
+def test_failed_command_keeps_thread_and_port(worker):
+    event = call(worker.send_batch, [1, 0], "on")
+    assert event["type"] == "error"
+    assert event["connected"]
+    assert worker.is_alive() and worker.is_open()
+    assert call(worker.send, 1, "status")["type"] == "response"
+
+
+def test_failed_poll_still_calls_back(worker, monkeypatch):
+    def broken(relays, previous):
+        raise RuntimeError("sweep failed")
+
+    monkeypatch.setattr(worker, "_sweep", broken)
+    result = queue.Queue()
+    worker.poll([1], result.put)
+    assert result.get(timeout=2) is False
+    monkeypatch.undo()
+    worker.poll([1], result.put)
+    assert result.get(timeout=2) is True
+
+
+def test_sequence_updates_known_states(worker):
+    sequence = build_sequence("pulse", {"steps": [{"at": 0, "relays": "1-2", "command": "on"},
+                                                  {"at": 0.01, "relays": "2", "command": "off"}]})
+    event = call(worker.run_sequence, sequence)
+    assert event["type"] == "sequence_done"
+    assert event["states"] == {1: "on", 2: "off"}
+    assert call(worker.send, 1, "status")["reply"].state == "on"
+
+
+def test_commands_without_port_are_rejected():
+    events = queue.Queue()
+    worker = FastWorker(events.put)
+    worker.start()
+    try:
+        assert call(worker.send, 1, "on")["type"] == "not_connected"
+        worker.open("/dev/does-not-exist")
+        types = [events.get(timeout=2)["type"] for _ in range(2)]
+        assert types == ["not_connected", "open_failed"]
+        assert not worker.is_open()
+    finally:
+        worker.stop(2)